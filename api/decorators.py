@@ -2,11 +2,19 @@
 """Django views for the api application"""
 
 # Imports
+import asyncio
 from functools import wraps
 from django.http import HttpResponseNotAllowed
 
 def http_method_decorator(http_methods):
     def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_async_view(request, *args, **kwargs):
+                if request.method not in http_methods:
+                    return HttpResponseNotAllowed(http_methods)
+                return await view_func(request, *args, **kwargs)
+            return _wrapped_async_view
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
             if request.method not in http_methods:
@@ -18,6 +26,9 @@ def http_method_decorator(http_methods):
 def require_get(view_func):
     return http_method_decorator(['GET'])(view_func)
 
+def require_safe(view_func):
+    return http_method_decorator(['GET', 'HEAD'])(view_func)
+
 def require_post(view_func):
     return http_method_decorator(['POST'])(view_func)
 
@@ -0,0 +1,30 @@
+"""Django command compressing the octrees of the pointclouds of the data directory, see PointcloudCompressor"""
+
+# Imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from api.scripts.available_pointclouds_helper import AvailablePointcloudsHelper
+from api.scripts.pointcloud_compressor import PointcloudCompressor, POINTCLOUD_COMPRESSION_WORKERS, POINTCLOUD_COMPRESSION_QUALITY
+
+# Main
+class Command(BaseCommand):
+    help = 'Re-encode the octrees of the pointclouds of the data directory with Brotli, then publish them and update the catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scans', nargs='*', help='Scans to compress (spotYYYYmmddHHMMSS), all the uncompressed ones by default')
+        parser.add_argument('--workers', type=int, default=POINTCLOUD_COMPRESSION_WORKERS,
+                            help='Number of processes (POINTCLOUD_COMPRESSION_WORKERS, or the number of CPUs, by default)')
+        parser.add_argument('--quality', type=int, choices=range(12), default=POINTCLOUD_COMPRESSION_QUALITY, metavar='0-11',
+                            help='Brotli quality, from 0 (fastest) to 11 (smallest)')
+
+    def handle(self, *args, **options):
+        def progress(scan, index, total, report):
+            self.stdout.write(f'[{index}/{total}] {scan}: {report["nodes"]} nodes, {report["bytes"] / 2**20:.1f} MiB to '
+                              f'{report["compressed_bytes"] / 2**20:.1f} MiB (ratio {report["ratio"]:.2f}) in {report["seconds"]:.1f} s')
+
+        compressor = PointcloudCompressor(workers=options['workers'], quality=options['quality'])
+        reports = compressor.compress_all(options['scans'] or None, progress)
+        if reports:
+            AvailablePointcloudsHelper().collect_new_pointclouds(pointclouds=[report['scan'] for report in reports])
+        self.stdout.write(self.style.SUCCESS(f'{len(reports)} pointclouds compressed'))
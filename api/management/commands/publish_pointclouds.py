@@ -0,0 +1,24 @@
+"""Django command publishing the new pointclouds of the data directory, see PointcloudPublisher"""
+
+# Imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from api.scripts.available_pointclouds_helper import AvailablePointcloudsHelper
+from api.scripts.pointcloud_compressor import PointcloudCompressor
+
+# Main
+class Command(BaseCommand):
+    help = ('Publish the new or changed pointclouds of the data directory to the static files, and update the catalog, '
+            'after recovering the octrees whose compression was interrupted.')
+
+    def handle(self, *args, **options):
+        for scan in PointcloudCompressor().recover_all():
+            self.stdout.write(f'{scan}: recovered from an interrupted compression')
+
+        def progress(scan, index, total, published):
+            self.stdout.write(f'[{index}/{total}] {scan}: {published["method"]}, {published["files"]} files, '
+                              f'{published["bytes"] / 2**20:.1f} MiB')
+
+        published = AvailablePointcloudsHelper().collect_new_pointclouds(progress)
+        self.stdout.write(self.style.SUCCESS(f'{len(published)} pointclouds published'))
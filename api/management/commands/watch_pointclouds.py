@@ -0,0 +1,48 @@
+"""Django command watching the data directory for new pointclouds, see PointcloudWatcher"""
+
+# Imports
+from django.core.management.base import BaseCommand
+
+# Local imports
+from api.scripts.available_pointclouds_helper import AvailablePointcloudsHelper
+from api.scripts.pointcloud_compressor import PointcloudCompressor, POINTCLOUD_COMPRESSION
+from api.scripts.pointcloud_watcher import PointcloudWatcher, POINTCLOUD_WATCHER, POINTCLOUD_WATCHER_SETTLE_TIME, POINTCLOUD_WATCHER_POLL_INTERVAL, INOTIFY, POLL
+
+# Main
+class Command(BaseCommand):
+    help = ('Watch the data directory, and publish, catalog and render the thumbnail of each new pointcloud once complete, '
+            'compressing its octree first if POINTCLOUD_COMPRESSION is brotli. Does nothing if POINTCLOUD_WATCHER is off.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['off', INOTIFY, POLL], default=POINTCLOUD_WATCHER,
+                            help='inotify (falling back to polling if not available), poll, or off (POINTCLOUD_WATCHER by default)')
+        parser.add_argument('--settle-time', type=float, default=POINTCLOUD_WATCHER_SETTLE_TIME,
+                            help='Time without change after which a scan is registered, in seconds')
+        parser.add_argument('--compression', choices=['off', 'brotli'], default=POINTCLOUD_COMPRESSION,
+                            help='Compression of the octrees of the new pointclouds (POINTCLOUD_COMPRESSION by default)')
+        parser.add_argument('--poll-interval', type=float, default=POINTCLOUD_WATCHER_POLL_INTERVAL,
+                            help='Time between two polls of the data directory, in seconds')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'off':
+            self.stdout.write('The pointcloud watcher is off, set POINTCLOUD_WATCHER to inotify or poll to enable it')
+            return
+
+        compressor = PointcloudCompressor() if options['compression'] == 'brotli' else None
+
+        def register(pointclouds):
+            if compressor is not None:
+                for report in compressor.compress_all(pointclouds):
+                    self.stdout.write(f'{report["scan"]}: compressed with ratio {report["ratio"]:.2f} in {report["seconds"]:.1f} s')
+            helper = AvailablePointcloudsHelper()
+            published = helper.collect_new_pointclouds(pointclouds=pointclouds)
+            for pointcloud in pointclouds:
+                self.stdout.write(f'{pointcloud}: {"published" if pointcloud in published else "catalog updated"}')
+            helper.render_thumbnails(pointclouds)
+
+        watcher = PointcloudWatcher(register, mode=options['mode'], settle_time=options['settle_time'],
+                                    poll_interval=options['poll_interval'])
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
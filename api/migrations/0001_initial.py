@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Pointcloud',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('size', models.BigIntegerField(db_index=True, null=True)),
+                ('points', models.BigIntegerField(db_index=True, null=True)),
+                ('min_x', models.FloatField(null=True)),
+                ('min_y', models.FloatField(null=True)),
+                ('min_z', models.FloatField(null=True)),
+                ('max_x', models.FloatField(null=True)),
+                ('max_y', models.FloatField(null=True)),
+                ('max_z', models.FloatField(null=True)),
+                ('metadata_mtime_ns', models.BigIntegerField(null=True)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['min_x', 'max_x', 'min_y', 'max_y', 'min_z', 'max_z'], name='pointcloud_bounding_box')],
+            },
+        ),
+    ]
@@ -1,3 +1,37 @@
 from django.db import models
 
-# Create your models here.
+class Pointcloud(models.Model):
+    """
+    A Potree pointcloud of the data directory, indexed by the catalog scan.
+      Statistics are read from the metadata.json of the scan, they are null until the conversion is complete.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    timestamp = models.DateTimeField(db_index=True)
+    size = models.BigIntegerField(null=True, db_index=True)
+    points = models.BigIntegerField(null=True, db_index=True)
+    min_x = models.FloatField(null=True)
+    min_y = models.FloatField(null=True)
+    min_z = models.FloatField(null=True)
+    max_x = models.FloatField(null=True)
+    max_y = models.FloatField(null=True)
+    max_z = models.FloatField(null=True)
+    # Modification time of metadata.json when it was read, in nanoseconds, to only read changed scans again
+    metadata_mtime_ns = models.BigIntegerField(null=True)
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['min_x', 'max_x', 'min_y', 'max_y', 'min_z', 'max_z'], name='pointcloud_bounding_box'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def bounding_box(self):
+        """
+        Returns the bounding box as [[min x, min y, min z], [max x, max y, max z]], or None if unknown.
+        """
+        if self.min_x is None:
+            return None
+        return [[self.min_x, self.min_y, self.min_z], [self.max_x, self.max_y, self.max_z]]
@@ -4,11 +4,20 @@
 
 # Imports
 import os
+import json
 import datetime
-import time
-import subprocess
+
+## Django
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 # Local imports
+from api.models import Pointcloud
+from .pointcloud_publisher import PointcloudPublisher, POTREE_DIR
+from .pointcloud_thumbnails import PointcloudThumbnails
+
 ## Environment variables
 from dotenv import load_dotenv
 from manage import ROOT_DIR
@@ -19,18 +28,22 @@ load_dotenv(ROOT_DIR + '.env')
 import logging
 logger = logging.getLogger(__name__)
 
+# Variables
+PAGE_SIZE = 50
+# Files of the Potree conversion of a scan
+POTREE_FILES = ['metadata.json', 'hierarchy.bin', 'octree.bin']
+
 # Main
 class AvailablePointcloudsHelper(object):
     """
     Helper class for available pointclouds.
+      The pointclouds are listed from the Pointcloud catalog, which the scan keeps up to date with the directory.
     """
     def __init__(self):
         """
-        Construct a new AvailablePointcloudsHelper instance by making an inventory
-        of the current content of the /staticfiles/pointclouds directory.
+        Construct a new AvailablePointcloudsHelper instance for the /staticfiles/data directory.
         """
         self.pointclouds_dir = os.path.join(ROOT_DIR, 'staticfiles', 'data')
-        self.pointclouds = self._get_available_pointclouds()
 
     def _get_available_pointclouds(self):
         """
@@ -42,37 +55,199 @@ class AvailablePointcloudsHelper(object):
                 if entry.is_dir() and entry.name.startswith('spot'):
                     pointclouds.append(entry.name)
         return pointclouds
-    
-    def list(self):
+
+    def _parse_timestamp(self, pointcloud):
         """
-        Outputs the list of available pointclouds, sorted by date.
+        Helper method to read the date of a pointcloud from its name (spotYYYYmmddHHMMSS), None if it is not a date.
         """
-        pointcloud_context = []
-        for pointcloud in self.pointclouds:
-            timestamp = pointcloud[4:]
-            try:
-                date = datetime.datetime.strptime(timestamp, "%Y%m%d%H%M%S")
-                formatted_date = date.strftime("%d/%m/%Y %H:%M:%S")
-                unix_timestamp = int(time.mktime(date.timetuple()))
-                pointcloud_object = {
-                    'name': pointcloud,
-                    'date': formatted_date,
-                    'timestamp': unix_timestamp
-                }
-                pointcloud_context.append(pointcloud_object)
-            except ValueError:
-                continue
-        
-        sorted_pointclouds = sorted(pointcloud_context, key=lambda x: x['timestamp'], reverse=True)
-        return sorted_pointclouds
+        try:
+            date = datetime.datetime.strptime(pointcloud[4:], "%Y%m%d%H%M%S")
+        except ValueError:
+            return None
+        return timezone.make_aware(date)
 
-    def collect_new_pointclouds(self):
+    def _read_metadata(self, pointcloud):
         """
-        Executes the `collectstatic` function to refresh the list of available pointclouds.
+        Helper method to read the statistics of a pointcloud from its Potree metadata.json.
         """
+        potree_dir = os.path.join(self.pointclouds_dir, pointcloud, POTREE_DIR)
         try:
-            subprocess.run(['python', 'manage.py', 'collectstatic', '--noinput'], check=True)
-            logger.info('collectstatic command executed successfully.')
-        except subprocess.CalledProcessError as e:
-            logger.error(f'An error occurred while executing collectstatic command: {e}')
+            with open(os.path.join(potree_dir, 'metadata.json')) as f:
+                metadata = json.load(f)
+            bounding_box_min, bounding_box_max = metadata['boundingBox']['min'], metadata['boundingBox']['max']
+            fields = {
+                'points': metadata['points'],
+                'size': sum(os.path.getsize(os.path.join(potree_dir, name)) for name in POTREE_FILES),
+            }
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Unable to read the metadata of the {pointcloud} pointcloud: {e}')
+            return {}
+        for axis, minimum, maximum in zip('xyz', bounding_box_min, bounding_box_max):
+            fields['min_' + axis] = minimum
+            fields['max_' + axis] = maximum
+        return fields
+
+    def scan(self, pointclouds=None):
+        """
+        Updates the catalog with the pointclouds added, changed or removed since the last scan.
+          Only the metadata.json of the new or changed pointclouds (by modification time) are read.
+
+            Parameters:
+                pointclouds (list): Only update these pointclouds, e.g. the ones a watcher saw change, all by default
+
+            Returns:
+                updated, removed (int, int): Number of pointclouds added or updated, and removed
+        """
+        known = Pointcloud.objects.all()
+        if pointclouds is None:
+            available = self._get_available_pointclouds()
+        else:
+            known = known.filter(name__in=pointclouds)
+            available = [pointcloud for pointcloud in pointclouds if os.path.isdir(os.path.join(self.pointclouds_dir, pointcloud))]
+        known = dict(known.values_list('name', 'metadata_mtime_ns'))
+        found = set()
+        updated = 0
+        with transaction.atomic():
+            for pointcloud in available:
+                timestamp = self._parse_timestamp(pointcloud)
+                if timestamp is None:
+                    continue
+                found.add(pointcloud)
+                try:
+                    metadata_mtime_ns = os.stat(os.path.join(self.pointclouds_dir, pointcloud, POTREE_DIR, 'metadata.json')).st_mtime_ns
+                except OSError:
+                    # Not converted yet
+                    metadata_mtime_ns = None
+                if pointcloud in known and known[pointcloud] == metadata_mtime_ns:
+                    continue
+                fields = {'size': None, 'points': None, 'min_x': None, 'min_y': None, 'min_z': None,
+                          'max_x': None, 'max_y': None, 'max_z': None}
+                if metadata_mtime_ns is not None:
+                    fields.update(self._read_metadata(pointcloud))
+                Pointcloud.objects.update_or_create(name=pointcloud, defaults=dict(
+                    timestamp=timestamp, metadata_mtime_ns=metadata_mtime_ns, **fields))
+                updated += 1
+            removed = set(known) - found
+            if removed:
+                Pointcloud.objects.filter(name__in=removed).delete()
+        thumbnails = PointcloudThumbnails(self.pointclouds_dir)
+        for pointcloud in removed:
+            thumbnails.remove(pointcloud)
+        if updated or removed:
+            logger.info(f'Pointcloud catalog: {updated} added or updated, {len(removed)} removed')
+        return updated, len(removed)
+
+    def _parse_bound(self, value, end=False):
+        """
+        Helper method to read a date or datetime bound of a date range, a date covering the whole day.
+        """
+        if not value:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is not None:
+            bound = datetime.datetime.combine(day, datetime.time.max if end else datetime.time.min)
+        else:
+            bound = parse_datetime(value)
+            if bound is None:
+                raise ValueError(f'Invalid date: {value}')
+        if timezone.is_naive(bound):
+            bound = timezone.make_aware(bound)
+        return bound
+
+    def list(self, start=None, end=None, page=1, page_size=PAGE_SIZE):
+        """
+        Outputs a page of the available pointclouds, sorted by date, most recent first.
+
+            Parameters:
+                start (str): Only the pointclouds from this date or datetime (ISO 8601)
+                end (str): Only the pointclouds until this date or datetime (ISO 8601), included
+                page (int): Number of the page, from 1
+                page_size (int): Number of pointclouds per page, None for all of them in a single page
+
+            Returns:
+                pointclouds (dict): Total count, page number, number of pages and pointclouds of the page.
+                  The thumbnail of a pointcloud is its version (hex), None until rendered, which is then scheduled
+        """
+        if not Pointcloud.objects.exists():
+            # First use of the catalog, e.g. on a new database
+            self.scan()
+        pointclouds = Pointcloud.objects.all()
+        start, end = self._parse_bound(start), self._parse_bound(end, end=True)
+        if start is not None:
+            pointclouds = pointclouds.filter(timestamp__gte=start)
+        if end is not None:
+            pointclouds = pointclouds.filter(timestamp__lte=end)
+
+        if page_size is None:
+            page_size = max(pointclouds.count(), 1)
+        paginator = Paginator(pointclouds, page_size)
+        pointcloud_page = paginator.get_page(page)
+        thumbnails = PointcloudThumbnails(self.pointclouds_dir)
+        results = []
+        for pointcloud in pointcloud_page:
+            date = timezone.localtime(pointcloud.timestamp)
+            thumbnail = None
+            if pointcloud.metadata_mtime_ns is not None:
+                if thumbnails.cached(pointcloud.name, pointcloud.metadata_mtime_ns):
+                    thumbnail = f'{pointcloud.metadata_mtime_ns:x}'
+                else:
+                    thumbnails.schedule(pointcloud.name, pointcloud.metadata_mtime_ns)
+            results.append({
+                'name': pointcloud.name,
+                'date': date.strftime("%d/%m/%Y %H:%M:%S"),
+                'timestamp': int(pointcloud.timestamp.timestamp()),
+                'size': pointcloud.size,
+                'points': pointcloud.points,
+                'bounding_box': pointcloud.bounding_box,
+                'thumbnail': thumbnail,
+            })
+        return {
+            'count': paginator.count,
+            'page': pointcloud_page.number,
+            'pages': paginator.num_pages,
+            'results': results,
+        }
 
+    def collect_new_pointclouds(self, progress=None, pointclouds=None):
+        """
+        Publishes the new pointclouds placed in the data folder to the static files, and updates the catalog.
+
+            Parameters:
+                progress (callable): Called after each published pointcloud, see PointcloudPublisher.publish
+                pointclouds (list): Only collect these pointclouds, all by default
+
+            Returns:
+                published (dict): Method, number of files and bytes of each pointcloud published
+        """
+        published = PointcloudPublisher(target_dir=self.pointclouds_dir).publish(progress, pointclouds)
+        self.scan(pointclouds)
+        return published
+
+    def render_thumbnails(self, pointclouds=None):
+        """
+        Renders the missing or outdated thumbnails of the converted pointclouds of the catalog, e.g. as they are collected.
+
+            Parameters:
+                pointclouds (list): Only render the thumbnails of these pointclouds, all by default
+
+            Returns:
+                rendered (list): Names of the pointclouds whose thumbnail was rendered
+        """
+        thumbnails = PointcloudThumbnails(self.pointclouds_dir)
+        catalog = Pointcloud.objects.filter(metadata_mtime_ns__isnull=False)
+        if pointclouds is not None:
+            catalog = catalog.filter(name__in=pointclouds)
+        rendered = []
+        for name, signature in catalog.values_list('name', 'metadata_mtime_ns'):
+            if thumbnails.cached(name, signature):
+                continue
+            try:
+                thumbnails.render(name, signature)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f'Unable to render the thumbnail of the {name} pointcloud: {e}')
+                continue
+            rendered.append(name)
+        return rendered
@@ -14,6 +14,7 @@
 #   * Added instruction to sit before shutting down in the hello_spot function
 #   * Removed the 'Capture an image' instruction
 #   * Added a state_client argument to the hello_spot function
+#   * Reused the pooled robot session instead of creating a new SDK and robot on each execution
 # See https://github.com/boston-dynamics/spot-sdk/blob/master/python/examples/hello_spot/hello_spot.py for the original file
 
 #!/usr/bin/env python
@@ -33,6 +34,7 @@ from bosdyn.client.robot_command import RobotCommandBuilder, RobotCommandClient,
 
 # Local imports
 from .estop_nogui import EstopNoGui
+from .robot_session_pool import robot_session_pool
 
 ## Environment variables
 from dotenv import load_dotenv
@@ -134,20 +136,35 @@ def main():
     # Setup logging
     bosdyn.client.util.setup_logging(BOSDYN_CLIENT_LOGGING_VERBOSE)
     
-    # Create robot object
-    sdk = bosdyn.client.create_standard_sdk("HelloSpot")
-    robot = sdk.create_robot(ROBOT_IP)
-    bosdyn.client.util.authenticate(robot, getSpotAuthentication())
+    # Get the pooled robot session
+    username, password = getSpotAuthentication()
+    session = robot_session_pool.get(ROBOT_IP, username=username, password=password, client_name="HelloSpot")
+    try:
+        return run_hello_spot(session)
+    finally:
+        robot_session_pool.release(session)
+
+def run_hello_spot(session):
+    """
+    Runs Hello, Spot! on a pooled robot session.
+
+        Parameters:
+            session (RobotSession): Session returned by the pool
+
+        Returns:
+            (boolean): The function execution was successful (or not)
+    """
+    robot = session.robot
 
     # Create estop client for the robot
-    estop_client = robot.ensure_client(EstopClient.default_service_name)
+    estop_client = session.ensure_client(EstopClient.default_service_name)
 
     # Create nogui estop
     estop_nogui = EstopNoGui(estop_client, int(ROBOT_ESTOP_TIMEOUT_SEC), "Estop NoGUI")
     estop_nogui.allow()
 
     # Create robot state client for the robot
-    state_client = robot.ensure_client(RobotStateClient.default_service_name)
+    state_client = session.ensure_client(RobotStateClient.default_service_name)
 
     try:
         hello_spot(robot, state_client)
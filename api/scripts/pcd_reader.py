@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Reader of the PCD pointclouds exported by Spot-SLAM, a fixed number of points at a time"""
+
+
+# Imports
+import os
+import glob
+
+import numpy as np
+
+# Variables
+# Points read at once
+CHUNK_POINTS = 65536
+ASCII, BINARY = 'ascii', 'binary'
+PCD_TYPES = {
+    ('F', 4): '<f4', ('F', 8): '<f8',
+    ('I', 1): 'i1', ('I', 2): '<i2', ('I', 4): '<i4', ('I', 8): '<i8',
+    ('U', 1): 'u1', ('U', 2): '<u2', ('U', 4): '<u4', ('U', 8): '<u8',
+}
+
+
+# Main
+def find_pcd(scan_dir):
+    """
+    Returns the path to the PCD pointcloud of a scan, in its directory or its pointclouds directory, None if there is none.
+    """
+    paths = sorted(glob.glob(os.path.join(glob.escape(scan_dir), '*.pcd')) + glob.glob(os.path.join(glob.escape(scan_dir), 'pointclouds', '*.pcd')))
+    return paths[0] if paths else None
+
+class PcdReader(object):
+    """
+    Reads a PCD file, ascii or binary, by chunks of points. The binary_compressed encoding, compressed as a whole, is not supported.
+    """
+    def __init__(self, path):
+        """
+        Construct a new PcdReader instance, reading the header of a PCD file.
+
+            Raises:
+                OSError: if the file cannot be read
+                ValueError: if the header is invalid, or the encoding not supported
+        """
+        self.path = path
+        header = {}
+        with open(path, 'rb') as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    raise ValueError('No DATA line in the PCD header')
+                line = line.decode('ascii', errors='replace').strip()
+                if not line or line.startswith('#'):
+                    continue
+                key, _, value = line.partition(' ')
+                header[key.upper()] = value.split()
+                if key.upper() == 'DATA':
+                    break
+            self.data_offset = f.tell()
+        try:
+            self.fields = header['FIELDS']
+            sizes = [int(size) for size in header['SIZE']]
+            types = header['TYPE']
+            counts = [int(count) for count in header.get('COUNT', ['1'] * len(self.fields))]
+            self.points = int(header['POINTS'][0]) if 'POINTS' in header else int(header['WIDTH'][0]) * int(header['HEIGHT'][0])
+            self.data = header['DATA'][0].lower()
+            # Fields named by index, as PCL names all its padding fields _
+            self.dtype = np.dtype([(str(index), PCD_TYPES[(kind.upper(), size)], (count,))
+                                   for index, (kind, size, count) in enumerate(zip(types, sizes, counts))])
+        except (KeyError, IndexError) as e:
+            raise ValueError(f'Invalid PCD header: {e}')
+        if self.data not in (ASCII, BINARY):
+            raise ValueError(f'Unsupported PCD encoding {self.data}')
+        if not all(name in self.fields for name in 'xyz'):
+            raise ValueError('The PCD has no x, y and z fields')
+
+    def field(self, chunk, name):
+        """
+        Returns the values of a field of a chunk, (n, count), None if the PCD has no such field.
+        """
+        if name not in self.fields:
+            return None
+        return chunk[str(self.fields.index(name))]
+
+    def chunks(self, chunk_points=CHUNK_POINTS):
+        """
+        Yields the points of the file, chunk_points at a time.
+
+            Yields:
+                points (np.ndarray): Points, of dtype self.dtype
+        """
+        remaining = self.points
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset)
+            while remaining > 0:
+                count = min(chunk_points, remaining)
+                if self.data == BINARY:
+                    data = f.read(count * self.dtype.itemsize)
+                    points = np.frombuffer(data, dtype=self.dtype, count=len(data) // self.dtype.itemsize)
+                else:
+                    points = self._parse_lines([f.readline() for _ in range(count)])
+                if len(points) == 0:
+                    break
+                remaining -= len(points)
+                yield points
+
+    def _parse_lines(self, lines):
+        """
+        Helper method to parse lines of an ascii PCD.
+        """
+        lines = [line for line in lines if line.strip()]
+        points = np.zeros(len(lines), dtype=self.dtype)
+        if not lines:
+            return points
+        values = np.array(b' '.join(lines).split(), dtype=float).reshape(len(lines), -1)
+        column = 0
+        for index, name in enumerate(self.fields):
+            field = points.dtype[str(index)]
+            count = field.shape[0]
+            if name in ('rgb', 'rgba') and field.base == np.dtype('<f4'):
+                # Colors packed in the bits of a float
+                points[str(index)] = values[:, column:column + count].astype('<f4')
+            else:
+                points[str(index)] = values[:, column:column + count]
+            column += count
+        return points
+
+    def bounds(self):
+        """
+        Returns the bounds of the points, reading the whole file.
+
+            Returns:
+                bounds (tuple): (min, max) corners
+        """
+        minimum, maximum = np.full(3, np.inf), np.full(3, -np.inf)
+        for chunk in self.chunks():
+            xyz = self.xyz(chunk)
+            if len(xyz):
+                minimum, maximum = np.minimum(minimum, xyz.min(axis=0)), np.maximum(maximum, xyz.max(axis=0))
+        if not np.all(np.isfinite(minimum)):
+            return np.zeros(3), np.zeros(3)
+        return minimum, maximum
+
+    def xyz(self, chunk):
+        """
+        Returns the coordinates of a chunk of points, (n, 3).
+        """
+        return np.column_stack([self.field(chunk, name)[:, 0] for name in 'xyz']).astype(float)
+
+    def colors(self, chunk):
+        """
+        Returns the 8 bit colors of a chunk of points, (n, 3), from their packed rgb or rgba field, None if there is none.
+        """
+        packed = self.field(chunk, 'rgb')
+        if packed is None:
+            packed = self.field(chunk, 'rgba')
+        if packed is None:
+            return None
+        packed = np.ascontiguousarray(packed[:, 0])
+        if packed.dtype.itemsize != 4:
+            return None
+        packed = packed.view('<u4')
+        return np.column_stack([(packed >> np.uint32(shift)) & np.uint32(0xff) for shift in (16, 8, 0)])
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+"""Re-encoding of the Potree octrees of the data directory with Brotli, which Potree decodes in its workers"""
+
+
+# Imports
+import os
+import json
+import time
+import shutil
+import concurrent.futures
+
+import brotli
+import numpy as np
+
+# Local imports
+from .pointcloud_publisher import DATA_DIR, POTREE_DIR
+
+## Environment variables
+from dotenv import load_dotenv
+from manage import ROOT_DIR
+
+load_dotenv(ROOT_DIR + '.env')
+
+# Compression of the new scans by the pointcloud watcher: brotli, or off
+POINTCLOUD_COMPRESSION = os.getenv('POINTCLOUD_COMPRESSION', 'off')
+POINTCLOUD_COMPRESSION_QUALITY = int(os.getenv('POINTCLOUD_COMPRESSION_QUALITY', 5))
+POINTCLOUD_COMPRESSION_WORKERS = int(os.getenv('POINTCLOUD_COMPRESSION_WORKERS', 0)) or os.cpu_count()
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Variables
+DEFAULT, BROTLI = 'DEFAULT', 'BROTLI'
+# Suffixes of the directories of the compressed octree before it is swapped in, and of the original one while it is
+PARTIAL, ORIGINAL = '.partial', '.original'
+# Original bytes of the nodes compressed by a task of the pool
+BATCH_SIZE = 32 * 2**20
+"""
+Records of hierarchy.bin: type (2 for a proxy to another chunk of the hierarchy), child mask, number of points,
+and offset and size of the node in octree.bin (of the chunk in hierarchy.bin for a proxy)
+"""
+HIERARCHY_RECORD = np.dtype([('type', 'u1'), ('childMask', 'u1'), ('numPoints', '<u4'), ('byteOffset', '<i8'), ('byteSize', '<i8')])
+PROXY = 2
+ATTRIBUTE_TYPES = {
+    'int8': 'i1', 'int16': '<i2', 'int32': '<i4', 'int64': '<i8',
+    'uint8': 'u1', 'uint16': '<u2', 'uint32': '<u4', 'uint64': '<u8',
+    'float': '<f4', 'double': '<f8',
+}
+"""
+Attributes Morton coded by the Brotli encoding, as named by PotreeConverter and its decoder
+"""
+POSITION_NAMES = ('position', 'POSITION_CARTESIAN')
+COLOR_NAMES = ('rgb', 'rgba', 'RGBA')
+
+
+# Main
+def _spread(values):
+    """
+    Spreads the bits of 16 bit values to every third bit of 48 bit values, for Morton codes.
+    """
+    values = values.astype(np.uint64)
+    for shift, mask in [(32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                        (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)]:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def _compact(values):
+    """
+    Gathers every third bit of 48 bit values back to 16 bit values, the inverse of _spread.
+    """
+    values = values & np.uint64(0x1249249249249249)
+    for shift, mask in [(2, 0x10c30c30c30c30c3), (4, 0x100f00f00f00f00f), (8, 0x1f0000ff0000ff),
+                        (16, 0x1f00000000ffff), (32, 0x1fffff)]:
+        values = (values ^ (values >> np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def _interleave(channels):
+    """
+    Interleaves the bits of three 16 bit channels, the first one in the lowest bit.
+    """
+    return _spread(channels[:, 0]) | (_spread(channels[:, 1]) << np.uint64(1)) | (_spread(channels[:, 2]) << np.uint64(2))
+
+def _deinterleave(codes):
+    """
+    Splits Morton codes back to three 16 bit channels, the inverse of _interleave.
+    """
+    return np.stack([_compact(codes >> np.uint64(shift)) for shift in range(3)], axis=1)
+
+def point_dtype(attributes):
+    """
+    Returns the numpy dtype of a point of the DEFAULT encoding, from the attributes of metadata.json.
+      The fields are named by index, as nothing prevents two attributes from having the same name.
+    """
+    fields = []
+    for index, attribute in enumerate(attributes):
+        if attribute['type'] not in ATTRIBUTE_TYPES:
+            raise ValueError(f'Unsupported type {attribute["type"]} of the {attribute["name"]} attribute')
+        if (attribute['name'] in POSITION_NAMES + COLOR_NAMES) and attribute['numElements'] != 3:
+            raise ValueError(f'Unsupported number of elements {attribute["numElements"]} of the {attribute["name"]} attribute')
+        fields.append((str(index), ATTRIBUTE_TYPES[attribute['type']], (attribute['numElements'],)))
+    dtype = np.dtype(fields)
+    if dtype.itemsize != sum(attribute['size'] for attribute in attributes):
+        raise ValueError('The sizes of the attributes do not match their types')
+    return dtype
+
+def encode_node(data, attributes, quality=POINTCLOUD_COMPRESSION_QUALITY):
+    """
+    Encodes a node from the DEFAULT encoding (points one after the other) to the BROTLI one: the values of each
+      attribute one after the other, positions as 128 bit Morton codes of their upper and lower 16 bits, colors as
+      64 bit Morton codes, all compressed with Brotli.
+
+        Parameters:
+            data (bytes): Node in the DEFAULT encoding
+            attributes (list): Attributes of the points, from metadata.json
+
+        Returns:
+            data (bytes): Node in the BROTLI encoding
+    """
+    points = np.frombuffer(data, dtype=point_dtype(attributes))
+    buffers = []
+    for index, attribute in enumerate(attributes):
+        values = points[str(index)]
+        if attribute['name'] in POSITION_NAMES:
+            values = values.view(np.uint32)
+            codes = np.empty((len(points), 2), dtype='<u8')
+            codes[:, 0] = _interleave(values >> np.uint32(16))
+            codes[:, 1] = _interleave(values & np.uint32(0xffff))
+            buffers.append(codes.tobytes())
+        elif attribute['name'] in COLOR_NAMES:
+            buffers.append(_interleave(values.astype(np.uint64)).astype('<u8').tobytes())
+        else:
+            buffers.append(np.ascontiguousarray(values).tobytes())
+    return brotli.compress(b''.join(buffers), quality=quality)
+
+def decode_node(data, attributes, num_points):
+    """
+    Decodes a node from the BROTLI encoding back to the DEFAULT one, the inverse of encode_node.
+    """
+    data = brotli.decompress(data)
+    points = np.zeros(num_points, dtype=point_dtype(attributes))
+    offset = 0
+    for index, attribute in enumerate(attributes):
+        field = str(index)
+        if attribute['name'] in POSITION_NAMES:
+            codes = np.frombuffer(data, dtype='<u8', count=2 * num_points, offset=offset).reshape(-1, 2)
+            values = (_deinterleave(codes[:, 0]) << np.uint64(16)) | _deinterleave(codes[:, 1])
+            points[field] = values.astype(np.uint32).view(np.int32)
+            offset += 16 * num_points
+        elif attribute['name'] in COLOR_NAMES:
+            codes = np.frombuffer(data, dtype='<u8', count=num_points, offset=offset)
+            points[field] = _deinterleave(codes)
+            offset += 8 * num_points
+        else:
+            dtype = points.dtype[field]
+            points[field] = np.frombuffer(data, dtype=dtype.base, count=num_points * dtype.shape[0], offset=offset).reshape(-1, *dtype.shape)
+            offset += dtype.itemsize * num_points
+    if offset != len(data):
+        raise ValueError(f'{len(data) - offset} unexpected bytes in the node')
+    return points.tobytes()
+
+def _compress_nodes(octree_path, nodes, attributes, quality):
+    """
+    Helper function of the pool compressing nodes of an octree.
+
+        Parameters:
+            nodes (list): (offset, size) of the nodes in octree.bin
+
+        Returns:
+            nodes (list): Nodes in the BROTLI encoding
+    """
+    compressed = []
+    with open(octree_path, 'rb') as f:
+        for offset, size in nodes:
+            f.seek(offset)
+            compressed.append(encode_node(f.read(size), attributes, quality))
+    return compressed
+
+def _verify_nodes(octree_path, compressed_path, nodes, attributes):
+    """
+    Helper function of the pool checking that compressed nodes, read back from their file, decode to the original ones.
+
+        Parameters:
+            nodes (list): (offset, size, compressed offset, compressed size, number of points) of the nodes
+
+        Returns:
+            verified (bool): Whether all the nodes match
+    """
+    with open(octree_path, 'rb') as original, open(compressed_path, 'rb') as compressed:
+        for offset, size, compressed_offset, compressed_size, num_points in nodes:
+            original.seek(offset)
+            compressed.seek(compressed_offset)
+            try:
+                decoded = decode_node(compressed.read(compressed_size), attributes, num_points)
+            except (brotli.error, ValueError):
+                return False
+            if decoded != original.read(size):
+                return False
+    return True
+
+class PointcloudCompressor(object):
+    """
+    Rewrites the octree of a scan node by node in the Brotli encoding, in a pool of processes, and updates its
+      hierarchy and metadata. The rewrite goes to a .partial sibling of the Potree directory, which only replaces the
+      original directory once every node read back from it decodes to the original node, by two renames, so that
+      readers never see the new octree with the old metadata or the other way round. A swap interrupted by a crash
+      is completed by recover, before any compression.
+    """
+    def __init__(self, source_dir=None, workers=POINTCLOUD_COMPRESSION_WORKERS, quality=POINTCLOUD_COMPRESSION_QUALITY):
+        """
+        Construct a new PointcloudCompressor instance.
+
+            Parameters:
+                source_dir (str): Directory of the scans, /web/static/data by default
+                workers (int): Number of processes, 1 to compress in the current process
+                quality (int): Brotli quality, from 0 (fastest) to 11 (smallest)
+        """
+        self.source_dir = source_dir or DATA_DIR
+        self.workers = workers
+        self.quality = quality
+
+    def _map(self, function, *iterables):
+        """
+        Helper method to map a function in the pool of processes, or in the current process for a single worker.
+        """
+        if self.workers <= 1:
+            yield from map(function, *iterables)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            yield from executor.map(function, *iterables)
+
+    def _read_metadata(self, potree_dir):
+        """
+        Helper method to read the metadata of a scan.
+        """
+        with open(os.path.join(potree_dir, 'metadata.json')) as f:
+            return json.load(f)
+
+    def pending(self, scans=None):
+        """
+        Returns the converted scans whose octree is not compressed yet.
+
+            Parameters:
+                scans (list): Only consider these scans, all the scans of the data directory by default
+        """
+        if scans is None:
+            scans = self._scans()
+        pending = []
+        for scan in scans:
+            try:
+                metadata = self._read_metadata(os.path.join(self.source_dir, scan, POTREE_DIR))
+            except (OSError, ValueError):
+                continue
+            if metadata.get('encoding', DEFAULT) == DEFAULT:
+                pending.append(scan)
+        return pending
+
+    def compress(self, scan):
+        """
+        Compresses the octree of a scan.
+
+            Parameters:
+                scan (str): Name of the scan (spotYYYYmmddHHMMSS)
+
+            Returns:
+                report (dict): scan, number of nodes, bytes of the octree before and after, ratio, and time in seconds
+
+            Raises:
+                ValueError: if the scan is already compressed, its attributes are not supported,
+                  or the compressed octree does not decode to the original one
+        """
+        start = time.monotonic()
+        self.recover(scan)
+        potree_dir = os.path.join(self.source_dir, scan, POTREE_DIR)
+        metadata = self._read_metadata(potree_dir)
+        if metadata.get('encoding', DEFAULT) != DEFAULT:
+            raise ValueError(f'The octree of {scan} is already in the {metadata["encoding"]} encoding')
+        attributes = metadata['attributes']
+        point_dtype(attributes)
+
+        octree_path = os.path.join(potree_dir, 'octree.bin')
+        partial_dir, original_dir = potree_dir + PARTIAL, potree_dir + ORIGINAL
+        partial_paths = {name: os.path.join(partial_dir, name) for name in ['octree.bin', 'hierarchy.bin', 'metadata.json']}
+        with open(os.path.join(potree_dir, 'hierarchy.bin'), 'rb') as f:
+            hierarchy = np.frombuffer(f.read(), dtype=HIERARCHY_RECORD).copy()
+        # Every record of hierarchy.bin, whichever its chunk, which is not a proxy is a node
+        nodes = np.flatnonzero((hierarchy['type'] != PROXY) & (hierarchy['byteSize'] > 0))
+        nodes = nodes[np.argsort(hierarchy['byteOffset'][nodes], kind='stable')]
+        batches = self._batches(nodes, hierarchy['byteSize'])
+        original = hierarchy.copy()
+
+        try:
+            os.makedirs(partial_dir)
+            offset = 0
+            with open(partial_paths['octree.bin'], 'wb') as f:
+                compressed_batches = self._map(_compress_nodes, [octree_path] * len(batches),
+                                               [[(int(hierarchy['byteOffset'][node]), int(hierarchy['byteSize'][node])) for node in batch] for batch in batches],
+                                               [attributes] * len(batches), [self.quality] * len(batches))
+                for batch, compressed_nodes in zip(batches, compressed_batches):
+                    for node, data in zip(batch, compressed_nodes):
+                        f.write(data)
+                        hierarchy['byteOffset'][node] = offset
+                        hierarchy['byteSize'][node] = len(data)
+                        offset += len(data)
+                self._sync(f)
+
+            verified = self._map(_verify_nodes, [octree_path] * len(batches), [partial_paths['octree.bin']] * len(batches),
+                                 [[(int(original['byteOffset'][node]), int(original['byteSize'][node]), int(hierarchy['byteOffset'][node]),
+                                    int(hierarchy['byteSize'][node]), int(hierarchy['numPoints'][node])) for node in batch] for batch in batches],
+                                 [attributes] * len(batches))
+            if not all(list(verified)):
+                raise ValueError(f'The compressed octree of {scan} does not decode to the original one, it is left unchanged')
+
+            with open(partial_paths['hierarchy.bin'], 'wb') as f:
+                f.write(hierarchy.tobytes())
+                self._sync(f)
+            metadata['encoding'] = BROTLI
+            with open(partial_paths['metadata.json'], 'w') as f:
+                json.dump(metadata, f, indent='\t')
+                self._sync(f)
+            # The other files of the conversion, e.g. its log, are kept
+            for entry in os.scandir(potree_dir):
+                if entry.is_file() and entry.name not in partial_paths:
+                    shutil.copy2(entry.path, os.path.join(partial_dir, entry.name))
+            self._sync_dir(partial_dir)
+
+            # Once the original directory is renamed, the complete partial one is the scan, recover finishes the swap
+            os.rename(potree_dir, original_dir)
+            os.rename(partial_dir, potree_dir)
+            self._sync_dir(os.path.dirname(potree_dir))
+            shutil.rmtree(original_dir)
+        finally:
+            if os.path.isdir(original_dir):
+                self.recover(scan)
+            elif os.path.isdir(partial_dir):
+                shutil.rmtree(partial_dir)
+
+        original_bytes = int(original['byteSize'][nodes].sum())
+        report = {
+            'scan': scan,
+            'nodes': len(nodes),
+            'bytes': original_bytes,
+            'compressed_bytes': offset,
+            'ratio': original_bytes / offset if offset else 1.0,
+            'seconds': time.monotonic() - start,
+        }
+        logger.info(f'Compressed the octree of {scan}: {len(nodes)} nodes, {original_bytes / 2**20:.1f} MiB to '
+                    f'{offset / 2**20:.1f} MiB (ratio {report["ratio"]:.2f}) in {report["seconds"]:.1f} s')
+        return report
+
+    def _sync(self, f):
+        """
+        Helper method to flush a file to the disk, before it replaces another one.
+        """
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _sync_dir(self, path):
+        """
+        Helper method to flush the entries of a directory to the disk, after renames.
+        """
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def recover(self, scan):
+        """
+        Recovers the Potree directory of a scan from an interrupted compression: a swap interrupted between its two
+          renames is completed, as the partial directory is complete by then, and leftover directories are removed.
+
+            Parameters:
+                scan (str): Name of the scan (spotYYYYmmddHHMMSS)
+
+            Returns:
+                recovered (bool): Whether there was something to recover
+        """
+        potree_dir = os.path.join(self.source_dir, scan, POTREE_DIR)
+        partial_dir, original_dir = potree_dir + PARTIAL, potree_dir + ORIGINAL
+        recovered = False
+        if os.path.isdir(original_dir):
+            recovered = True
+            if not os.path.isdir(potree_dir):
+                os.rename(partial_dir if os.path.isdir(partial_dir) else original_dir, potree_dir)
+                self._sync_dir(os.path.dirname(potree_dir))
+            if os.path.isdir(original_dir):
+                shutil.rmtree(original_dir)
+        if os.path.isdir(partial_dir):
+            recovered = True
+            shutil.rmtree(partial_dir)
+        if recovered:
+            logger.warning(f'Recovered the octree of {scan} from an interrupted compression')
+        return recovered
+
+    def recover_all(self):
+        """
+        Recovers the scans of the data directory from interrupted compressions, see recover.
+
+            Returns:
+                recovered (list): Scans recovered
+        """
+        return [scan for scan in self._scans() if self.recover(scan)]
+
+    def _scans(self):
+        """
+        Helper method to list the scans of the data directory.
+        """
+        if not os.path.isdir(self.source_dir):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.source_dir) if entry.is_dir() and entry.name.startswith('spot'))
+
+    def _batches(self, nodes, sizes):
+        """
+        Helper method to group consecutive nodes in batches of about BATCH_SIZE bytes, the tasks of the pool.
+        """
+        batches, batch, batch_size = [], [], 0
+        for node in nodes:
+            batch.append(node)
+            batch_size += int(sizes[node])
+            if batch_size >= BATCH_SIZE:
+                batches.append(batch)
+                batch, batch_size = [], 0
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def compress_all(self, scans=None, progress=None):
+        """
+        Compresses the octrees of the scans which are not compressed yet.
+
+            Parameters:
+                scans (list): Only consider these scans, all the scans of the data directory by default
+                progress (callable): Called after each scan with (scan, index, total, report)
+
+            Returns:
+                reports (list): Reports of the compressed scans
+        """
+        for scan in (self._scans() if scans is None else scans):
+            try:
+                self.recover(scan)
+            except OSError as e:
+                logger.error(f'Unable to recover the octree of {scan}: {e}')
+        pending = self.pending(scans)
+        reports = []
+        for index, scan in enumerate(pending, 1):
+            try:
+                report = self.compress(scan)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f'Unable to compress the octree of {scan}: {e}')
+                continue
+            reports.append(report)
+            if progress is not None:
+                progress(scan, index, len(pending), report)
+        return reports
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Helper for serving the Potree files of the pointclouds, with byte ranges and cache validators"""
+
+
+# Imports
+import os
+import re
+import asyncio
+
+# Local imports
+from .pointcloud_publisher import DATA_DIR, POTREE_DIR
+
+## Environment variables
+from dotenv import load_dotenv
+from manage import ROOT_DIR
+
+load_dotenv(ROOT_DIR + '.env')
+
+# Internal nginx location of the data directory, the transfers are handed off to nginx when set
+POINTCLOUD_ACCEL_REDIRECT = os.getenv('POINTCLOUD_ACCEL_REDIRECT', '')
+
+# Variables
+"""
+Files a Potree viewer loads, and their content types
+"""
+POTREE_FILES = {
+    'metadata.json': 'application/json',
+    'hierarchy.bin': 'application/octet-stream',
+    'octree.bin': 'application/octet-stream',
+}
+CHUNK_SIZE = 256 * 1024
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+# Main
+def pointcloud_file(name, file_name, data_dir=DATA_DIR):
+    """
+    Returns the path to a Potree file of a pointcloud, None if it is not one.
+
+        Parameters:
+            name (str): Name of the pointcloud (spotYYYYmmddHHMMSS)
+            file_name (str): metadata.json, hierarchy.bin or octree.bin
+            data_dir (str): Directory of the pointclouds
+
+        Returns:
+            path (str): Path to the file, relative to the data directory
+    """
+    if file_name not in POTREE_FILES or not name.startswith('spot') or os.sep in name or name != os.path.basename(name):
+        return None
+    return os.path.join(name, POTREE_DIR, file_name)
+
+def etag(stat):
+    """
+    Returns a strong ETag of a file, changed whenever it is replaced or written.
+    """
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def parse_range(header, size):
+    """
+    Parses a Range header, for a single range of bytes only, as Potree requests.
+
+        Parameters:
+            header (str): Value of the Range header
+            size (int): Size of the file
+
+        Returns:
+            byte_range (tuple): (first, last) bytes, None to send the whole file (no range, or several ranges),
+              False if the range cannot be satisfied
+    """
+    match = RANGE_PATTERN.match(header.replace(' ', '')) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last bytes of the file
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        return False
+    return first, last
+
+def file_chunks(path, offset, length, chunk_size=CHUNK_SIZE):
+    """
+    Yields a part of a file, a chunk at a time.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+async def aiterate(chunks):
+    """
+    Yields the chunks of a synchronous iterator, running it in an executor.
+      Served through ASGI, a synchronous iterator would be read entirely in memory first.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+def afile_chunks(path, offset, length, chunk_size=CHUNK_SIZE):
+    """
+    Yields a part of a file, a chunk at a time, reading in an executor.
+    """
+    return aiterate(file_chunks(path, offset, length, chunk_size))
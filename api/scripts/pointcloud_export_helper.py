@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+"""Helper for exporting points of the pointclouds to LAS, PLY or NPY files, streamed chunk by chunk"""
+
+
+# Imports
+import io
+import os
+import struct
+import datetime
+import tempfile
+
+import numpy as np
+
+# Local imports
+from .potree_octree import PotreeOctree
+from .pcd_reader import PcdReader, find_pcd
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Variables
+"""
+Points as exported: coordinates as integers, times the scale plus the offset of the writer, intensity and 16 bit colors
+"""
+EXPORT_DTYPE = np.dtype([('X', '<i4'), ('Y', '<i4'), ('Z', '<i4'), ('intensity', '<u2'), ('red', '<u2'), ('green', '<u2'), ('blue', '<u2')])
+# Bytes of the encoded points yielded at once
+CHUNK_SIZE = 4 * 2**20
+# Bytes of the points of the nodes crossing the faces of an extract box kept in memory, the rest spilling to a temporary file
+SPOOL_SIZE = 64 * 2**20
+# Scale of the integer coordinates of the points of a PCD, when the scan has no octree to take it from
+PCD_SCALE = 0.001
+SOFTWARE = 'spot-utils'
+
+
+# Main
+class PointCountError(Exception):
+    """
+    Raised when the points exported do not match the number announced in the header, the file being sent is then aborted.
+    """
+    pass
+
+class PointcloudWriter(object):
+    """
+    Encodes points to a file format, a header first then chunks of points, so that files of any size are streamed.
+      The number of points must be known up front, as the formats record it in their header.
+    """
+    extension = None
+    content_type = 'application/octet-stream'
+    record_size = None
+    # Whether the header records the bounds of the points
+    bounds_in_header = False
+
+    def __init__(self, scale, offset, bounds):
+        """
+        Construct a new PointcloudWriter instance.
+
+            Parameters:
+                scale (np.ndarray): Scale of the integer coordinates of the points
+                offset (np.ndarray): Offset of the integer coordinates of the points
+                bounds (tuple): (min, max) corners of a box containing the points
+        """
+        self.scale = np.asarray(scale, dtype=float)
+        self.offset = np.asarray(offset, dtype=float)
+        self.bounds = tuple(np.asarray(bound, dtype=float) for bound in bounds)
+
+    def header(self, count):
+        """
+        Returns the header of a file of a number of points.
+        """
+        raise NotImplementedError
+
+    def encode(self, points):
+        """
+        Returns the encoding of points, of EXPORT_DTYPE.
+        """
+        raise NotImplementedError
+
+    def size(self, count):
+        """
+        Returns the size of a file of a number of points, in bytes.
+        """
+        return len(self.header(count)) + count * self.record_size
+
+    def coordinates(self, points):
+        """
+        Helper method returning the coordinates of points, (n, 3).
+        """
+        return np.column_stack([points['X'], points['Y'], points['Z']]) * self.scale + self.offset
+
+class LasWriter(PointcloudWriter):
+    """
+    LAS 1.2 files, with points of data format 2 (coordinates, intensity and color).
+    """
+    extension = 'las'
+    content_type = 'application/vnd.las'
+    record_size = 26
+    bounds_in_header = True
+    HEADER = struct.Struct('<4sHH16sBB32s32sHHHIIBHI5I3d3d6d')
+    RECORD = np.dtype([('X', '<i4'), ('Y', '<i4'), ('Z', '<i4'), ('intensity', '<u2'), ('returns', 'u1'), ('classification', 'u1'),
+                       ('scan_angle', 'i1'), ('user_data', 'u1'), ('point_source_id', '<u2'), ('red', '<u2'), ('green', '<u2'), ('blue', '<u2')])
+
+    def header(self, count):
+        today = datetime.date.today()
+        (min_x, min_y, min_z), (max_x, max_y, max_z) = self.bounds
+        return self.HEADER.pack(b'LASF', 0, 0, b'\0' * 16, 1, 2, SOFTWARE.encode(), SOFTWARE.encode(),
+                                today.timetuple().tm_yday, today.year, self.HEADER.size, self.HEADER.size, 0, 2,
+                                self.record_size, count, count, 0, 0, 0, 0, *self.scale, *self.offset,
+                                max_x, min_x, max_y, min_y, max_z, min_z)
+
+    def encode(self, points):
+        records = np.zeros(len(points), dtype=self.RECORD)
+        for field in EXPORT_DTYPE.names:
+            records[field] = points[field]
+        # First return of a single one
+        records['returns'] = 0b001001
+        return records.tobytes()
+
+class PlyWriter(PointcloudWriter):
+    """
+    Binary PLY files, with double coordinates, 8 bit colors and intensity.
+    """
+    extension = 'ply'
+    record_size = 29
+    RECORD = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'), ('intensity', '<u2')])
+
+    def header(self, count):
+        return (f'ply\nformat binary_little_endian 1.0\ncomment generated by {SOFTWARE}\nelement vertex {count}\n'
+                'property double x\nproperty double y\nproperty double z\n'
+                'property uchar red\nproperty uchar green\nproperty uchar blue\nproperty ushort intensity\n'
+                'end_header\n').encode()
+
+    def encode(self, points):
+        records = np.zeros(len(points), dtype=self.RECORD)
+        coordinates = self.coordinates(points)
+        for axis, field in enumerate('xyz'):
+            records[field] = coordinates[:, axis]
+        for field in ['red', 'green', 'blue']:
+            # 16 bit colors are scaled down, 8 bit ones stored in 16 bits are kept, as the viewer does
+            records[field] = np.where(points[field] > 255, points[field] // 256, points[field])
+        records['intensity'] = points['intensity']
+        return records.tobytes()
+
+class NpyWriter(PointcloudWriter):
+    """
+    NumPy .npy files, of a structured array with double coordinates, intensity and 16 bit colors.
+    """
+    extension = 'npy'
+    record_size = 32
+    RECORD = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('intensity', '<u2'), ('red', '<u2'), ('green', '<u2'), ('blue', '<u2')])
+
+    def header(self, count):
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(self.RECORD), 'fortran_order': False, 'shape': (count,)})
+        return header.getvalue()
+
+    def encode(self, points):
+        records = np.zeros(len(points), dtype=self.RECORD)
+        coordinates = self.coordinates(points)
+        for axis, field in enumerate('xyz'):
+            records[field] = coordinates[:, axis]
+        for field in ['intensity', 'red', 'green', 'blue']:
+            records[field] = points[field]
+        return records.tobytes()
+
+WRITERS = {writer.extension: writer for writer in [LasWriter, PlyWriter, NpyWriter]}
+
+def parse_box(minimum, maximum):
+    """
+    Parses the corners of an axis-aligned box, as x,y,z strings.
+
+        Returns:
+            box (tuple): (min, max) corners
+
+        Raises:
+            ValueError: if a corner is not 3 numbers, or the box is empty
+    """
+    corners = []
+    for corner in [minimum, maximum]:
+        values = [float(value) for value in (corner or '').split(',')]
+        if len(values) != 3 or not np.all(np.isfinite(values)):
+            raise ValueError(f'Invalid corner {corner}, expected x,y,z')
+        corners.append(np.array(values))
+    if np.any(corners[0] > corners[1]):
+        raise ValueError('The minimum corner of the box exceeds its maximum corner')
+    return tuple(corners)
+
+def octree_points(octree, points):
+    """
+    Converts points read from a Potree octree to EXPORT_DTYPE, with the scale and offset of the octree.
+    """
+    exported = np.zeros(len(points), dtype=EXPORT_DTYPE)
+    position = points[octree.position]
+    for axis, field in enumerate('XYZ'):
+        exported[field] = position[:, axis]
+    if octree.intensity is not None:
+        exported['intensity'] = points[octree.intensity].reshape(len(points))
+    if octree.color is not None:
+        for channel, field in enumerate(['red', 'green', 'blue']):
+            exported[field] = points[octree.color][:, channel]
+    return exported
+
+def encoded_chunks(writer, count, chunks, chunk_size=CHUNK_SIZE):
+    """
+    Yields a file of points: its header, then the encoded points, gathered in chunks of about chunk_size bytes.
+
+        Parameters:
+            writer (PointcloudWriter): Writer of the format of the file
+            count (int): Number of points, written to the header
+            chunks (iterable): Arrays of points, of EXPORT_DTYPE
+
+        Raises:
+            PointCountError: The points changed while they were being sent, before the file is complete,
+              as the header and the length of the response cannot be changed any more
+    """
+    yield writer.header(count)
+    buffers, size, written = [], 0, 0
+    for points in chunks:
+        written += len(points)
+        if written > count:
+            raise PointCountError(f'More points exported than the {count} announced in the header')
+        buffers.append(writer.encode(points))
+        size += len(buffers[-1])
+        if size >= chunk_size:
+            yield b''.join(buffers)
+            buffers, size = [], 0
+    if written != count:
+        raise PointCountError(f'{written} points exported instead of the {count} announced in the header')
+    if buffers:
+        yield b''.join(buffers)
+
+def box_export(octree, box, max_level, writer_class, spool_size=SPOOL_SIZE):
+    """
+    Prepares the export of the points of an octree in a box. The nodes inside the box are counted from the hierarchy,
+      and only read while the file is sent. The nodes crossing the faces of the box are read once, up front, to count
+      their points in the box, which are kept until sent, spilling to a temporary file past spool_size bytes.
+
+        Parameters:
+            octree (PotreeOctree): Octree of the scan, closed once the export is sent or closed
+            box (tuple): (min, max) corners of the box
+            max_level (int): Deepest level exported, all by default
+            writer_class (type): PointcloudWriter of the format of the export
+
+        Returns:
+            export (tuple): (writer, count, chunks), chunks yielding the encoded file, header first
+    """
+    # The extract is bounded by the box and the points of the scan, as its header records
+    points_min, points_max = octree.points_bounds
+    writer = writer_class(octree.scale, octree.offset, (np.maximum(box[0], points_min), np.minimum(box[1], points_max)))
+    inner, count = [], 0
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        for node in octree.nodes(box, max_level):
+            if node.num_points == 0:
+                continue
+            if octree.encloses(box, node):
+                inner.append(node)
+                count += node.num_points
+            else:
+                points = octree.read_in_box(node, box)
+                spool.write(octree_points(octree, points).tobytes())
+                count += len(points)
+    except BaseException:
+        spool.close()
+        octree.close()
+        raise
+
+    def points():
+        for node in inner:
+            yield octree_points(octree, octree.read(node))
+        spool.seek(0)
+        while True:
+            data = spool.read(CHUNK_SIZE // EXPORT_DTYPE.itemsize * EXPORT_DTYPE.itemsize)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=EXPORT_DTYPE)
+
+    def chunks():
+        try:
+            yield from encoded_chunks(writer, count, points())
+        finally:
+            spool.close()
+            octree.close()
+
+    return writer, count, chunks()
+
+def pcd_points(reader, points, scale, offset):
+    """
+    Converts points read from a PCD file to EXPORT_DTYPE, quantized to a scale and offset.
+    """
+    exported = np.zeros(len(points), dtype=EXPORT_DTYPE)
+    position = np.round((reader.xyz(points) - offset) / scale)
+    for axis, field in enumerate('XYZ'):
+        exported[field] = np.clip(position[:, axis], -2**31, 2**31 - 1)
+    intensity = reader.field(points, 'intensity')
+    if intensity is not None:
+        exported['intensity'] = np.clip(np.round(intensity[:, 0].astype(float)), 0, 2**16 - 1)
+    colors = reader.colors(points)
+    if colors is not None:
+        # 8 bit colors stored in 16 bits, as LAS expects them
+        for channel, field in enumerate(['red', 'green', 'blue']):
+            exported[field] = colors[:, channel].astype('<u2') * 256
+    return exported
+
+def scan_export(scan_dir, potree_dir, writer_class):
+    """
+    Prepares the export of all the points of a scan: from its original PCD when it has a readable one, else from its octree,
+      node by node, inner nodes included as Potree stores every point in a single node. Either way, the points are read
+      a chunk at a time, and their number is known up front, from the header of the PCD or the metadata of the octree.
+
+        Parameters:
+            scan_dir (str): Directory of the scan
+            potree_dir (str): Directory of its Potree conversion, relative to scan_dir
+            writer_class (type): PointcloudWriter of the format of the export
+
+        Returns:
+            export (tuple): (writer, count, chunks), chunks yielding the encoded file, header first
+
+        Raises:
+            OSError: if the scan has neither a readable PCD nor octree
+            ValueError: if its octree is not supported
+    """
+    reader = None
+    path = find_pcd(scan_dir)
+    if path is not None:
+        try:
+            reader = PcdReader(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Exporting {scan_dir} from its octree, as its PCD cannot be read: {e}')
+    try:
+        octree = PotreeOctree(os.path.join(scan_dir, potree_dir))
+    except (OSError, ValueError):
+        if reader is None:
+            raise
+        octree = None
+
+    if reader is None:
+        writer = writer_class(octree.scale, octree.offset, octree.points_bounds)
+        count = int(octree.metadata.get('points', 0)) or octree.count()
+        points = (octree_points(octree, points) for points in octree.points())
+    else:
+        if octree is not None:
+            # Same frame as the octree, whose bounds save a pass over the PCD
+            scale, offset, bounds = octree.scale, octree.offset, octree.points_bounds
+            octree.close()
+            octree = None
+        elif writer_class.bounds_in_header:
+            bounds = reader.bounds()
+            scale, offset = np.full(3, PCD_SCALE), np.floor(bounds[0])
+        else:
+            scale, offset, bounds = np.full(3, PCD_SCALE), np.zeros(3), (np.zeros(3), np.zeros(3))
+        writer = writer_class(scale, offset, bounds)
+        count = reader.points
+        points = (pcd_points(reader, points, scale, offset) for points in reader.chunks())
+
+    def chunks():
+        try:
+            yield from encoded_chunks(writer, count, points)
+        finally:
+            if octree is not None:
+                octree.close()
+
+    return writer, count, chunks()
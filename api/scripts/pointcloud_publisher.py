@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Incremental publisher of the pointclouds of the data directory to the static files"""
+
+
+# Imports
+import os
+import errno
+import json
+import shutil
+
+## Environment variables
+from dotenv import load_dotenv
+from manage import ROOT_DIR
+
+load_dotenv(ROOT_DIR + '.env')
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Variables
+# Directory of the scans, where DATA_DIR is mounted
+DATA_DIR = os.path.join(ROOT_DIR, 'web', 'static', 'data')
+MANIFEST_NAME = '.published.json'
+# Potree conversion of a scan, relative to the scan directory
+POTREE_DIR = os.path.join('pointclouds', 'spot')
+# Written last by the Potree conversion, its modification time tells whether a scan changed
+METADATA_PATH = os.path.join(POTREE_DIR, 'metadata.json')
+# Publishing methods, from the cheapest
+HARDLINK, SYMLINK, COPY = 'hardlink', 'symlink', 'copy'
+# Errors of os.link when the filesystems do not allow a hardlink, e.g. across devices
+LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES)
+
+
+# Main
+class PointcloudPublisher(object):
+    """
+    Publishes the scans of the data directory (/web/static/data) to the static files (/staticfiles/data),
+      by hardlinks when both are on the same filesystem, else by a symlink of the scan, else by a copy.
+      What has been published is recorded in a manifest, only new or changed scans are published again.
+    """
+    def __init__(self, source_dir=None, target_dir=None):
+        """
+        Construct a new PointcloudPublisher instance and load its manifest.
+
+            Parameters:
+                source_dir (str): Directory of the scans, /web/static/data by default
+                target_dir (str): Directory to publish the scans to, /staticfiles/data by default
+        """
+        self.source_dir = source_dir or DATA_DIR
+        self.target_dir = target_dir or os.path.join(ROOT_DIR, 'staticfiles', 'data')
+        self.manifest_path = os.path.join(self.target_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        """
+        Helper method to read the manifest, empty if there is none yet or it is unreadable.
+        """
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f'Unable to read the manifest of the published pointclouds, publishing them again: {e}')
+            return {}
+
+    def _save_manifest(self):
+        """
+        Helper method to write the manifest atomically, after each scan so that an interrupted run resumes.
+        """
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
+
+    def _signature(self, scan):
+        """
+        Helper method returning the modification time of the metadata of a scan, or while it is not converted,
+          the number, total size and latest modification time of its files, so that an unchanged raw scan is not published again.
+        """
+        try:
+            return os.stat(os.path.join(self.source_dir, scan, METADATA_PATH)).st_mtime_ns
+        except OSError:
+            pass
+        files, size, mtime = 0, 0, 0
+        for root, _, names in os.walk(os.path.join(self.source_dir, scan)):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files, size, mtime = files + 1, size + stat.st_size, max(mtime, stat.st_mtime_ns)
+        return f'{files}:{size}:{mtime}'
+
+    def _scans(self, scans=None):
+        """
+        Helper method to list the scan directories of the data directory, among the given scans if any.
+        """
+        if scans is not None:
+            return sorted(scan for scan in scans if os.path.isdir(os.path.join(self.source_dir, scan)))
+        if not os.path.isdir(self.source_dir):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.source_dir) if entry.is_dir() and entry.name.startswith('spot'))
+
+    def pending(self, scans=None):
+        """
+        Returns the scans that are new or changed since they were published.
+
+            Parameters:
+                scans (list): Only consider these scans, all the scans of the data directory by default
+        """
+        pending = []
+        for scan in self._scans(scans):
+            published = self.manifest.get(scan)
+            signature = self._signature(scan)
+            if (published is None or published['signature'] != signature
+                    or not os.path.lexists(os.path.join(self.target_dir, scan))):
+                pending.append(scan)
+        return pending
+
+    def publish(self, progress=None, scans=None):
+        """
+        Publishes the new or changed scans, and unpublishes the ones removed from the data directory.
+
+            Parameters:
+                progress (callable): Called after each scan with (scan, index, total, published), published being
+                  the manifest entry of the scan: method, signature, number of files and bytes
+                scans (list): Only consider these scans, e.g. the ones a watcher saw change, all by default
+
+            Returns:
+                published (dict): Manifest entries of the scans published by this run
+        """
+        os.makedirs(self.target_dir, exist_ok=True)
+        existing = self._scans(scans)
+        considered = set(self.manifest) if scans is None else set(self.manifest) & set(scans)
+        for scan in sorted(considered - set(existing)):
+            logger.info(f'Unpublishing the {scan} pointcloud, removed from the data directory')
+            self._remove(os.path.join(self.target_dir, scan))
+            del self.manifest[scan]
+            self._save_manifest()
+
+        pending = self.pending(existing)
+        published = {}
+        for index, scan in enumerate(pending, 1):
+            signature = self._signature(scan)
+            try:
+                entry = self._publish_scan(scan)
+            except OSError as e:
+                logger.error(f'Unable to publish the {scan} pointcloud: {e}')
+                continue
+            entry['signature'] = signature
+            self.manifest[scan] = published[scan] = entry
+            self._save_manifest()
+            logger.info(f'Published the {scan} pointcloud ({index}/{len(pending)}) by {entry["method"]}: '
+                        f'{entry["files"]} files, {entry["bytes"] / 2**20:.1f} MiB')
+            if progress is not None:
+                progress(scan, index, len(pending), entry)
+        return published
+
+    def _publish_scan(self, scan):
+        """
+        Helper method to publish a scan, to a temporary name first so that it only appears once complete.
+        """
+        source = os.path.join(self.source_dir, scan)
+        target = os.path.join(self.target_dir, scan)
+        partial = os.path.join(self.target_dir, f'.{scan}.partial')
+        self._remove(partial)
+        files, size = 0, 0
+        for root, _, names in os.walk(source):
+            for name in names:
+                files += 1
+                size += os.path.getsize(os.path.join(root, name))
+
+        try:
+            self._link_tree(source, partial)
+            method = HARDLINK
+        except OSError as e:
+            if e.errno not in LINK_ERRORS:
+                raise
+            self._remove(partial)
+            try:
+                os.symlink(os.path.abspath(source), partial, target_is_directory=True)
+                method = SYMLINK
+            except OSError:
+                shutil.copytree(source, partial)
+                method = COPY
+        self._remove(target)
+        os.rename(partial, target)
+        return {'method': method, 'files': files, 'bytes': size}
+
+    def _link_tree(self, source, target):
+        """
+        Helper method to recreate a directory tree with hardlinks to its files, failing on the first file that cannot be linked.
+        """
+        for root, _, names in os.walk(source):
+            target_root = os.path.join(target, os.path.relpath(root, source))
+            os.makedirs(target_root, exist_ok=True)
+            for name in names:
+                os.link(os.path.join(root, name), os.path.join(target_root, name))
+
+    def _remove(self, path):
+        """
+        Helper method to remove a published scan, whether it is a symlink or a directory.
+        """
+        if os.path.islink(path):
+            os.unlink(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
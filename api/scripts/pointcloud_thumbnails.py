@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Top-down thumbnails of the pointclouds, rendered from the coarse levels of their Potree octree"""
+
+
+# Imports
+import os
+import glob
+import itertools
+import threading
+import concurrent.futures
+
+import numpy as np
+from PIL import Image
+
+# Local imports
+from .pointcloud_publisher import POTREE_DIR
+from .potree_octree import PotreeOctree
+
+## Environment variables
+from dotenv import load_dotenv
+from manage import ROOT_DIR
+
+load_dotenv(ROOT_DIR + '.env')
+
+# Coloring of the thumbnails: height, or intensity where the scans have one
+POINTCLOUD_THUMBNAIL_COLOR = os.getenv('POINTCLOUD_THUMBNAIL_COLOR', 'height')
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Variables
+# Next to the database of the catalog
+THUMBNAIL_DIR = os.path.join(ROOT_DIR, 'data', 'thumbnails')
+# Longest side of the thumbnails, in pixels
+THUMBNAIL_SIZE = 256
+# Points read from the coarse levels of the octree, whole levels are read until the next one would exceed it
+THUMBNAIL_POINTS = 500000
+HEIGHT, INTENSITY = 'height', 'intensity'
+# Colormap from low to high values, close to viridis
+COLORMAP = np.array([[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]], dtype=float)
+
+# The thumbnails are rendered one at a time, in the background of the process, each one once
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='pointcloud-thumbnails')
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+# Main
+class PointcloudThumbnails(object):
+    """
+    Renders top-down thumbnails of the pointclouds, from the coarse levels of their octree, and caches them on disk.
+      A thumbnail is named after the modification time of the metadata.json it was rendered from, as recorded by
+      the catalog, so that it is invalidated whenever the scan changes.
+    """
+    def __init__(self, source_dir, cache_dir=None, color=POINTCLOUD_THUMBNAIL_COLOR, size=THUMBNAIL_SIZE, max_points=THUMBNAIL_POINTS):
+        """
+        Construct a new PointcloudThumbnails instance.
+
+            Parameters:
+                source_dir (str): Directory of the pointclouds
+                cache_dir (str): Directory of the thumbnails, /data/thumbnails by default
+                color (str): height, or intensity (falling back to height for the scans without intensity)
+                size (int): Longest side of the thumbnails, in pixels
+                max_points (int): Points read from the octree
+        """
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir or THUMBNAIL_DIR
+        self.color = color
+        self.size = size
+        self.max_points = max_points
+
+    def path(self, name, signature):
+        """
+        Returns the path to the thumbnail of a pointcloud.
+
+            Parameters:
+                name (str): Name of the pointcloud (spotYYYYmmddHHMMSS)
+                signature (int): Modification time of its metadata.json, in nanoseconds
+        """
+        return os.path.join(self.cache_dir, f'{name}-{signature:x}.png')
+
+    def cached(self, name, signature):
+        """
+        Tells whether the thumbnail of a pointcloud is rendered and up to date.
+        """
+        return os.path.isfile(self.path(name, signature))
+
+    def schedule(self, name, signature):
+        """
+        Renders the thumbnail of a pointcloud in the background, unless it was already scheduled.
+        """
+        path = self.path(name, signature)
+        with _scheduled_lock:
+            if path in _scheduled:
+                return
+            _scheduled.add(path)
+        _executor.submit(self._render_logged, name, signature)
+
+    def _render_logged(self, name, signature):
+        """
+        Helper method rendering a thumbnail in the background, where errors are only logged.
+        """
+        try:
+            self.render(name, signature)
+        except Exception as e:
+            logger.warning(f'Unable to render the thumbnail of the {name} pointcloud: {e}')
+
+    def remove(self, name):
+        """
+        Removes the thumbnails of a pointcloud.
+        """
+        for path in glob.glob(os.path.join(glob.escape(self.cache_dir), f'{glob.escape(name)}-*.png')):
+            os.remove(path)
+
+    def read_points(self, name):
+        """
+        Reads the points of the coarse levels of the octree of a pointcloud, whole levels from the root until the
+          next one would exceed the maximum number of points.
+
+            Returns:
+                xyz (np.ndarray): Positions, (n, 3)
+                intensity (np.ndarray): Intensities, None if the pointcloud has none
+                octree (PotreeOctree): Octree of the pointcloud, closed
+        """
+        with PotreeOctree(os.path.join(self.source_dir, name, POTREE_DIR)) as octree:
+            nodes, points = [], 0
+            for level, level_nodes in itertools.groupby(octree.nodes(), key=lambda node: node.level):
+                level_nodes = list(level_nodes)
+                level_points = sum(node.num_points for node in level_nodes)
+                if nodes and points + level_points > self.max_points:
+                    break
+                nodes.extend(level_nodes)
+                points += level_points
+            points = np.concatenate([octree.read(node) for node in nodes])
+            xyz = octree.coordinates(points)
+            intensity = points[octree.intensity].reshape(len(points)).astype(float) if octree.intensity is not None else None
+        return xyz, intensity, octree
+
+    def render(self, name, signature):
+        """
+        Renders the thumbnail of a pointcloud: the highest point of each pixel, seen from above, colored by its
+          height, or the mean intensity of the points of each pixel. The pixels without points are transparent.
+
+            Returns:
+                path (str): Path to the thumbnail
+        """
+        xyz, intensity, octree = self.read_points(name)
+        bounding_box_min = octree.min
+        extent = np.maximum(octree.max - bounding_box_min, 1e-9)
+        width = max(1, int(round(self.size * min(1.0, extent[0] / extent[1]))))
+        height = max(1, int(round(self.size * min(1.0, extent[1] / extent[0]))))
+
+        columns = np.clip(((xyz[:, 0] - bounding_box_min[0]) / extent[0] * width).astype(int), 0, width - 1)
+        # North up, the first row of the image is the largest y
+        rows = np.clip(height - 1 - ((xyz[:, 1] - bounding_box_min[1]) / extent[1] * height).astype(int), 0, height - 1)
+        pixels = rows * width + columns
+        counts = np.bincount(pixels, minlength=width * height)
+        occupied = counts > 0
+        if self.color == INTENSITY and intensity is not None:
+            values = np.bincount(pixels, weights=intensity, minlength=width * height)
+            values[occupied] /= counts[occupied]
+        else:
+            values = np.full(width * height, -np.inf)
+            np.maximum.at(values, pixels, xyz[:, 2])
+
+        image = np.zeros((width * height, 4), dtype=np.uint8)
+        if occupied.any():
+            low, high = np.percentile(values[occupied], [2, 98])
+            scaled = np.clip((values[occupied] - low) / ((high - low) or 1), 0, 1)
+            stops = np.linspace(0, 1, len(COLORMAP))
+            for channel in range(3):
+                image[occupied, channel] = np.interp(scaled, stops, COLORMAP[:, channel])
+            image[occupied, 3] = 255
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.remove(name)
+        path = self.path(name, signature)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        Image.fromarray(image.reshape(height, width, 4), 'RGBA').save(temp_path, 'PNG')
+        os.replace(temp_path, path)
+        return path
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""Watcher of the data directory, registering the new scans in the pointcloud catalog once complete"""
+
+
+# Imports
+import os
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+import time
+
+# Local imports
+from .pointcloud_publisher import DATA_DIR, POTREE_DIR, METADATA_PATH
+
+## Environment variables
+from dotenv import load_dotenv
+from manage import ROOT_DIR
+
+load_dotenv(ROOT_DIR + '.env')
+
+POINTCLOUD_WATCHER = os.getenv('POINTCLOUD_WATCHER', 'off')
+POINTCLOUD_WATCHER_SETTLE_TIME = float(os.getenv('POINTCLOUD_WATCHER_SETTLE_TIME', 10))
+POINTCLOUD_WATCHER_POLL_INTERVAL = float(os.getenv('POINTCLOUD_WATCHER_POLL_INTERVAL', 5))
+POINTCLOUD_WATCHER_RETRY_DELAY = float(os.getenv('POINTCLOUD_WATCHER_RETRY_DELAY', 5))
+POINTCLOUD_WATCHER_MAX_RETRY_DELAY = float(os.getenv('POINTCLOUD_WATCHER_MAX_RETRY_DELAY', 300))
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Variables
+INOTIFY, POLL = 'inotify', 'poll'
+# Files of a complete Potree conversion, relative to the scan directory
+COMPLETE_FILES = [os.path.join(POTREE_DIR, name) for name in ['metadata.json', 'hierarchy.bin', 'octree.bin']]
+
+"""
+inotify constants, from <sys/inotify.h>
+"""
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+DATA_DIR_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+SCAN_DIR_MASK = DATA_DIR_MASK | IN_MODIFY | IN_CLOSE_WRITE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+# Main
+class Inotify(object):
+    """
+    Minimal binding of the Linux inotify API, through ctypes to avoid a dependency.
+    """
+    def __init__(self):
+        """
+        Construct a new Inotify instance, raising OSError where inotify is not available.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this system')
+        self.libc = libc
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask):
+        """
+        Watches a directory, returning the watch descriptor of its events.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        return wd
+
+    def read(self, timeout):
+        """
+        Waits for events up to a timeout, in seconds.
+
+            Returns:
+                events (list): (watch descriptor, mask, name) tuples
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class PointcloudWatcher(object):
+    """
+    Registers the scans of the data directory once they are complete and no longer changing.
+      Changes are told by inotify, or found by polling where it is not available (e.g. on network mounts,
+      which do not report the changes made by other hosts). A scan is registered once it went unchanged
+      for the settle time, so that partial writes are never published.
+    """
+    def __init__(self, register, source_dir=None, mode=INOTIFY, settle_time=POINTCLOUD_WATCHER_SETTLE_TIME,
+                 poll_interval=POINTCLOUD_WATCHER_POLL_INTERVAL, retry_delay=POINTCLOUD_WATCHER_RETRY_DELAY,
+                 max_retry_delay=POINTCLOUD_WATCHER_MAX_RETRY_DELAY):
+        """
+        Construct a new PointcloudWatcher instance.
+
+            Parameters:
+                register (callable): Called with the list of scans which changed, once settled
+                source_dir (str): Directory of the scans, /web/static/data by default
+                mode (str): 'inotify', falling back to 'poll' if not available
+                settle_time (float): Time without change after which a scan is registered, in seconds
+                poll_interval (float): Time between two polls, in seconds
+                retry_delay (float): Time before registering again after a failure, doubled on each consecutive failure, in seconds
+                max_retry_delay (float): Maximum time between two registration attempts, in seconds
+        """
+        self.register = register
+        self.source_dir = source_dir or DATA_DIR
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Consecutive registration failures, and time before which registering is not tried again
+        self.failures = 0
+        self.retry_at = 0
+        # Scan -> time of its last change, until it is registered
+        self.changes = {}
+        # Scan -> signature of its files when last polled
+        self.signatures = {}
+        self.registered = set()
+        # Watch descriptor -> scan, None for the data directory
+        self.watches = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.inotify = None
+        if mode == INOTIFY:
+            try:
+                self.inotify = Inotify()
+                self.watches[self.inotify.add_watch(self.source_dir, DATA_DIR_MASK)] = None
+            except OSError as e:
+                logger.warning(f'Unable to watch {self.source_dir} with inotify, polling it instead: {e}')
+                self._close_inotify()
+
+    def start(self):
+        """
+        Starts watching in a background thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops watching.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        """
+        Watches until stopped.
+        """
+        logger.info(f'Watching {self.source_dir} for new pointclouds ({INOTIFY if self.inotify else POLL})')
+        # The scans changed while nothing was watching are found by a first poll
+        self.poll()
+        try:
+            while not self.stopped.is_set():
+                if self.inotify is not None:
+                    self.handle_events(self.inotify.read(timeout=1))
+                else:
+                    self.stopped.wait(self.poll_interval)
+                    self.poll()
+                self.register_settled()
+        finally:
+            self._close_inotify()
+
+    def _scans(self):
+        """
+        Helper method to list the scan directories of the data directory.
+        """
+        try:
+            return {entry.name for entry in os.scandir(self.source_dir) if entry.is_dir() and entry.name.startswith('spot')}
+        except OSError:
+            return set()
+
+    def _signature(self, scan):
+        """
+        Helper method returning the names, sizes and modification times of the files of a scan.
+          A registered scan is only checked for a new conversion, by its metadata, to keep polls cheap on large data directories.
+        """
+        scan_dir = os.path.join(self.source_dir, scan)
+        if scan in self.registered:
+            try:
+                return os.stat(os.path.join(scan_dir, METADATA_PATH)).st_mtime_ns
+            except OSError:
+                return None
+        signature = []
+        for root, _, names in os.walk(scan_dir):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                signature.append((os.path.relpath(os.path.join(root, name), scan_dir), stat.st_size, stat.st_mtime_ns))
+        return sorted(signature)
+
+    def poll(self):
+        """
+        Records the scans whose files changed since the last poll, or which were added or removed.
+        """
+        now = time.monotonic()
+        scans = self._scans()
+        for scan in scans:
+            signature = self._signature(scan)
+            if scan not in self.signatures or self.signatures[scan] != signature:
+                self.signatures[scan] = signature
+                self.changes[scan] = now
+                self._watch_scan(scan)
+        for scan in set(self.signatures) - scans:
+            del self.signatures[scan]
+            self.changes[scan] = now
+
+    def _watch_scan(self, scan):
+        """
+        Helper method to watch the directories of a scan with inotify, if used.
+        """
+        if self.inotify is None:
+            return
+        for root, _, _ in os.walk(os.path.join(self.source_dir, scan)):
+            try:
+                self.watches[self.inotify.add_watch(root, SCAN_DIR_MASK)] = scan
+            except OSError as e:
+                logger.warning(f'Unable to watch {root}: {e}')
+
+    def handle_events(self, events):
+        """
+        Records the scans changed according to inotify events.
+        """
+        now = time.monotonic()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, every scan is checked again
+                logger.warning('inotify events overflowed, polling the data directory')
+                self.signatures.clear()
+                self.poll()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            scan = self.watches[wd]
+            if scan is None:
+                # Event of the data directory itself
+                if not name.startswith('spot'):
+                    continue
+                scan = name
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_scan(scan)
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # New subdirectory of a scan, e.g. the Potree output
+                self._watch_scan(scan)
+            self.changes[scan] = now
+
+    def is_complete(self, scan):
+        """
+        Tells whether the Potree conversion of a scan is complete.
+        """
+        return all(os.path.isfile(os.path.join(self.source_dir, scan, path)) for path in COMPLETE_FILES)
+
+    def register_settled(self):
+        """
+        Registers the scans complete, or removed, and unchanged for the settle time.
+        """
+        now = time.monotonic()
+        if now < self.retry_at:
+            return
+        settled = []
+        for scan, changed in list(self.changes.items()):
+            if now - changed < self.settle_time:
+                continue
+            removed = not os.path.isdir(os.path.join(self.source_dir, scan))
+            if removed or self.is_complete(scan):
+                settled.append(scan)
+        if not settled:
+            return
+        logger.info(f'Registering the settled pointclouds: {", ".join(sorted(settled))}')
+        try:
+            self.register(sorted(settled))
+        except Exception as e:
+            # The scans stay settled, the registration is tried again after a delay growing with the failures
+            delay = min(self.retry_delay * 2 ** self.failures, self.max_retry_delay)
+            self.failures += 1
+            self.retry_at = now + delay
+            logger.error(f'Unable to register the pointclouds {settled}, trying again in {delay:.0f} s: {e}')
+            return
+        self.failures = 0
+        for scan in settled:
+            del self.changes[scan]
+            if os.path.isdir(os.path.join(self.source_dir, scan)):
+                self.registered.add(scan)
+                # Its signature is now the cheap one of a registered scan
+                self.signatures[scan] = self._signature(scan)
+            else:
+                self.registered.discard(scan)
+
+    def _close_inotify(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
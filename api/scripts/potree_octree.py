@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""Reader of the Potree 2.0 octrees of the pointclouds, walking their hierarchy and memory-mapping their points"""
+
+
+# Imports
+import os
+import mmap
+import json
+import collections
+
+import numpy as np
+
+# Local imports
+from .pointcloud_compressor import HIERARCHY_RECORD, PROXY, BROTLI, POSITION_NAMES, COLOR_NAMES, point_dtype, decode_node
+
+# Variables
+INTENSITY = 'intensity'
+"""
+Node of an octree: index of its record in hierarchy.bin, level (0 for the root), bounds, and number of points,
+offset and size in octree.bin
+"""
+Node = collections.namedtuple('Node', ['index', 'level', 'min', 'max', 'num_points', 'byte_offset', 'byte_size'])
+
+
+# Main
+class PotreeOctree(object):
+    """
+    Reads a Potree octree: its nodes, walked from the root level by level, and their points.
+      octree.bin is memory-mapped, so that only the nodes read are loaded, without copies for the DEFAULT encoding.
+    """
+    def __init__(self, potree_dir):
+        """
+        Construct a new PotreeOctree instance, opening the files of a Potree conversion.
+
+            Parameters:
+                potree_dir (str): Directory of metadata.json, hierarchy.bin and octree.bin
+
+            Raises:
+                OSError: if a file cannot be read
+                ValueError: if the metadata is invalid or its attributes not supported
+        """
+        try:
+            with open(os.path.join(potree_dir, 'metadata.json')) as f:
+                self.metadata = json.load(f)
+            self.attributes = self.metadata['attributes']
+            self.scale = np.array(self.metadata['scale'], dtype=float)
+            self.offset = np.array(self.metadata['offset'], dtype=float)
+            self.min = np.array(self.metadata['boundingBox']['min'], dtype=float)
+            self.max = np.array(self.metadata['boundingBox']['max'], dtype=float)
+            first_chunk_size = self.metadata['hierarchy']['firstChunkSize']
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'Invalid metadata: {e}')
+        self.dtype = point_dtype(self.attributes)
+        self.fields = {attribute['name']: str(index) for index, attribute in enumerate(self.attributes)}
+        self.position = next((self.fields[name] for name in POSITION_NAMES if name in self.fields), None)
+        if self.position is None:
+            raise ValueError('The pointcloud has no position attribute')
+        self.color = next((self.fields[name] for name in COLOR_NAMES if name in self.fields), None)
+        self.intensity = self.fields.get(INTENSITY)
+
+        self.hierarchy = np.fromfile(os.path.join(potree_dir, 'hierarchy.bin'), dtype=HIERARCHY_RECORD)
+        # Record -> (child index, record) of its children, filled as the chunks of the hierarchy are walked
+        self._children = {}
+        self._root = self._read_chunk(0, first_chunk_size // HIERARCHY_RECORD.itemsize)
+
+        self._file = open(os.path.join(potree_dir, 'octree.bin'), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._octree = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+
+    def close(self):
+        if isinstance(self._octree, mmap.mmap):
+            try:
+                self._octree.close()
+            except BufferError:
+                # Points read without copy are still used, the map is closed once they are released
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def points_bounds(self):
+        """
+        Returns the tight bounds of the points, from the range of the position attribute, else the bounds of the octree.
+        """
+        attribute = self.attributes[int(self.position)]
+        if 'min' in attribute and 'max' in attribute:
+            return np.array(attribute['min'], dtype=float), np.array(attribute['max'], dtype=float)
+        return self.min, self.max
+
+    def _read_chunk(self, first, count):
+        """
+        Helper method to read the children of the nodes of a chunk of the hierarchy, returning its first record.
+          The children of a node are the next records of its chunk, those of a proxy are in the chunk it points to.
+        """
+        following = first + 1
+        for index in range(first, min(first + count, len(self.hierarchy))):
+            if self.hierarchy['type'][index] == PROXY:
+                continue
+            mask = int(self.hierarchy['childMask'][index])
+            children = [child_index for child_index in range(8) if mask & (1 << child_index)]
+            self._children[index] = list(zip(children, range(following, following + len(children))))
+            following += len(children)
+        return first
+
+    def _resolve(self, index):
+        """
+        Helper method returning the record of a node, reading the chunk of the hierarchy a proxy points to.
+        """
+        if self.hierarchy['type'][index] != PROXY:
+            return index
+        return self._read_chunk(int(self.hierarchy['byteOffset'][index]) // HIERARCHY_RECORD.itemsize,
+                                int(self.hierarchy['byteSize'][index]) // HIERARCHY_RECORD.itemsize)
+
+    def nodes(self, box=None, max_level=None):
+        """
+        Walks the nodes of the octree from the root, level by level. The subtrees outside of the box are not walked.
+
+            Parameters:
+                box (tuple): (min, max) corners of an axis-aligned box, the whole octree by default
+                max_level (int): Deepest level walked, all by default
+
+            Yields:
+                node (Node): Nodes intersecting the box
+        """
+        queue = collections.deque([(self._root, 0, self.min, self.max)])
+        while queue:
+            index, level, node_min, node_max = queue.popleft()
+            if box is not None and (np.any(node_max < box[0]) or np.any(node_min > box[1])):
+                continue
+            index = self._resolve(index)
+            record = self.hierarchy[index]
+            yield Node(index, level, node_min, node_max, int(record['numPoints']), int(record['byteOffset']), int(record['byteSize']))
+            if max_level is not None and level >= max_level:
+                continue
+            half = (node_max - node_min) / 2
+            for child_index, child in self._children.get(index, []):
+                # Bits 2, 1 and 0 of the child index tell the upper half of the node along x, y and z
+                upper = np.array([(child_index >> 2) & 1, (child_index >> 1) & 1, child_index & 1], dtype=bool)
+                child_min = np.where(upper, node_min + half, node_min)
+                child_max = np.where(upper, node_max, node_min + half)
+                queue.append((child, level + 1, child_min, child_max))
+
+    def read(self, node):
+        """
+        Reads the points of a node, in the DEFAULT encoding.
+
+            Returns:
+                points (np.ndarray): Points, of dtype self.dtype
+        """
+        if node.byte_size == 0:
+            return np.zeros(0, dtype=self.dtype)
+        if self.metadata.get('encoding') == BROTLI:
+            data = decode_node(self._octree[node.byte_offset:node.byte_offset + node.byte_size], self.attributes, node.num_points)
+            return np.frombuffer(data, dtype=self.dtype)
+        return np.frombuffer(self._octree, dtype=self.dtype, count=node.num_points, offset=node.byte_offset)
+
+    def coordinates(self, points):
+        """
+        Returns the coordinates of points, (n, 3).
+        """
+        return points[self.position] * self.scale + self.offset
+
+    def count(self, box=None, max_level=None):
+        """
+        Counts the points in a box. Only the nodes crossing the faces of the box are read, the others are counted from the hierarchy.
+        """
+        count = 0
+        for node in self.nodes(box, max_level):
+            if self.encloses(box, node):
+                count += node.num_points
+            else:
+                count += len(self.read_in_box(node, box))
+        return count
+
+    def points(self, box=None, max_level=None):
+        """
+        Reads the points in a box, node by node.
+
+            Parameters:
+                box (tuple): (min, max) corners of an axis-aligned box, the whole octree by default
+                max_level (int): Deepest level read, all by default
+
+            Yields:
+                points (np.ndarray): Points of a node in the box, of dtype self.dtype
+        """
+        for node in self.nodes(box, max_level):
+            if node.num_points == 0:
+                continue
+            points = self.read(node) if self.encloses(box, node) else self.read_in_box(node, box)
+            if len(points):
+                yield points
+
+    def encloses(self, box, node):
+        """
+        Tells whether a node is entirely in a box, None standing for the whole octree, so that all its points are.
+        """
+        return box is None or bool(np.all(node.min >= box[0]) and np.all(node.max <= box[1]))
+
+    def read_in_box(self, node, box):
+        """
+        Reads the points of a node that are in a box.
+
+            Returns:
+                points (np.ndarray): Points, of dtype self.dtype
+        """
+        points = self.read(node)
+        coordinates = self.coordinates(points)
+        return points[np.all((coordinates >= box[0]) & (coordinates <= box[1]), axis=1)]
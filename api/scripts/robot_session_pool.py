@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""Process-wide pool of authenticated robot sessions"""
+
+
+# Imports
+import hashlib
+import threading
+import concurrent.futures
+
+## Boston Dynamics
+import bosdyn.client
+from bosdyn.client.auth import AuthResponseError
+from bosdyn.client.exceptions import RpcError, TimeSyncRequired
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Variables
+# Errors telling that the session itself is unusable (robot rebooted, unreachable or token revoked),
+#   not that a request was wrong
+STALE_SESSION_ERRORS = (RpcError, AuthResponseError, TimeSyncRequired)
+
+# Main
+class RobotSession(object):
+    """
+    An authenticated, time-synced connection to the robot, shared by every request of the process.
+    """
+    def __init__(self, robot_ip, guid=None, secret=None, username=None, password=None, client_name='spot-utils', port=None, cert=None):
+        """
+        Construct a new RobotSession instance by authenticating on the robot,
+          either with payload credentials or with user credentials.
+
+            Parameters:
+                robot_ip (str): IP address of the robot
+                guid (str): Payload GUID
+                secret (str): Payload secret
+                username (str): Robot user name (when no payload credentials are given)
+                password (str): Robot user password (when no payload credentials are given)
+                client_name (str): Name of the SDK client
+                port (int): Port of the robot gRPC server, when not the standard one (e.g. a local stand-in)
+                cert (str): Path to the robot root certificate, when not the one of the SDK
+        """
+        self.sdk = bosdyn.client.create_standard_sdk(client_name)
+        if cert is not None:
+            self.sdk.load_robot_cert(cert)
+        self.robot = self.sdk.create_robot(robot_ip)
+        if port is not None:
+            self.robot.update_secure_channel_port(int(port))
+        if guid is not None:
+            self.robot.authenticate_from_payload_credentials(guid, secret)
+        else:
+            self.robot.authenticate(username, password)
+        # The robot keeps the user token refreshed in the background once authenticated.
+        self.robot.sync_with_directory()
+        self.robot.start_time_sync()
+        self.robot.time_sync.wait_for_sync()
+        self.clients = {}
+        self.lock = threading.Lock()
+        # Callers holding the session, and whether it was dropped from the pool, both under the pool lock
+        self.users = 0
+        self.invalidated = False
+
+    def ensure_client(self, service_name):
+        """
+        Returns the client for a service, creating it on first use only.
+
+            Parameters:
+                service_name (str): Name of the service in the robot directory
+
+            Returns:
+                client (BaseClient): Client for the service
+        """
+        with self.lock:
+            client = self.clients.get(service_name)
+            if client is None:
+                client = self.robot.ensure_client(service_name)
+                self.clients[service_name] = client
+            return client
+
+    def close(self):
+        """
+        Stops the background time sync and token refresh of the session.
+        """
+        self.robot._shutdown()
+
+class RobotSessionPool(object):
+    """
+    Keeps one RobotSession per robot IP and credentials.
+    """
+    def __init__(self):
+        """
+        Construct a new, empty, RobotSessionPool instance.
+        """
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, robot_ip, guid=None, secret=None, username=None, password=None, client_name='spot-utils', port=None, cert=None):
+        """
+        Returns the session matching the robot IP and credentials, creating it if needed.
+          The session is created outside of the lock, so that a slow robot only delays the callers of that session.
+
+            Parameters:
+                robot_ip (str): IP address of the robot
+                guid (str): Payload GUID
+                secret (str): Payload secret
+                username (str): Robot user name (when no payload credentials are given)
+                password (str): Robot user password (when no payload credentials are given)
+                client_name (str): Name of the SDK client, used when a new session is created
+                port (int): Port of the robot gRPC server, when not the standard one
+                cert (str): Path to the robot root certificate, when not the one of the SDK
+
+            Returns:
+                session (RobotSession): A ready to use session, to hand back with release or invalidate
+
+            Raises:
+                Exception: Any error of the session creation, for every caller waiting for it
+        """
+        key = self._key(robot_ip, guid, secret, username, password) + (port,)
+        while True:
+            with self.lock:
+                session = self.sessions.get(key)
+                if session is None:
+                    # Placeholder of the session while it connects to the robot, outside of the lock
+                    pending = concurrent.futures.Future()
+                    self.sessions[key] = pending
+                    break
+                if not isinstance(session, concurrent.futures.Future):
+                    session.users += 1
+                    return session
+            # Created by another caller, raising its error if it failed, then taken from the pool again
+            #   in case it was invalidated in the meantime
+            session.result()
+
+        logger.info(f'Opening a new robot session to {robot_ip}')
+        try:
+            session = RobotSession(robot_ip, guid, secret, username, password, client_name, port, cert)
+        except BaseException as e:
+            with self.lock:
+                if self.sessions.get(key) is pending:
+                    del self.sessions[key]
+            pending.set_exception(e)
+            raise
+        with self.lock:
+            self.sessions[key] = session
+            session.users += 1
+        pending.set_result(session)
+        return session
+
+    def release(self, session):
+        """
+        Hands back a session returned by get. The session stays pooled, unless it was invalidated,
+          in which case it is closed once its last user released it.
+
+            Parameters:
+                session (RobotSession): The session to release
+        """
+        with self.lock:
+            session.users = max(session.users - 1, 0)
+            close = session.invalidated and session.users == 0
+        if close:
+            self._close(session)
+
+    def invalidate(self, session):
+        """
+        Drops a session from the pool, for instance after the robot rebooted, and releases it.
+          The callers already holding it keep it until they release it, the next ones get a new session.
+
+            Parameters:
+                session (RobotSession): The session to drop
+        """
+        with self.lock:
+            for key, pooled_session in list(self.sessions.items()):
+                if pooled_session is session:
+                    del self.sessions[key]
+            session.invalidated = True
+        self.release(session)
+
+    def _close(self, session):
+        """
+        Helper method to close a session nobody uses anymore.
+        """
+        try:
+            session.close()
+        except Exception as e:
+            logger.warning(f'Unable to close robot session: {e}')
+
+    def _key(self, robot_ip, guid, secret, username, password):
+        """
+        Helper method to build the pool key, without keeping the secrets in clear.
+        """
+        identity = guid if guid is not None else username
+        credential = secret if guid is not None else password
+        digest = hashlib.sha256((credential or '').encode()).hexdigest()
+        return (robot_ip, identity, digest)
+
+robot_session_pool = RobotSessionPool()
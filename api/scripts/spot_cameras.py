@@ -2,16 +2,33 @@
 """Allows querrying Spot's Image Services"""
 
 # Imports
+import os
+import asyncio
+import struct
 import numpy as np
-from scipy import ndimage
 import cv2 as cv
 import threading
 import time
+import concurrent.futures
 
 ## Boston Dynamics
 import bosdyn.client
 from bosdyn.api import image_pb2
 
+# Local imports
+## Environment variables
+from dotenv import load_dotenv
+from manage import ROOT_DIR
+
+load_dotenv(ROOT_DIR + '.env')
+
+SPOT_CAMERAS_MAX_CAPTURE_THREADS = int(os.getenv('SPOT_CAMERAS_MAX_CAPTURE_THREADS', 6))
+SPOT_CAMERAS_MOSAIC_TILE_SIZE = int(os.getenv('SPOT_CAMERAS_MOSAIC_TILE_SIZE', 320))
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
 # Variables
 ROTATION_ANGLE = {
     'back_fisheye_image': 0,
@@ -21,94 +38,634 @@ ROTATION_ANGLE = {
     'right_fisheye_image': 180,
     'video99': 0
 }
+MOSAIC = 'mosaic'
+MOSAIC_WITH_VIDEO99 = 'mosaic_with_video99'
+MOSAIC_SOURCES = [
+    'frontleft_fisheye_image',
+    'frontright_fisheye_image',
+    'left_fisheye_image',
+    'right_fisheye_image',
+    'back_fisheye_image'
+]
+MOSAIC_COLUMNS = 3
+# Header of the WebSocket binary frames: sequence number, capture time (UNIX seconds), camera name length
+WS_FRAME_HEADER = struct.Struct('<IdH')
+# Encodings a stream can be requested in: OpenCV extension, quality flag, MIME type
+IMAGE_FORMATS = {
+    'jpeg': ('.jpg', cv.IMWRITE_JPEG_QUALITY, 'image/jpeg'),
+    'webp': ('.webp', cv.IMWRITE_WEBP_QUALITY, 'image/webp')
+}
+LOSSLESS_ROTATIONS = {
+    90: cv.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv.ROTATE_180,
+    270: cv.ROTATE_90_CLOCKWISE
+}
 
 # Main
+class CaptureLimitError(Exception):
+    """
+    Raised when starting a new capture loop would exceed the configured limit.
+    """
+    pass
+
 class SpotCameras(object):
     """
     Provides an interface of communication with Spot's Image Services.
     """
-    def __init__(self, camera_request, image_client):
+    def __init__(self, camera_request, image_client, capture=True, on_stop=None):
         """
         Construct a new SpotCameras instance
 
             Parameters:
                 camera_request (str): Camera requested
                 image_client (Client): Client for Spot's Image Service
+                capture (bool): Start the capture loop, False to only get the first frame, e.g. in benchmarks
+                on_stop (callable): Called once when the capture loop stops, e.g. to release the robot session
         """
         self.frame = None
+        self.source_jpeg = None
+        self.jpeg = None
+        self.frame_seq = 0
+        self.frame_time = None
+        self.published_frame = None
+        self.variants = {}
+        self.variants_seq = 0
+        self.variants_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.async_waiters = set()
+        self.subscribers = 0
+        self.fps_caps = []
         self.camera_request = camera_request
         self.image_client = image_client
-        self.getImage()
         self.updating = True
-        threading.Thread(target=self.update, args=()).start()
-    
+        self.on_stop = None
+        self.getImage()
+        self.encode()
+        # Only set once the first frame was captured, a failing constructor leaves the cleanup to its caller
+        self.on_stop = on_stop
+        if capture:
+            threading.Thread(target=self.update, args=(), daemon=True).start()
+
     def __del__(self):
         """
         Stops the interface from updating the frame.
         """
-        self.updating = False
-    
+        self.stop()
+
+    def stop(self):
+        """
+        Stops the capture loop and wakes up the subscribers waiting for a frame.
+        """
+        with self.condition:
+            self.updating = False
+            on_stop, self.on_stop = self.on_stop, None
+            self.condition.notify_all()
+            self._notify_async_waiters()
+        if on_stop is not None:
+            on_stop()
+
     def getImage(self):
         """
         Querries Spot's Image Service to get a capture of the required camera.
         """
         image_responses = self.image_client.get_image_from_sources([self.camera_request])
         image = image_responses[0]
-        num_bytes = 1
-        if image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_DEPTH_U16:
-            dtype = np.uint16
-            extension = ".png"
+        angle = ROTATION_ANGLE[image.source.name] % 360
+        if image.shot.image.format == image_pb2.Image.FORMAT_JPEG and angle == 0:
+            # Fast path: forward the robot's JPEG untouched.
+            self.frame = None
+            self.source_jpeg = bytes(image.shot.image.data)
+            return
+        self.frame = decode_image(image)
+        self.source_jpeg = None
+
+    def encode(self):
+        """
+        Encodes the current frame in JPG, once for all the subscribers,
+          and hands it over to the subscribers waiting for a new frame.
+        """
+        if self.source_jpeg is not None:
+            # The robot's JPEG is forwarded as is.
+            jpeg = self.source_jpeg
         else:
-            if image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_RGB_U8:
-                num_bytes = 3
-            elif image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_RGBA_U8:
-                num_bytes = 4
-            elif image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8:
-                num_bytes = 1
-            elif image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U16:
-                num_bytes = 2
-            dtype = np.uint8
-            extension = ".jpg"
-        img = np.frombuffer(image.shot.image.data, dtype=dtype)
-        if image.shot.image.format == image_pb2.Image.FORMAT_RAW:
             try:
-                img = img.reshape((image.shot.image.rows, image.shot.image.cols, num_bytes))
-            except ValueError:
-                img = cv.imdecode(img, -1)
-        else:
-            img = cv.imdecode(img, -1)
-        img = ndimage.rotate(img, ROTATION_ANGLE[image.source.name])
-        self.frame = img
+                _, jpeg = cv.imencode('.jpg', self.frame)
+                jpeg = jpeg.tobytes()
+            except:
+                jpeg = None
+        with self.condition:
+            self.jpeg = jpeg
+            self.published_frame = self.frame
+            self.frame_seq += 1
+            self.frame_time = time.time()
+            self.condition.notify_all()
+            self._notify_async_waiters()
 
     def get_frame(self):
         """
-        Encodes the frame in JPG.
+        Returns the last frame, encoded in JPG.
         """
-        frame = self.frame
-        try:
-            _, jpeg = cv.imencode('.jpg', frame)
-            return jpeg.tobytes()
-        except:
+        jpeg = self.jpeg
+        if jpeg is None:
             return False
-    
+        return jpeg
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """
+        Waits for a frame more recent than the last one sent to a subscriber.
+
+            Parameters:
+                last_seq (int): Sequence number of the last frame sent to the subscriber
+                timeout (float): Time to wait for a new frame before checking again that the capture loop is alive
+
+            Returns:
+                frame_seq (int): Sequence number of the frame
+                frame (bytes): The frame, encoded in JPG, or False once the capture loop stopped
+        """
+        with self.condition:
+            while self.updating and self.frame_seq <= last_seq:
+                self.condition.wait(timeout)
+            if not self.updating or self.jpeg is None:
+                return self.frame_seq, False
+            return self.frame_seq, self.jpeg
+
+    async def wait_for_frame_async(self, last_seq, timeout=1.0, with_time=False):
+        """
+        Waits for a frame more recent than the last one sent to a subscriber, without blocking the event loop.
+
+            Parameters:
+                last_seq (int): Sequence number of the last frame sent to the subscriber
+                timeout (float): Maximum time to wait for a new frame
+                with_time (bool): Also return the capture time of the frame
+
+            Returns:
+                frame_seq (int): Sequence number of the frame, last_seq if no new frame came in time
+                frame (bytes): The frame, encoded in JPG, None if no new frame came in time, or False once the capture loop stopped
+                frame_time (float): UNIX time of the frame, only if with_time
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.condition:
+            waiting = self.updating and self.frame_seq <= last_seq
+            if waiting:
+                self.async_waiters.add(waiter)
+        if waiting:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.condition:
+                    self.async_waiters.discard(waiter)
+        with self.condition:
+            if not self.updating or self.jpeg is None:
+                result = self.frame_seq, False, self.frame_time
+            elif self.frame_seq <= last_seq:
+                result = last_seq, None, None
+            else:
+                result = self.frame_seq, self.jpeg, self.frame_time
+        return result if with_time else result[:2]
+
+    def get_variant(self, width=None, quality=None, image_format='jpeg', with_time=False):
+        """
+        Returns the last frame in the requested resolution, quality and format.
+          Each variant is encoded once per frame, the viewers asking for the same one share it.
+
+            Parameters:
+                width (int): Maximum width of the frame, None for the full resolution
+                quality (int): Encoding quality, from 1 to 100, None for OpenCV's default
+                image_format (str): Key of IMAGE_FORMATS
+                with_time (bool): Also return the capture time of the frame
+
+            Returns:
+                frame_seq (int): Sequence number of the frame
+                frame (bytes): The encoded frame, or False once the capture loop stopped
+                frame_time (float): UNIX time of the frame, only if with_time
+        """
+        with self.condition:
+            frame_seq, frame, jpeg, frame_time = self.frame_seq, self.published_frame, self.jpeg, self.frame_time
+            if not self.updating or jpeg is None:
+                return (frame_seq, False, frame_time) if with_time else (frame_seq, False)
+        if is_default_variant(width, quality, image_format):
+            return (frame_seq, jpeg, frame_time) if with_time else (frame_seq, jpeg)
+        key = (frame_seq, width, quality, image_format)
+        with self.variants_lock:
+            data = self.variants.get(key)
+            if data is None:
+                source = self.variants.get((frame_seq, 'source'))
+                if source is None:
+                    source = frame if frame is not None else cv.imdecode(np.frombuffer(jpeg, np.uint8), cv.IMREAD_COLOR)
+                data = encode_variant(source, width, quality, image_format)
+                # Only the variants of the last frame are worth keeping, a caller late on an older frame
+                #   must not drop those of a newer one.
+                if frame_seq > self.variants_seq:
+                    self.variants_seq = frame_seq
+                    self.variants = {}
+                if frame_seq == self.variants_seq:
+                    self.variants[(frame_seq, 'source')] = source
+                    self.variants[key] = data
+        return (frame_seq, data, frame_time) if with_time else (frame_seq, data)
+
+    def _notify_async_waiters(self):
+        """
+        Helper method to wake up the coroutines waiting for a frame. The condition must be held.
+        """
+        for loop, event in self.async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The event loop of the waiter is closed.
+                pass
+
+    def capture_period(self):
+        """
+        Returns the minimum time between two captures, given the FPS caps of the subscribers.
+        """
+        fps_caps = list(self.fps_caps)
+        if not fps_caps or None in fps_caps:
+            return 0
+        return 1.0 / max(fps_caps)
+
     def update(self):
         """
         Updates the stored frame.
         """
         while self.updating:
-            self.getImage()
+            start = time.monotonic()
+            try:
+                self.getImage()
+                self.encode()
+            except Exception as e:
+                logger.error(f'Capture loop for {self.camera_request} stopped: {e}')
+                self.jpeg = None
+                self.stop()
+                break
+            delay = self.capture_period() - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+class SpotCamerasMosaic(SpotCameras):
+    """
+    Captures all of Spot's body cameras in a single request and lays them out in a single frame.
+    """
+    def __init__(self, image_client, ricoh_image_client=None, tile_size=SPOT_CAMERAS_MOSAIC_TILE_SIZE, on_stop=None):
+        """
+        Construct a new SpotCamerasMosaic instance
+
+            Parameters:
+                image_client (Client): Client for Spot's Image Service
+                ricoh_image_client (Client): Client for the SpotCameras Image Service, to add the video99 camera
+                tile_size (int): Size of the square each camera is downscaled to fit in, in pixels
+                on_stop (callable): Called once when the capture loop stops, e.g. to release the robot session
+        """
+        self.ricoh_image_client = ricoh_image_client
+        self.tile_size = tile_size
+        camera_request = MOSAIC_WITH_VIDEO99 if ricoh_image_client is not None else MOSAIC
+        super(SpotCamerasMosaic, self).__init__(camera_request, image_client, on_stop=on_stop)
+
+    def getImage(self):
+        """
+        Querries all the body cameras at once and lays the images out in a grid.
+        """
+        image_responses = list(self.image_client.get_image_from_sources(MOSAIC_SOURCES))
+        if self.ricoh_image_client is not None:
+            image_responses += self.ricoh_image_client.get_image_from_sources(['video99'])
+        columns = MOSAIC_COLUMNS
+        rows = -(-len(image_responses) // columns)
+        mosaic = np.zeros((rows * self.tile_size, columns * self.tile_size, 3), dtype=np.uint8)
+        for index, image in enumerate(image_responses):
+            if image.status != image_pb2.ImageResponse.STATUS_OK:
+                continue
+            tile = decode_image(image)
+            if tile is None:
+                continue
+            tile = self._fit_tile(tile)
+            top = (index // columns) * self.tile_size + (self.tile_size - tile.shape[0]) // 2
+            left = (index % columns) * self.tile_size + (self.tile_size - tile.shape[1]) // 2
+            mosaic[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+        self.frame = mosaic
+        self.source_jpeg = None
+
+    def _fit_tile(self, img):
+        """
+        Helper method to downscale an image to fit in a tile, as a 3 channels 8 bits image.
+        """
+        if img.dtype != np.uint8:
+            img = (img >> 8).astype(np.uint8)
+        if img.ndim == 3 and img.shape[2] == 1:
+            img = img[:, :, 0]
+        if img.ndim == 2:
+            img = cv.cvtColor(img, cv.COLOR_GRAY2BGR)
+        elif img.shape[2] == 4:
+            img = cv.cvtColor(img, cv.COLOR_BGRA2BGR)
+        elif img.shape[2] == 2:
+            img = cv.cvtColor(img[:, :, 1], cv.COLOR_GRAY2BGR)
+        scale = min(self.tile_size / img.shape[1], self.tile_size / img.shape[0])
+        if scale < 1:
+            size = (max(int(img.shape[1] * scale), 1), max(int(img.shape[0] * scale), 1))
+            img = cv.resize(img, size, interpolation=cv.INTER_AREA)
+        return img
+
+def decode_image(image):
+    """
+    Decodes and rotates an image response from Spot's Image Services.
+
+        Parameters:
+            image (image_pb2.ImageResponse): image response
+
+        Returns:
+            (numpy.ndarray): decoded image, upright, or None if it cannot be decoded
+    """
+    num_bytes = 1
+    if image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_DEPTH_U16:
+        dtype = np.uint16
+    else:
+        if image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_RGB_U8:
+            num_bytes = 3
+        elif image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_RGBA_U8:
+            num_bytes = 4
+        elif image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8:
+            num_bytes = 1
+        elif image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U16:
+            num_bytes = 2
+        dtype = np.uint8
+    img = np.frombuffer(image.shot.image.data, dtype=dtype)
+    if image.shot.image.format == image_pb2.Image.FORMAT_RAW:
+        try:
+            img = img.reshape((image.shot.image.rows, image.shot.image.cols, num_bytes))
+        except ValueError:
+            img = cv.imdecode(img, -1)
+    else:
+        img = cv.imdecode(img, -1)
+    if img is None:
+        return None
+    return rotate(img, ROTATION_ANGLE.get(image.source.name, 0))
+
+def encode_variant(img, width=None, quality=None, image_format='jpeg'):
+    """
+    Encodes an image, downscaled to a maximum width.
+
+        Parameters:
+            img (numpy.ndarray): The image
+            width (int): Maximum width of the image, None for the full resolution
+            quality (int): Encoding quality, from 1 to 100, None for OpenCV's default
+            image_format (str): Key of IMAGE_FORMATS
+
+        Returns:
+            data (bytes): The encoded image
+    """
+    extension, quality_flag, _ = IMAGE_FORMATS[image_format]
+    if width is not None and width < img.shape[1]:
+        height = max(1, round(img.shape[0] * width / img.shape[1]))
+        img = cv.resize(img, (width, height), interpolation=cv.INTER_AREA)
+    params = [quality_flag, quality] if quality is not None else []
+    _, data = cv.imencode(extension, img, params)
+    return data.tobytes()
+
+def rotate(img, angle):
+    """
+    Rotates an image counterclockwise.
+
+        Parameters:
+            img (numpy.ndarray): image to rotate
+            angle (int): rotation angle, in degrees
+
+        Returns:
+            (numpy.ndarray): rotated image
+    """
+    angle = angle % 360
+    if angle == 0:
+        return img
+    if angle in LOSSLESS_ROTATIONS:
+        # Exact transpose/flip, no interpolation involved.
+        return cv.rotate(img, LOSSLESS_ROTATIONS[angle])
+    from scipy import ndimage
+    return ndimage.rotate(img, angle)
+
+class SpotCamerasBroadcaster(object):
+    """
+    Shares one SpotCameras capture loop per camera source between any number of subscribers.
+    """
+    def __init__(self, max_capture_threads=SPOT_CAMERAS_MAX_CAPTURE_THREADS):
+        """
+        Construct a new SpotCamerasBroadcaster instance
+
+            Parameters:
+                max_capture_threads (int): Maximum number of capture loops running at once
+        """
+        self.max_capture_threads = max_capture_threads
+        self.cameras = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, camera_request, camera_factory, fps=None):
+        """
+        Subscribes to the capture loop of a camera source, starting it if needed.
+          The camera is built outside of the lock, so that a slow robot only delays the subscribers of that camera.
+
+            Parameters:
+                camera_request (str): Camera requested
+                camera_factory (callable): Returns a new SpotCameras instance for the camera requested
+                fps (float): Maximum frame rate needed by the subscriber, None for as fast as possible
+
+            Returns:
+                camera (SpotCameras): The shared SpotCameras instance
+
+            Raises:
+                CaptureLimitError: Starting a new capture loop would exceed max_capture_threads
+                Exception: Any error of camera_factory, for every subscriber waiting for it
+        """
+        while True:
+            with self.lock:
+                camera = self.cameras.get(camera_request)
+                if isinstance(camera, concurrent.futures.Future):
+                    pending, starting = camera, False
+                elif camera is None or not camera.updating:
+                    self._reap()
+                    if len(self.cameras) >= self.max_capture_threads:
+                        raise CaptureLimitError(f'Cannot capture more than {self.max_capture_threads} cameras at once.')
+                    # Placeholder of the camera while it connects to the robot, outside of the lock
+                    pending, starting = concurrent.futures.Future(), True
+                    self.cameras[camera_request] = pending
+                else:
+                    return self._add_subscriber(camera, fps)
+
+            if starting:
+                try:
+                    camera = camera_factory()
+                except BaseException as e:
+                    with self.lock:
+                        if self.cameras.get(camera_request) is pending:
+                            del self.cameras[camera_request]
+                    pending.set_exception(e)
+                    raise
+                with self.lock:
+                    self.cameras[camera_request] = camera
+                    self._add_subscriber(camera, fps)
+                pending.set_result(camera)
+                return camera
+
+            # Started by another subscriber, raising its error if it failed
+            camera = pending.result()
+            with self.lock:
+                if self.cameras.get(camera_request) is camera and camera.updating:
+                    return self._add_subscriber(camera, fps)
+            # Stopped in the meantime, start it again
+
+    def _add_subscriber(self, camera, fps):
+        """
+        Helper method to count a new subscriber of a camera. The lock must be held.
+        """
+        camera.subscribers += 1
+        camera.fps_caps.append(fps)
+        return camera
+
+    def unsubscribe(self, camera, fps=None):
+        """
+        Releases a subscription, stopping the capture loop when its last subscriber leaves.
+
+            Parameters:
+                camera (SpotCameras): The SpotCameras instance returned by subscribe
+                fps (float): Frame rate given when subscribing
+        """
+        with self.lock:
+            camera.subscribers = max(camera.subscribers - 1, 0)
+            if fps in camera.fps_caps:
+                camera.fps_caps.remove(fps)
+            if camera.subscribers == 0:
+                camera.stop()
+                if self.cameras.get(camera.camera_request) is camera:
+                    del self.cameras[camera.camera_request]
+
+    def reap(self):
+        """
+        Stops every capture loop that has no subscriber left.
+        """
+        with self.lock:
+            self._reap()
+
+    def _reap(self):
+        """
+        Helper method to stop idle or dead capture loops. The lock must be held.
+        """
+        for camera_request, camera in list(self.cameras.items()):
+            if isinstance(camera, concurrent.futures.Future):
+                # Still starting
+                continue
+            if camera.subscribers == 0 or not camera.updating:
+                camera.stop()
+                del self.cameras[camera_request]
+
+broadcaster = SpotCamerasBroadcaster()
+
+def is_default_variant(width, quality, image_format):
+    """
+    Helper function telling whether the frames are requested as captured, without re-encoding.
+    """
+    return width is None and quality is None and image_format == 'jpeg'
+
+async def get_variant_async(camera, width, quality, image_format, with_time=False):
+    """
+    Helper function to encode a variant of the last frame off the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, camera.get_variant, width, quality, image_format, with_time)
+
+def gen(camera, fps=None, width=None, quality=None, image_format='jpeg'):
+    """
+    Generates a stream from frames, sending each frame only once.
+
+        Parameters:
+            camera (SpotCameras): instance of the SpotCameras class, connected to the robot's requested Image Service.
+            fps (float): Maximum frame rate of the stream, None for as fast as the camera
+            width (int): Maximum width of the frames, None for the full resolution
+            quality (int): Encoding quality of the frames, None for OpenCV's default
+            image_format (str): Encoding of the frames, key of IMAGE_FORMATS
+    """
+    frame_seq = 0
+    min_interval = 1.0 / fps if fps else 0
+    part_header = b'--frame\r\nContent-Type: ' + IMAGE_FORMATS[image_format][2].encode() + b'\r\n\r\n'
+    try:
+        while True:
+            tick = time.monotonic()
+            frame_seq, frame = camera.wait_for_frame(frame_seq)
+            if frame and not is_default_variant(width, quality, image_format):
+                frame_seq, frame = camera.get_variant(width, quality, image_format)
+            if (not frame):
+                break
+            yield(part_header + frame + b'\r\n\r\n')
+            delay = min_interval - (time.monotonic() - tick)
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        broadcaster.unsubscribe(camera, fps)
+
+async def agen(camera, fps=None, disconnected=None, width=None, quality=None, image_format='jpeg'):
+    """
+    Asynchronously generates a stream from frames, sending each frame only once.
+
+        Parameters:
+            camera (SpotCameras): instance of the SpotCameras class, connected to the robot's requested Image Service.
+            fps (float): Maximum frame rate of the stream, None for as fast as the camera
+            disconnected (asyncio.Event): Set once the client disconnected
+            width (int): Maximum width of the frames, None for the full resolution
+            quality (int): Encoding quality of the frames, None for OpenCV's default
+            image_format (str): Encoding of the frames, key of IMAGE_FORMATS
+    """
+    frame_seq = 0
+    min_interval = 1.0 / fps if fps else 0
+    part_header = b'--frame\r\nContent-Type: ' + IMAGE_FORMATS[image_format][2].encode() + b'\r\n\r\n'
+    try:
+        while disconnected is None or not disconnected.is_set():
+            tick = time.monotonic()
+            frame_seq, frame = await camera.wait_for_frame_async(frame_seq)
+            if frame is None:
+                continue
+            if frame and not is_default_variant(width, quality, image_format):
+                frame_seq, frame = await get_variant_async(camera, width, quality, image_format)
+            if (not frame):
+                break
+            yield(part_header + frame + b'\r\n\r\n')
+            delay = min_interval - (time.monotonic() - tick)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        # The broadcaster lock is only held briefly, cameras are built outside of it, and this also runs
+        # when the generator is finalized after its loop closed.
+        broadcaster.unsubscribe(camera, fps)
 
-def gen(camera):
+async def wsgen(camera, fps=None, disconnected=None, width=None, quality=None, image_format='jpeg'):
     """
-    Generates a stream from frames.
+    Asynchronously generates WebSocket binary messages from frames, each one being the frame,
+      encoded as requested, behind a WS_FRAME_HEADER and the camera name.
+      The next frame is only taken once the previous message was sent, so the frames captured
+      while the client is slow to read are dropped instead of piling up.
 
         Parameters:
             camera (SpotCameras): instance of the SpotCameras class, connected to the robot's requested Image Service.
+            fps (float): Maximum frame rate of the stream, None for as fast as the camera
+            disconnected (asyncio.Event): Set once the client disconnected
+            width (int): Maximum width of the frames, None for the full resolution
+            quality (int): Encoding quality of the frames, None for OpenCV's default
+            image_format (str): Encoding of the frames, key of IMAGE_FORMATS
     """
-    while True:
-        frame = camera.get_frame()
-        if (not frame):
-            camera.__del__()
-            break
-        yield(b'--frame\r\n'
-              b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n\r\n')
+    sent_seq = 0
+    min_interval = 1.0 / fps if fps else 0
+    camera_name = camera.camera_request.encode()
+    try:
+        while disconnected is None or not disconnected.is_set():
+            tick = time.monotonic()
+            frame_seq, frame, frame_time = await camera.wait_for_frame_async(sent_seq, with_time=True)
+            if frame is None:
+                continue
+            if frame and not is_default_variant(width, quality, image_format):
+                frame_seq, frame, frame_time = await get_variant_async(camera, width, quality, image_format, with_time=True)
+            if (not frame):
+                break
+            if frame_seq <= sent_seq:
+                # A newer frame was already sent to this viewer.
+                continue
+            sent_seq = frame_seq
+            yield(WS_FRAME_HEADER.pack(frame_seq, frame_time, len(camera_name)) + camera_name + frame)
+            delay = min_interval - (time.monotonic() - tick)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        broadcaster.unsubscribe(camera, fps)
@@ -6,7 +6,7 @@
 from django.urls import path
 
 # Local imports
-from .views import ApiRoutes, HelloSpot, getCameraFeed, closeCameraFeed, startSpotCamerasImageServiceView, stopSpotCamerasImageServiceView, Pointclouds, SpotSLAM
+from .views import ApiRoutes, HelloSpot, getCameraFeed, cameraFeedSocket, closeCameraFeed, startSpotCamerasImageServiceView, stopSpotCamerasImageServiceView, Pointclouds, getPointcloudData, getPointcloudThumbnail, extractPointcloud, exportPointcloud, SpotSLAM
 
 
 # Main
@@ -14,10 +14,15 @@ from .views import ApiRoutes, HelloSpot, getCameraFeed, closeCameraFeed, startSp
 * /api/                         ->      List all API endpoints
 * /api/hello-spot/              ->      Execute HelloSpot
 * /api/camera/                  ->      Get live camera feed
+* /api/camera/ws/               ->      Get live camera feed over a WebSocket
 * /api/close-camera             ->      Close live camera feed
 * /api/start-spot-camera        ->      Run SpotCameras image service
 * /api/stop-spot-camera         ->      Stop SpotCameras image service
 * /api/pointclouds              ->      List available pointclouds
+* /api/pointclouds/<name>/data/ ->      Get the Potree files of a pointcloud
+* /api/pointclouds/<name>/thumbnail ->   Get the top-down thumbnail of a pointcloud
+* /api/pointclouds/<name>/extract ->     Get the points of a pointcloud in a box
+* /api/pointclouds/<name>/export ->      Get all the points of a pointcloud
 * /api/spot-slam                ->      Generate new pointcloud
 """
 urlpatterns = [
@@ -28,5 +33,13 @@ urlpatterns = [
     path('start-spot-cameras/', startSpotCamerasImageServiceView, name='api-start-spot-cameras'),
     path('stop-spot-cameras/', stopSpotCamerasImageServiceView, name='api-stop-spot-cameras'),
     path('pointclouds/', Pointclouds.as_view(), name='api-pointclouds'),
+    path('pointclouds/<str:name>/data/<str:file_name>', getPointcloudData, name='api-pointcloud-data'),
+    path('pointclouds/<str:name>/thumbnail', getPointcloudThumbnail, name='api-pointcloud-thumbnail'),
+    path('pointclouds/<str:name>/extract', extractPointcloud, name='api-pointcloud-extract'),
+    path('pointclouds/<str:name>/export', exportPointcloud, name='api-pointcloud-export'),
     path('spot-slam/', SpotSLAM.as_view(), name='api-spot-slam'),
-]
\ No newline at end of file
+]
+# Served by spotUtils.asgi, outside of Django's URL resolver
+websocket_urlpatterns = {
+    '/api/camera/ws/': cameraFeedSocket,
+}
@@ -4,24 +4,35 @@
 
 # Imports
 import os
+import asyncio
+from urllib.parse import parse_qs, quote
 
 ## Django REST framework
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.http import StreamingHttpResponse, HttpResponse
-from django.views.decorators import gzip
+from django.http import StreamingHttpResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 
 ## Bosdyn
-import bosdyn.client
 from bosdyn.client.image import ImageClient
 
 # Local imports
-from .decorators import require_get, require_delete
+from .models import Pointcloud
+from .decorators import require_get, require_safe, require_delete
 from .scripts.helloSpot import main
-from .scripts.spot_cameras import gen, SpotCameras
+from .scripts.spot_cameras import gen, agen, wsgen, broadcaster, SpotCameras, SpotCamerasMosaic, CaptureLimitError, ROTATION_ANGLE, MOSAIC, MOSAIC_WITH_VIDEO99, IMAGE_FORMATS
+from .scripts.robot_session_pool import robot_session_pool, STALE_SESSION_ERRORS
 from .scripts.gst_loopback_helper import GstLoopbackHelper
 from .scripts.spot_cameras_image_service_helper import SpotCamerasImageServiceHelper
-from .scripts.available_pointclouds_helper import AvailablePointcloudsHelper
+from .scripts.available_pointclouds_helper import AvailablePointcloudsHelper, PAGE_SIZE
+from .scripts.pointcloud_publisher import DATA_DIR, POTREE_DIR
+from .scripts.pointcloud_thumbnails import PointcloudThumbnails
+from .scripts.pointcloud_data_helper import POINTCLOUD_ACCEL_REDIRECT, POTREE_FILES, pointcloud_file, etag, parse_range, file_chunks, afile_chunks, aiterate
+from .scripts.pointcloud_export_helper import WRITERS, parse_box, box_export, scan_export
+from .scripts.potree_octree import PotreeOctree
 from .scripts.spot_slam_helper import SpotSLAMHelper
 
 ## Environment variables
@@ -33,15 +44,18 @@ load_dotenv(ROOT_DIR + '.env')
 ROBOT_IP = os.getenv('ROBOT_IP')
 GUID = os.getenv('GUID')
 SECRET = os.getenv('SECRET')
+# Only set to reach a robot on a non-standard port or certificate, e.g. the local stand-in of benchmarks/spot_stand_in.py
+ROBOT_PORT = os.getenv('ROBOT_PORT')
+ROBOT_CERT = os.getenv('ROBOT_CERT')
 
 # Logging
 import logging
 logger = logging.getLogger(__name__)
 
 # Variables
-camera = None
 gstLoopbackHelper = None
 spotCamerasImageServiceHelper = None
+MAX_PAGE_SIZE = 500
 
 
 # Main
@@ -61,10 +75,28 @@ class ApiRoutes(APIView):
                 'description': 'Hello, Spot!'
             },
             {
-                'endpoint': '/camera/',
+                'endpoint': '/camera/?camera=frontleft_fisheye_image&fps=10',
                 'method': 'GET',
                 'body': None,
-                'description': 'Get live camera feed from Spot\'s cameras'
+                'description': 'Get live camera feed from Spot\'s cameras, optionally capped to a frame rate'
+            },
+            {
+                'endpoint': '/camera/?camera=frontleft_fisheye_image&width=640&quality=70&format=webp',
+                'method': 'GET',
+                'body': None,
+                'description': 'Get live camera feed downscaled to a maximum width, with an encoding quality (1-100) and format (jpeg or webp), also accepted by /camera/ws/'
+            },
+            {
+                'endpoint': '/camera/?camera=mosaic',
+                'method': 'GET',
+                'body': None,
+                'description': 'Get a single live feed of all of Spot\'s body cameras (camera=mosaic_with_video99 adds the RICOH THETA Z1)'
+            },
+            {
+                'endpoint': '/camera/ws/?camera=frontleft_fisheye_image',
+                'method': 'GET',
+                'body': None,
+                'description': 'Get live camera feed over a WebSocket, as binary messages with a header (sequence number, timestamp, camera), dropping the frames a slow client cannot keep up with'
             },
             {
                 'endpoint': '/close-camera/',
@@ -85,16 +117,40 @@ class ApiRoutes(APIView):
                 'description': 'Stop SpotCameras image service'
             },
             {
-                'endpoint': '/pointclouds',
+                'endpoint': '/pointclouds/?start=2023-08-01&end=2023-08-31&page=1&page_size=50',
                 'method': 'GET',
                 'body': None,
-                'description': 'List available services'
+                'description': 'List available pointclouds, most recent first, optionally within a date range, and only a page of them with page or page_size (count and pages in the X-Total-Count, X-Page and X-Page-Count headers)'
             },
             {
                 'endpoint': '/pointclouds',
                 'method': 'POST',
                 'body': None,
-                'description': 'Collect new pointclouds'
+                'description': 'Publish new pointclouds and update the pointcloud catalog'
+            },
+            {
+                'endpoint': '/pointclouds/<name>/data/octree.bin',
+                'method': 'GET',
+                'body': None,
+                'description': 'Get a Potree file (metadata.json, hierarchy.bin or octree.bin) of a pointcloud, with byte ranges and cache validators'
+            },
+            {
+                'endpoint': '/pointclouds/<name>/thumbnail?v=<version>',
+                'method': 'GET',
+                'body': None,
+                'description': 'Get the top-down thumbnail of a pointcloud, rendered in the background (404 until then)'
+            },
+            {
+                'endpoint': '/pointclouds/<name>/extract?min=<x,y,z>&max=<x,y,z>&level=<level>&format=las',
+                'method': 'GET',
+                'body': None,
+                'description': 'Download the points of a pointcloud in a box, up to a level of detail, as LAS, PLY or NPY'
+            },
+            {
+                'endpoint': '/pointclouds/<name>/export?format=las',
+                'method': 'GET',
+                'body': None,
+                'description': 'Download all the points of a pointcloud, from its PCD or its octree, as LAS, PLY or NPY'
             },
             {
                 'endpoint': '/spot-slam?slam=start',
@@ -128,40 +184,162 @@ class HelloSpot(APIView):
         main()
         return Response('Hello, Spot!')
 
+def _camera_factory(camera_request):
+    """
+    Helper function returning the factory of the SpotCameras instance for a camera,
+      only called when no viewer is already watching this camera.
+    """
+    def camera_factory():
+        # Get an image client from the pooled robot session, held until the capture loop stops.
+        session = robot_session_pool.get(ROBOT_IP, guid=GUID, secret=SECRET, client_name='image_capture', port=ROBOT_PORT, cert=ROBOT_CERT)
+        release = lambda: robot_session_pool.release(session)
+        try:
+            if camera_request == MOSAIC:
+                return SpotCamerasMosaic(session.ensure_client(ImageClient.default_service_name), on_stop=release)
+            elif camera_request == MOSAIC_WITH_VIDEO99:
+                return SpotCamerasMosaic(session.ensure_client(ImageClient.default_service_name),
+                                         session.ensure_client("spot-cameras-image-service"), on_stop=release)
+            elif camera_request == "video99":
+                image_client = session.ensure_client("spot-cameras-image-service")
+            else:
+                image_client = session.ensure_client(ImageClient.default_service_name)
+            return SpotCameras(camera_request, image_client, on_stop=release)
+        except STALE_SESSION_ERRORS:
+            # The session is stale (e.g. the robot rebooted), open a new one next time.
+            robot_session_pool.invalidate(session)
+            raise
+        except BaseException:
+            release()
+            raise
+    return camera_factory
+
+def _check_camera(camera_request):
+    """
+    Helper function checking that a camera can be streamed, before connecting to the robot.
+
+        Raises:
+            ValueError: The camera is unknown, with a message for the client
+    """
+    cameras = list(ROTATION_ANGLE) + [MOSAIC, MOSAIC_WITH_VIDEO99]
+    if camera_request not in cameras:
+        raise ValueError(f'camera must be one of {", ".join(cameras)}.')
+
+def _stream_params(params):
+    """
+    Helper function parsing the frame rate and the encoding requested for a camera feed.
+
+        Parameters:
+            params (dict): Query parameters of the request
+
+        Returns:
+            fps (float): Maximum frame rate, None for as fast as the camera
+            variant (dict): Width, quality and image format of the frames
+
+        Raises:
+            ValueError: A parameter is invalid, with a message for the client
+    """
+    try:
+        fps = float(params['fps']) if 'fps' in params else None
+    except ValueError:
+        raise ValueError('fps must be a number.')
+    if fps is not None and not fps > 0:
+        raise ValueError('fps must be positive.')
+    try:
+        width = int(params['width']) if 'width' in params else None
+        quality = int(params['quality']) if 'quality' in params else None
+    except ValueError:
+        raise ValueError('width and quality must be integers.')
+    if width is not None and not width > 0:
+        raise ValueError('width must be positive.')
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError('quality must be between 1 and 100.')
+    image_format = params.get('format', 'jpeg')
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f'format must be one of {", ".join(IMAGE_FORMATS)}.')
+    return fps, {'width': width, 'quality': quality, 'image_format': image_format}
+
 @require_get
-@gzip.gzip_page
-def getCameraFeed(request):
-    """
-    API endpoint for the camera live video feed
-    """
-    global camera
-    if camera is not None:
-        camera.__del__()
-    # Create robot object with an image client.
-    sdk = bosdyn.client.create_standard_sdk('image_capture')
-    robot = sdk.create_robot(ROBOT_IP)
-    robot.authenticate_from_payload_credentials(GUID, SECRET)
-    robot.sync_with_directory()
-    robot.time_sync.wait_for_sync()
+async def getCameraFeed(request):
+    """
+    API endpoint for the camera live video feed.
+      Served through ASGI, waiting for frames only costs a coroutine, not a worker.
+    """
     camera_request = request.GET.get('camera', 'frontleft_fisheye_image')
-    if camera_request == "video99":
-        image_client = robot.ensure_client("spot-cameras-image-service")
+    try:
+        _check_camera(camera_request)
+        fps, variant = _stream_params(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    try:
+        camera = await sync_to_async(broadcaster.subscribe, thread_sensitive=False)(camera_request, _camera_factory(camera_request), fps)
+    except CaptureLimitError as e:
+        logger.warning(e)
+        return HttpResponse(str(e), status=503)
+    except Exception as e:
+        logger.error(f'Unable to open the {camera_request} camera feed: {e}')
+        return HttpResponse(status=502)
+    if isinstance(request, ASGIRequest):
+        stream = agen(camera, fps, request.scope.get('disconnected'), **variant)
     else:
-        image_client = robot.ensure_client(ImageClient.default_service_name)
-    try :
-        camera = SpotCameras(camera_request, image_client)
-        return StreamingHttpResponse(gen(camera), content_type="multipart/x-mixed-replace;boundary=frame")
-    except:
+        stream = gen(camera, fps, **variant)
+    return StreamingHttpResponse(stream, content_type="multipart/x-mixed-replace;boundary=frame")
+
+async def cameraFeedSocket(scope, receive, send):
+    """
+    ASGI WebSocket endpoint for the camera live video feed, sending each frame as a binary message.
+      Same query parameters as getCameraFeed.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    params = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+    camera_request = params.get('camera', 'frontleft_fisheye_image')
+    try:
+        _check_camera(camera_request)
+        fps, variant = _stream_params(params)
+    except ValueError:
+        await send({'type': 'websocket.close', 'code': 1008})
+        return
+
+    try:
+        camera = await sync_to_async(broadcaster.subscribe, thread_sensitive=False)(camera_request, _camera_factory(camera_request), fps)
+    except CaptureLimitError as e:
+        logger.warning(e)
+        await send({'type': 'websocket.close', 'code': 1013})
+        return
+    except Exception as e:
+        logger.error(f'Unable to open the {camera_request} camera feed: {e}')
+        await send({'type': 'websocket.close', 'code': 1011})
+        return
+    await send({'type': 'websocket.accept'})
+
+    disconnected = asyncio.Event()
+    async def watch_disconnect():
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+        disconnected.set()
+    watcher = asyncio.ensure_future(watch_disconnect())
+    stream = wsgen(camera, fps, disconnected, **variant)
+    try:
+        async for frame in stream:
+            # Waits while the client's socket buffer is full.
+            await send({'type': 'websocket.send', 'bytes': frame})
+        if not disconnected.is_set():
+            # The capture loop stopped.
+            await send({'type': 'websocket.close', 'code': 1011})
+    except OSError:
         pass
+    finally:
+        watcher.cancel()
+        await stream.aclose()
 
 @require_delete
 def closeCameraFeed(request):
     """
-    API endpoint for closing the camera live video feed
+    API endpoint for closing the camera live video feeds nobody is watching anymore
     """
-    global camera
-    if camera is not None:
-        camera.__del__()
+    broadcaster.reap()
     return HttpResponse()
 
 @require_get
@@ -204,18 +382,173 @@ class Pointclouds(APIView):
     """
     def get(self, request, format=None):
         """
-        List available pointclouds (in the `/staticfiles/pointclouds` directory)
+        List available pointclouds (in the `/staticfiles/data` directory), as a list, most recent first.
+          Query parameters: start and end dates (ISO 8601), and page and page_size (at most MAX_PAGE_SIZE) to only
+          get a page, the list being complete without them. The total count, the page number and the number of pages
+          are given in the X-Total-Count, X-Page and X-Page-Count headers.
         """
         helper = AvailablePointcloudsHelper()
-        return Response(helper.list())
+        try:
+            page_size = None
+            if 'page' in request.GET or 'page_size' in request.GET:
+                page_size = min(int(request.GET.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE)
+                if page_size < 1:
+                    raise ValueError('page_size must be positive')
+            pointclouds = helper.list(request.GET.get('start'), request.GET.get('end'), request.GET.get('page', 1), page_size)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        response = Response(pointclouds['results'])
+        response['X-Total-Count'] = pointclouds['count']
+        response['X-Page'] = pointclouds['page']
+        response['X-Page-Count'] = pointclouds['pages']
+        return response
     
     def post(self, request, format=None):
         """
-        Collect new pointclouds placed in the data folder.
+        Publish the new pointclouds placed in the data folder, and update the catalog.
         """
         helper = AvailablePointcloudsHelper()
-        return HttpResponse(helper.collect_new_pointclouds())
+        return Response(helper.collect_new_pointclouds())
     
+@require_safe
+def getPointcloudData(request, name, file_name):
+    """
+    API endpoint serving the Potree files of a pointcloud straight from the data directory.
+      Single byte ranges and conditional requests are supported, as Potree loads the octree nodes by ranges.
+      The transfer is handed off to nginx when POINTCLOUD_ACCEL_REDIRECT is set.
+    """
+    relative_path = pointcloud_file(name, file_name)
+    if relative_path is None:
+        return HttpResponseNotFound()
+    path = os.path.join(DATA_DIR, relative_path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return HttpResponseNotFound()
+    content_type = POTREE_FILES[file_name]
+
+    if POINTCLOUD_ACCEL_REDIRECT:
+        # nginx handles the ranges and validators of the file itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = POINTCLOUD_ACCEL_REDIRECT + quote(relative_path.replace(os.sep, '/'))
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    file_etag, last_modified = etag(stat), int(stat.st_mtime)
+    validators = {'ETag': file_etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'no-cache', 'Accept-Ranges': 'bytes'}
+    response = get_conditional_response(request, etag=file_etag, last_modified=last_modified)
+    if response is not None:
+        # Not modified, or precondition failed
+        for header, value in validators.items():
+            response[header] = value
+        return response
+
+    byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range and if_range != file_etag and parse_http_date_safe(if_range) != last_modified:
+        # The client has another version of the file, it gets the whole new one
+        byte_range = None
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    first, last = byte_range or (0, stat.st_size - 1)
+    length = last - first + 1
+    status = 200 if byte_range is None else 206
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=content_type)
+    elif isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(afile_chunks(path, first, length), status=status, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(file_chunks(path, first, length), status=status, content_type=content_type)
+    for header, value in validators.items():
+        response[header] = value
+    response['Content-Length'] = length
+    if byte_range is not None:
+        response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+    return response
+
+@require_safe
+def getPointcloudThumbnail(request, name):
+    """
+    API endpoint serving the cached top-down thumbnail of a pointcloud, scheduling its rendering if it is missing.
+      Requested with its version, as listed by /api/pointclouds/, the thumbnail does not change and can be cached for good.
+    """
+    pointcloud = Pointcloud.objects.filter(name=name, metadata_mtime_ns__isnull=False).first()
+    if pointcloud is None:
+        return HttpResponseNotFound()
+    thumbnails = PointcloudThumbnails(AvailablePointcloudsHelper().pointclouds_dir)
+    try:
+        thumbnail = open(thumbnails.path(name, pointcloud.metadata_mtime_ns), 'rb')
+    except OSError:
+        thumbnails.schedule(name, pointcloud.metadata_mtime_ns)
+        return HttpResponseNotFound()
+    response = FileResponse(thumbnail, content_type='image/png')
+    if request.GET.get('v') == f'{pointcloud.metadata_mtime_ns:x}':
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+@require_get
+def extractPointcloud(request, name):
+    """
+    API endpoint streaming the points of a pointcloud in an axis-aligned box, optionally up to a level of detail of its octree.
+      Only the nodes of the octree intersecting the box are read, each one once, so that the cost grows with the extract, not the scan.
+    """
+    if pointcloud_file(name, 'metadata.json') is None:
+        return HttpResponseNotFound()
+    writer_class = WRITERS.get(request.GET.get('format', 'las'))
+    if writer_class is None:
+        return HttpResponseBadRequest(f'Invalid format, expected one of {", ".join(WRITERS)}')
+    try:
+        box = parse_box(request.GET.get('min'), request.GET.get('max'))
+        max_level = request.GET.get('level')
+        max_level = None if max_level is None else int(max_level)
+        if max_level is not None and max_level < 0:
+            raise ValueError('Invalid level, expected a positive integer')
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    try:
+        octree = PotreeOctree(os.path.join(DATA_DIR, name, POTREE_DIR))
+    except OSError:
+        return HttpResponseNotFound()
+    except ValueError as e:
+        return HttpResponseBadRequest(f'Unsupported pointcloud: {e}')
+
+    writer, count, chunks = box_export(octree, box, max_level, writer_class)
+
+    content = aiterate(chunks) if isinstance(request, ASGIRequest) else chunks
+    response = StreamingHttpResponse(content, content_type=writer.content_type)
+    response['Content-Length'] = writer.size(count)
+    response['Content-Disposition'] = f'attachment; filename="{name}-extract.{writer.extension}"'
+    return response
+
+@require_get
+def exportPointcloud(request, name):
+    """
+    API endpoint streaming all the points of a pointcloud, from its original PCD when there is one, else from its octree.
+      The points are read and encoded a chunk at a time, so that the download starts at once and memory stays flat.
+    """
+    if pointcloud_file(name, 'metadata.json') is None:
+        return HttpResponseNotFound()
+    writer_class = WRITERS.get(request.GET.get('format', 'las'))
+    if writer_class is None:
+        return HttpResponseBadRequest(f'Invalid format, expected one of {", ".join(WRITERS)}')
+    try:
+        writer, count, chunks = scan_export(os.path.join(DATA_DIR, name), POTREE_DIR, writer_class)
+    except OSError:
+        return HttpResponseNotFound()
+    except ValueError as e:
+        return HttpResponseBadRequest(f'Unsupported pointcloud: {e}')
+
+    content = aiterate(chunks) if isinstance(request, ASGIRequest) else chunks
+    response = StreamingHttpResponse(content, content_type=writer.content_type)
+    response['Content-Length'] = writer.size(count)
+    response['Content-Disposition'] = f'attachment; filename="{name}.{writer.extension}"'
+    return response
+
 class SpotSLAM(APIView):
     """
     API endpoint for generating new pointclouds
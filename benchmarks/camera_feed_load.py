@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Load test of the camera feed through gunicorn, against the local stand-in for Spot
+
+Starts the stand-in and gunicorn as deployed (uvicorn workers on spotUtils.asgi), opens concurrent
+/api/camera/ streams, and reports the time to first frame and the frame rate of each client, and the
+CPU and memory of the gunicorn processes. Run from the root of the project, with the environment of
+the application (ops/dev/app_env):
+    python -m benchmarks.camera_feed_load --clients 20 --duration 20 --json camera_feed_load.json
+"""
+
+# Imports
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# Local imports
+from benchmarks.spot_stand_in import SpotStandIn
+
+# Variables
+BOUNDARY = b'--frame\r\n'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+# Main
+def free_port():
+    """
+    Returns a local TCP port free at the moment.
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(port, workers, environment):
+    """
+    Starts gunicorn with uvicorn workers on spotUtils.asgi, as in ops/*/docker-compose.yml, and waits until it answers.
+
+        Returns:
+            process (subprocess.Popen): The gunicorn master process
+    """
+    env = dict(os.environ, **environment)
+    env['ALLOWED_HOSTS'] = ','.join(filter(None, [env.get('ALLOWED_HOSTS'), '127.0.0.1']))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '--timeout', '120',
+                                '--workers', str(workers), '-k', 'uvicorn.workers.UvicornWorker', 'spotUtils.asgi'], env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f'gunicorn exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise Exception('gunicorn did not start listening within 60 seconds')
+
+def process_tree(pid):
+    """
+    Returns the pid of a process and of its children, e.g. the gunicorn master and its workers.
+    """
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The name of the command may contain spaces, the fields after it do not.
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    return pids
+
+def sample_usage(pids):
+    """
+    Returns the total CPU time (in seconds) and resident memory (in bytes) of processes.
+    """
+    cpu, rss = 0, 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{pid}/statm') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+        # utime and stime, fields 14 and 15 of stat
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu, rss
+
+def monitor(pid, stop, samples, period=0.5):
+    """
+    Samples the CPU and memory of a process tree until stopped.
+    """
+    while not stop.is_set():
+        samples.append((time.monotonic(),) + sample_usage(process_tree(pid)))
+        stop.wait(period)
+
+def stream(port, path, deadline, result):
+    """
+    Reads a camera feed until the deadline, recording when each frame arrives.
+      A frame is counted when its part boundary is received, gen and agen send a part in a single chunk.
+    """
+    start = time.monotonic()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        result['status'] = response.status
+        if response.status != 200:
+            return
+        tail = b''
+        while time.monotonic() < deadline:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            data = tail + chunk
+            now = time.monotonic()
+            for _ in range(data.count(BOUNDARY)):
+                if 'first_frame' not in result:
+                    result['first_frame'] = now - start
+                result['frames'].append(now)
+            tail = data[-(len(BOUNDARY) - 1):]
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        connection.close()
+
+def summarize(results):
+    """
+    Returns the time to first frame and frame rate statistics of the clients.
+    """
+    first_frames = sorted(result['first_frame'] for result in results if 'first_frame' in result)
+    fps = []
+    for result in results:
+        frames = result['frames']
+        if len(frames) > 1:
+            fps.append((len(frames) - 1) / (frames[-1] - frames[0]))
+    fps.sort()
+    return {
+        'clients_served': len(first_frames),
+        'errors': sorted(set(result.get('error') or f'HTTP {result.get("status")}' for result in results
+                             if 'first_frame' not in result)),
+        'time_to_first_frame_p50_ms': round(1000 * statistics.median(first_frames), 1) if first_frames else None,
+        'time_to_first_frame_max_ms': round(1000 * first_frames[-1], 1) if first_frames else None,
+        'fps_per_client_mean': round(statistics.mean(fps), 2) if fps else None,
+        'fps_per_client_min': round(fps[0], 2) if fps else None,
+        'frames_total': sum(len(result['frames']) for result in results),
+    }
+
+def run(options):
+    """
+    Runs the load test.
+
+        Returns:
+            report (dict): Parameters and results of the load test
+    """
+    stand_in = SpotStandIn(fps=options.robot_fps)
+    port = options.http_port or free_port()
+    gunicorn = start_gunicorn(port, options.workers, stand_in.environment())
+    samples, stop = [], threading.Event()
+    try:
+        monitoring = threading.Thread(target=monitor, args=(gunicorn.pid, stop, samples), daemon=True)
+        monitoring.start()
+        deadline = time.monotonic() + options.duration
+        results, clients = [], []
+        for i in range(options.clients):
+            camera = options.camera[i % len(options.camera)]
+            path = f'/api/camera/?camera={camera}' + (f'&fps={options.fps}' if options.fps else '')
+            result = {'camera': camera, 'frames': []}
+            results.append(result)
+            clients.append(threading.Thread(target=stream, args=(port, path, deadline, result), daemon=True))
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(options.duration + 30)
+        stop.set()
+        monitoring.join()
+    finally:
+        gunicorn.terminate()
+        gunicorn.wait(30)
+        stand_in.stop()
+
+    report = {
+        'clients': options.clients,
+        'cameras': options.camera,
+        'workers': options.workers,
+        'requested_fps': options.fps,
+        'robot_fps': options.robot_fps,
+        'duration_s': options.duration,
+        'robot_get_image_calls': stand_in.image_servicer.requests,
+    }
+    report.update(summarize(results))
+    if len(samples) > 1:
+        (start, start_cpu, _), (end, end_cpu, _) = samples[0], samples[-1]
+        report['server_cpu_percent'] = round(100 * (end_cpu - start_cpu) / (end - start), 1)
+        report['server_rss_peak_mb'] = round(max(rss for _, _, rss in samples) / 2**20, 1)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10, help='Number of concurrent camera feeds')
+    parser.add_argument('--camera', action='append', help='Camera of the feeds, repeat to spread the clients over several cameras')
+    parser.add_argument('--fps', type=float, help='Frame rate requested by each client')
+    parser.add_argument('--robot-fps', type=float, default=15, help='Frame rate of the stand-in image sources')
+    parser.add_argument('--workers', type=int, default=1, help='Number of gunicorn workers')
+    parser.add_argument('--duration', type=float, default=10, help='Duration of the load, in seconds')
+    parser.add_argument('--http-port', type=int, default=0, help='Port of gunicorn, 0 for any free port')
+    parser.add_argument('--json', help='File to write the results to')
+    options = parser.parse_args()
+    options.camera = options.camera or ['frontleft_fisheye_image']
+
+    report = run(options)
+    for key, value in report.items():
+        print(f'{key:<30} {value}')
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""Microbenchmarks of the stages of the camera feed pipeline of spot_cameras
+
+Run from the root of the project:
+    python -m benchmarks.spot_cameras_pipeline --json bench_spot_cameras.json
+    python -m benchmarks.spot_cameras_pipeline --compare bench_spot_cameras.json
+"""
+
+# Imports
+import argparse
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+import numpy as np
+import cv2 as cv
+
+## Boston Dynamics
+from bosdyn.api import image_pb2
+
+# Local imports
+from api.scripts.spot_cameras import SpotCameras, ROTATION_ANGLE, decode_image, encode_variant, rotate, gen
+
+# Variables
+"""
+Image responses as sent by Spot: name, source, format, pixel format, rows, cols
+  The body fisheye cameras are 640x480 greyscale, the depth cameras 424x240, the hand camera 1920x1080 in color.
+"""
+CASES = [
+    ('jpeg_grey8_640x480', 'frontleft_fisheye_image', image_pb2.Image.FORMAT_JPEG, image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8, 480, 640),
+    ('jpeg_grey8_640x480_upright', 'back_fisheye_image', image_pb2.Image.FORMAT_JPEG, image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8, 480, 640),
+    ('raw_grey8_640x480', 'frontleft_fisheye_image', image_pb2.Image.FORMAT_RAW, image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8, 480, 640),
+    ('raw_grey16_640x480', 'frontleft_fisheye_image', image_pb2.Image.FORMAT_RAW, image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U16, 480, 640),
+    ('raw_depth16_424x240', 'frontleft_fisheye_image', image_pb2.Image.FORMAT_RAW, image_pb2.Image.PIXEL_FORMAT_DEPTH_U16, 240, 424),
+    ('raw_rgb8_1920x1080', 'right_fisheye_image', image_pb2.Image.FORMAT_RAW, image_pb2.Image.PIXEL_FORMAT_RGB_U8, 1080, 1920),
+    ('raw_rgba8_1920x1080', 'right_fisheye_image', image_pb2.Image.FORMAT_RAW, image_pb2.Image.PIXEL_FORMAT_RGBA_U8, 1080, 1920),
+]
+CHANNELS = {
+    image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8: (1, np.uint8),
+    image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U16: (1, np.uint16),
+    image_pb2.Image.PIXEL_FORMAT_DEPTH_U16: (1, np.uint16),
+    image_pb2.Image.PIXEL_FORMAT_RGB_U8: (3, np.uint8),
+    image_pb2.Image.PIXEL_FORMAT_RGBA_U8: (4, np.uint8),
+}
+# Slower than the baseline by this ratio is reported as a regression by --compare
+REGRESSION_RATIO = 1.2
+
+
+# Main
+def make_image_response(source_name, image_format, pixel_format, rows, cols):
+    """
+    Builds a fake image response, with a noisy gradient as a camera would produce.
+
+        Parameters:
+            source_name (str): Name of the image source
+            image_format (image_pb2.Image.Format): Format of the image data
+            pixel_format (image_pb2.Image.PixelFormat): Pixel format of the image
+            rows (int): Height of the image
+            cols (int): Width of the image
+
+        Returns:
+            image_response (image_pb2.ImageResponse): The fake image response
+    """
+    channels, dtype = CHANNELS[pixel_format]
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:rows, 0:cols]
+    img = (x + y)[:, :, None] * np.iinfo(dtype).max // (rows + cols) + rng.integers(0, 16, (rows, cols, channels))
+    img = img.astype(dtype)
+    if image_format == image_pb2.Image.FORMAT_JPEG:
+        data = cv.imencode('.jpg', img)[1].tobytes()
+    else:
+        data = img.tobytes()
+    image_response = image_pb2.ImageResponse()
+    image_response.status = image_pb2.ImageResponse.STATUS_OK
+    image_response.source.name = source_name
+    image_response.shot.image.data = data
+    image_response.shot.image.format = image_format
+    image_response.shot.image.pixel_format = pixel_format
+    image_response.shot.image.rows = rows
+    image_response.shot.image.cols = cols
+    return image_response
+
+class StubImageClient(object):
+    """
+    Stands for the client of Spot's Image Service, answering every request with the same image response.
+    """
+    def __init__(self, image_response):
+        self.image_response = image_response
+
+    def get_image_from_sources(self, image_sources):
+        return [self.image_response]
+
+def make_camera(image_response):
+    """
+    Builds a SpotCameras instance whose image client returns the image response, without capture loop.
+    """
+    return SpotCameras(image_response.source.name, StubImageClient(image_response), capture=False)
+
+class OneFrameCamera(object):
+    """
+    Stands for a SpotCameras instance in gen, with a single frame to stream.
+    """
+    def __init__(self, jpeg):
+        self.jpeg = jpeg
+        self.camera_request = None
+        self.subscribers = 1
+        self.fps_caps = [None]
+
+    def wait_for_frame(self, last_seq):
+        if last_seq == 0:
+            return 1, self.jpeg
+        return 1, False
+
+    def stop(self):
+        pass
+
+def stages(image_response):
+    """
+    Returns the stages of the pipeline for an image response, each one as a function of no argument.
+
+        Parameters:
+            image_response (image_pb2.ImageResponse): The image response
+
+        Returns:
+            stages (list): (stage name, function) tuples
+    """
+    serialized = image_response.SerializeToString()
+    upright = image_pb2.ImageResponse()
+    upright.CopyFrom(image_response)
+    upright.source.name = ''
+    decoded = decode_image(upright)
+    angle = ROTATION_ANGLE[image_response.source.name]
+    camera = make_camera(image_response)
+
+    def multipart():
+        return list(gen(OneFrameCamera(camera.jpeg)))
+
+    result = [
+        ('deserialize', lambda: image_pb2.ImageResponse.FromString(serialized)),
+        ('decode', lambda: decode_image(upright)),
+        ('rotate', lambda: rotate(decoded, angle)),
+        ('get_image', camera.getImage),
+        ('encode', camera.encode),
+    ]
+    if camera.jpeg is not None:
+        # Some pixel formats cannot be encoded in JPEG (e.g. 16 bits greyscale), the feed ends on them.
+        result += [
+            ('multipart', multipart),
+            ('variant_jpeg_q70_w320', lambda: encode_variant(decoded, 320, 70, 'jpeg')),
+            ('variant_webp_q70_w320', lambda: encode_variant(decoded, 320, 70, 'webp')),
+        ]
+    return result
+
+def measure(func, min_time=0.2, min_iterations=5):
+    """
+    Times a function and tracks the memory it allocates.
+
+        Parameters:
+            func (callable): The function to measure
+            min_time (float): Minimum total time of the timed calls, in seconds
+            min_iterations (int): Minimum number of timed calls
+
+        Returns:
+            result (dict): Timings in microseconds, peak and retained allocations in bytes
+    """
+    func()  # Warm up
+    tracemalloc.start()
+    func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < min_iterations or time.perf_counter() - start < min_time:
+        tick = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - tick)
+    timings.sort()
+    return {
+        'iterations': len(timings),
+        'median_us': round(1e6 * statistics.median(timings), 2),
+        'mean_us': round(1e6 * statistics.mean(timings), 2),
+        'min_us': round(1e6 * timings[0], 2),
+        'p95_us': round(1e6 * timings[int(0.95 * (len(timings) - 1))], 2),
+        'peak_alloc_bytes': peak,
+        'retained_alloc_bytes': retained,
+    }
+
+def run(min_time=0.2, cases=CASES):
+    """
+    Runs the benchmarks of every stage for every case.
+
+        Returns:
+            report (dict): Environment and results of the benchmarks
+    """
+    results = []
+    for case, source_name, image_format, pixel_format, rows, cols in cases:
+        image_response = make_image_response(source_name, image_format, pixel_format, rows, cols)
+        for stage, func in stages(image_response):
+            result = {'case': case, 'stage': stage}
+            result.update(measure(func, min_time))
+            results.append(result)
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+def compare(report, baseline, ratio=REGRESSION_RATIO):
+    """
+    Compares the median timings of a report to a baseline report.
+
+        Returns:
+            regressions (list): (case, stage, baseline median, median) tuples of the stages slower than ratio times the baseline
+    """
+    baseline_medians = {(result['case'], result['stage']): result['median_us'] for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        baseline_median = baseline_medians.get((result['case'], result['stage']))
+        if baseline_median and result['median_us'] > ratio * baseline_median:
+            regressions.append((result['case'], result['stage'], baseline_median, result['median_us']))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum time spent timing each stage, in seconds')
+    parser.add_argument('--json', help='File to write the results to')
+    parser.add_argument('--compare', help='Results of a previous run to compare to')
+    options = parser.parse_args()
+
+    report = run(options.min_time)
+    print(f'{"case":<28} {"stage":<24} {"median_us":>12} {"p95_us":>12} {"peak_alloc_kB":>14}')
+    for result in report['results']:
+        print(f'{result["case"]:<28} {result["stage"]:<24} {result["median_us"]:>12.1f} {result["p95_us"]:>12.1f} {result["peak_alloc_bytes"] / 1024:>14.1f}')
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(report, json.load(f))
+        for case, stage, baseline_median, median in regressions:
+            print(f'REGRESSION {case} {stage}: {baseline_median:.1f} us -> {median:.1f} us')
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""Local stand-in for Spot, serving the directory, auth, time-sync and image services over gRPC
+
+The web application connects to it as to a robot, with the environment variables printed at start:
+    python -m benchmarks.spot_stand_in --port 50443 --fps 15
+    python -m benchmarks.spot_stand_in --frames-dir recorded/  # Cycle through recorded JPEG frames
+"""
+
+# Imports
+import argparse
+import glob
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent import futures
+import grpc
+import numpy as np
+import cv2 as cv
+
+## Boston Dynamics
+import bosdyn.util
+from bosdyn.api import auth_pb2, directory_pb2, image_pb2, payload_registration_pb2, time_sync_pb2
+from bosdyn.api import auth_service_pb2_grpc, directory_service_pb2_grpc, image_service_pb2_grpc
+from bosdyn.api import payload_registration_service_pb2_grpc, time_sync_service_pb2_grpc
+from bosdyn.client.server_util import populate_response_header
+
+# Local imports
+from api.scripts.spot_cameras import MOSAIC_SOURCES
+
+# Variables
+"""
+Services of the directory: name, type, authority
+  The SDK reaches the bootstrap services (auth, directory, payload registration) on fixed authorities.
+"""
+SERVICES = [
+    ('auth', 'bosdyn.api.AuthService', 'auth.spot.robot'),
+    ('directory', 'bosdyn.api.DirectoryService', 'api.spot.robot'),
+    ('payload-registration', 'bosdyn.api.PayloadRegistrationService', 'payload-registration.spot.robot'),
+    ('time-sync', 'bosdyn.api.TimeSyncService', 'api.spot.robot'),
+    ('image', 'bosdyn.api.ImageService', 'api.spot.robot'),
+]
+TOKEN = 'spot-stand-in-token'
+CLOCK_IDENTIFIER = 'spot-stand-in'
+# Body cameras of Spot, 640x480 greyscale
+IMAGE_SOURCES = MOSAIC_SOURCES
+ROWS, COLS = 480, 640
+
+
+# Main
+def make_certificate(directory):
+    """
+    Creates a self-signed certificate valid for the authorities of the robot, with the openssl command.
+
+        Parameters:
+            directory (str): Directory to write the certificate and key to
+
+        Returns:
+            cert_path, key_path (str, str): Paths to the PEM certificate and key
+    """
+    cert_path = os.path.join(directory, 'spot-stand-in.crt')
+    key_path = os.path.join(directory, 'spot-stand-in.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=api.spot.robot', '-addext', 'subjectAltName=DNS:*.spot.robot,DNS:api.spot.robot',
+                    '-keyout', key_path, '-out', cert_path],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_path, key_path
+
+def synthetic_frames(count=30):
+    """
+    Returns greyscale JPEG frames of moving gradients with some noise, so that the decoder has some work to do.
+    """
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:ROWS, 0:COLS]
+    frames = []
+    for i in range(count):
+        frame = ((x + y + 8 * i) % 256).astype(np.uint8)
+        frame = cv.add(frame, rng.integers(0, 8, frame.shape, dtype=np.uint8))
+        frames.append(cv.imencode('.jpg', frame)[1].tobytes())
+    return frames
+
+def recorded_frames(frames_dir):
+    """
+    Returns the JPEG frames of a directory, in name order.
+    """
+    frames = []
+    for path in sorted(glob.glob(os.path.join(frames_dir, '*.jpg'))):
+        with open(path, 'rb') as f:
+            frames.append(f.read())
+    if not frames:
+        raise Exception(f'No JPEG frame in {frames_dir}')
+    return frames
+
+class DirectoryServicer(directory_service_pb2_grpc.DirectoryServiceServicer):
+    def ListServiceEntries(self, request, context):
+        response = directory_pb2.ListServiceEntriesResponse()
+        for name, service_type, authority in SERVICES:
+            response.service_entries.add(name=name, type=service_type, authority=authority)
+        populate_response_header(response, request)
+        return response
+
+    def GetServiceEntry(self, request, context):
+        response = directory_pb2.GetServiceEntryResponse(status=directory_pb2.GetServiceEntryResponse.STATUS_NONEXISTENT_SERVICE)
+        for name, service_type, authority in SERVICES:
+            if name == request.service_name:
+                response.status = directory_pb2.GetServiceEntryResponse.STATUS_OK
+                response.service_entry.CopyFrom(directory_pb2.ServiceEntry(name=name, type=service_type, authority=authority))
+        populate_response_header(response, request)
+        return response
+
+class AuthServicer(auth_service_pb2_grpc.AuthServiceServicer):
+    def GetAuthToken(self, request, context):
+        # Any user is welcome
+        response = auth_pb2.GetAuthTokenResponse(status=auth_pb2.GetAuthTokenResponse.STATUS_OK, token=TOKEN)
+        populate_response_header(response, request)
+        return response
+
+class PayloadRegistrationServicer(payload_registration_service_pb2_grpc.PayloadRegistrationServiceServicer):
+    def GetPayloadAuthToken(self, request, context):
+        # Any payload is welcome
+        response = payload_registration_pb2.GetPayloadAuthTokenResponse(
+            status=payload_registration_pb2.GetPayloadAuthTokenResponse.STATUS_OK, token=TOKEN)
+        populate_response_header(response, request)
+        return response
+
+class TimeSyncServicer(time_sync_service_pb2_grpc.TimeSyncServiceServicer):
+    def TimeSyncUpdate(self, request, context):
+        # The local clock is the robot's clock, the sync is established from the first exchange.
+        response = time_sync_pb2.TimeSyncUpdateResponse(clock_identifier=CLOCK_IDENTIFIER)
+        response.state.status = time_sync_pb2.TimeSyncState.STATUS_OK
+        response.state.best_estimate.round_trip_time.CopyFrom(bosdyn.util.seconds_to_duration(0))
+        response.state.best_estimate.clock_skew.CopyFrom(bosdyn.util.seconds_to_duration(0))
+        response.state.measurement_time.CopyFrom(bosdyn.util.now_timestamp())
+        populate_response_header(response, request)
+        response.header.response_timestamp.CopyFrom(bosdyn.util.now_timestamp())
+        return response
+
+class ImageServicer(image_service_pb2_grpc.ImageServiceServicer):
+    """
+    Serves the frames in a loop at a fixed frame rate, the same frame to every source, as a robot would.
+    """
+    def __init__(self, frames, fps=15):
+        self.frames = frames
+        self.fps = fps
+        self.start = time.time()
+        self.decoded = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def current_frame(self):
+        """
+        Returns the index and acquisition time of the frame of the moment.
+        """
+        index = int((time.time() - self.start) * self.fps)
+        return index % len(self.frames), self.start + index / self.fps
+
+    def raw_frame(self, index):
+        """
+        Returns the frame decoded to greyscale pixels, decoding each frame once only.
+        """
+        with self.lock:
+            if index not in self.decoded:
+                self.decoded[index] = cv.imdecode(np.frombuffer(self.frames[index], np.uint8), cv.IMREAD_GRAYSCALE).tobytes()
+            return self.decoded[index]
+
+    def ListImageSources(self, request, context):
+        response = image_pb2.ListImageSourcesResponse()
+        for name in IMAGE_SOURCES:
+            response.image_sources.add(name=name, rows=ROWS, cols=COLS, image_type=image_pb2.ImageSource.IMAGE_TYPE_VISUAL)
+        populate_response_header(response, request)
+        return response
+
+    def GetImage(self, request, context):
+        with self.lock:
+            self.requests += 1
+        index, acquisition_time = self.current_frame()
+        response = image_pb2.GetImageResponse()
+        for image_request in request.image_requests:
+            image_response = response.image_responses.add()
+            image_response.source.name = image_request.image_source_name
+            if image_request.image_source_name not in IMAGE_SOURCES:
+                image_response.status = image_pb2.ImageResponse.STATUS_UNKNOWN_CAMERA
+                continue
+            image_response.status = image_pb2.ImageResponse.STATUS_OK
+            image_response.source.rows = ROWS
+            image_response.source.cols = COLS
+            image_response.source.image_type = image_pb2.ImageSource.IMAGE_TYPE_VISUAL
+            image_response.shot.acquisition_time.CopyFrom(bosdyn.util.seconds_to_timestamp(acquisition_time))
+            image_response.shot.frame_name_image_sensor = image_request.image_source_name
+            image = image_response.shot.image
+            image.rows = ROWS
+            image.cols = COLS
+            image.pixel_format = image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8
+            if image_request.image_format == image_pb2.Image.FORMAT_RAW:
+                image.format = image_pb2.Image.FORMAT_RAW
+                image.data = self.raw_frame(index)
+            else:
+                image.format = image_pb2.Image.FORMAT_JPEG
+                image.data = self.frames[index]
+        populate_response_header(response, request)
+        return response
+
+class SpotStandIn(object):
+    """
+    A TLS gRPC server answering as a robot on a local port.
+    """
+    def __init__(self, frames=None, fps=15, port=0, cert_dir=None, max_workers=16):
+        """
+        Construct a new SpotStandIn instance and start its server.
+
+            Parameters:
+                frames (list): JPEG frames to serve, synthetic frames when not given
+                fps (float): Frame rate of the image sources
+                port (int): Port to listen on, 0 for any free port
+                cert_dir (str): Directory to write the certificate to, a temporary one when not given
+                max_workers (int): Number of threads answering the requests
+        """
+        if cert_dir is None:
+            self.temp_dir = tempfile.TemporaryDirectory()
+            cert_dir = self.temp_dir.name
+        self.cert_path, key_path = make_certificate(cert_dir)
+        with open(self.cert_path, 'rb') as f:
+            cert = f.read()
+        with open(key_path, 'rb') as f:
+            key = f.read()
+
+        self.image_servicer = ImageServicer(frames or synthetic_frames(), fps)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        directory_service_pb2_grpc.add_DirectoryServiceServicer_to_server(DirectoryServicer(), self.server)
+        auth_service_pb2_grpc.add_AuthServiceServicer_to_server(AuthServicer(), self.server)
+        payload_registration_service_pb2_grpc.add_PayloadRegistrationServiceServicer_to_server(PayloadRegistrationServicer(), self.server)
+        time_sync_service_pb2_grpc.add_TimeSyncServiceServicer_to_server(TimeSyncServicer(), self.server)
+        image_service_pb2_grpc.add_ImageServiceServicer_to_server(self.image_servicer, self.server)
+        self.port = self.server.add_secure_port(f'127.0.0.1:{port}', grpc.ssl_server_credentials([(key, cert)]))
+        self.server.start()
+
+    def environment(self):
+        """
+        Returns the environment variables pointing the web application at the stand-in.
+        """
+        return {
+            'ROBOT_IP': '127.0.0.1',
+            'ROBOT_PORT': str(self.port),
+            'ROBOT_CERT': self.cert_path,
+            'GUID': 'spot-stand-in',
+            'SECRET': 'spot-stand-in',
+        }
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self.server.stop(None)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on, 0 for any free port')
+    parser.add_argument('--fps', type=float, default=15, help='Frame rate of the image sources')
+    parser.add_argument('--frames-dir', help='Directory of recorded JPEG frames to serve, instead of synthetic ones')
+    parser.add_argument('--cert-dir', help='Directory to write the certificate to')
+    options = parser.parse_args()
+
+    frames = recorded_frames(options.frames_dir) if options.frames_dir else None
+    stand_in = SpotStandIn(frames, options.fps, options.port, options.cert_dir)
+    for name, value in stand_in.environment().items():
+        print(f'{name}={value}')
+    try:
+        stand_in.server.wait_for_termination()
+    except KeyboardInterrupt:
+        stand_in.stop()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Load benchmark of the Spot Cameras Service, without robot nor camera.
+
+The service runs in a child process, on synthetic (or video file) frames instead of the devices and
+without registering to a robot directory. GetImage is then called over local gRPC by concurrent
+clients, and the latency percentiles, the frame rate, the CPU time of the service per image and the
+hits and misses of its encode caches are reported.
+
+    python benchmark_spot_cameras_image_service.py --concurrency 4 --image-format JPEG --duration 10
+"""
+
+# Imports
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import cv2
+import grpc
+import numpy as np
+
+## Boston Dynamics
+import bosdyn.util
+from bosdyn.api import image_pb2
+from bosdyn.api import image_service_pb2_grpc
+from bosdyn.client.server_util import GrpcServiceRunner
+
+# Local Imports
+import spot_cameras_image_service
+
+# Variables
+_LOGGER = logging.getLogger(__name__)
+
+
+# Main
+class SyntheticCapture(object):
+    """Stand-in for cv2.VideoCapture, delivering frames at a fixed rate.
+
+    The frames are generated, or read in a loop from a video file. In MJPEG mode (CAP_PROP_FOURCC set to
+    MJPG and CAP_PROP_CONVERT_RGB to 0) they are delivered as JPEG buffers, encoded ahead of time since a
+    real device encodes them itself.
+    """
+
+    def __init__(self, device_name, rows=480, cols=640, fps=30, video=None):
+        self.rows = rows
+        self.cols = cols
+        self.period = 1.0 / fps
+        self.next_read = time.monotonic()
+        self.frames = synthetic_frames(rows, cols) if video is None else video_frames(video, rows, cols)
+        self.jpeg_frames = None
+        self.fourcc = 0
+        self.convert_rgb = 1
+        self.index = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FRAME_HEIGHT: self.rows, cv2.CAP_PROP_FRAME_WIDTH: self.cols,
+                cv2.CAP_PROP_FOURCC: self.fourcc, cv2.CAP_PROP_CONVERT_RGB: self.convert_rgb}.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FOURCC:
+            self.fourcc = value
+        elif prop == cv2.CAP_PROP_CONVERT_RGB:
+            self.convert_rgb = value
+        else:
+            return False
+        return True
+
+    def read(self):
+        # Block until the next frame is due, like a device does.
+        self.next_read = max(self.next_read + self.period, time.monotonic())
+        time.sleep(max(0, self.next_read - time.monotonic()))
+        self.index = (self.index + 1) % len(self.frames)
+        if self.fourcc == cv2.VideoWriter_fourcc(*'MJPG') and not self.convert_rgb:
+            if self.jpeg_frames is None:
+                self.jpeg_frames = [cv2.imencode('.jpg', frame)[1].reshape(1, -1) for frame in self.frames]
+            return True, self.jpeg_frames[self.index]
+        return True, self.frames[self.index].copy()
+
+    def release(self):
+        pass
+
+
+def synthetic_frames(rows, cols, count=30):
+    # Moving gradients with some noise, so that the JPEG encoder has some work to do.
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:rows, 0:cols]
+    frames = []
+    for i in range(count):
+        frame = np.stack([(x + 8 * i) % 256, (y + 4 * i) % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+        frame = cv2.add(frame, rng.integers(0, 32, frame.shape, dtype=np.uint8))
+        frames.append(frame)
+    return frames
+
+
+def video_frames(video, rows, cols, count=300):
+    capture = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < count:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(cv2.resize(frame, (cols, rows), interpolation=cv2.INTER_AREA))
+    capture.release()
+    if not frames:
+        raise Exception("Unable to read frames from %s" % video)
+    return frames
+
+
+class LocalTimeSync(object):
+    """Time sync of the LocalRobot, the local clock is the robot's clock."""
+
+    def wait_for_sync(self, timeout_sec=None):
+        pass
+
+    def robot_timestamp_from_local_secs(self, local_time_secs):
+        return bosdyn.util.seconds_to_timestamp(local_time_secs)
+
+
+class LocalFaultClient(object):
+    """Fault client of the LocalRobot, whatever the SDK version calls on it does nothing."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class LocalRobot(object):
+    """Stand-in for the bosdyn Robot, providing what the image servicer needs."""
+
+    def __init__(self):
+        self.time_sync = LocalTimeSync()
+
+    def ensure_client(self, service_name):
+        return LocalFaultClient()
+
+
+def serve(options, port, commands, results):
+    # Runs the service on synthetic captures, and reports its CPU time between the start and stop commands,
+    # and the counters of its encode caches.
+    spot_cameras_image_service.cv2.VideoCapture = lambda device_name: SyntheticCapture(
+        device_name, options.rows, options.cols, options.fps, options.video)
+    servicer = spot_cameras_image_service.make_spot_cameras_image_service(
+        LocalRobot(), 'benchmark-image-service', options.device_name, virtual_sources=options.virtual_source)
+    service_runner = GrpcServiceRunner(servicer, image_service_pb2_grpc.add_ImageServiceServicer_to_server, port)
+    results.put(service_runner.port)
+    assert commands.get() == 'start'
+    cpu_start = time.process_time()
+    stats_start = servicer.encode_cache_stats()
+    assert commands.get() == 'stop'
+    results.put(time.process_time() - cpu_start)
+    results.put({source_name: {counter: stats[counter] - stats_start[source_name][counter] for counter in ('hits', 'misses')}
+                 for source_name, stats in servicer.encode_cache_stats().items()})
+    service_runner.stop()
+
+
+def make_request(options, source_names):
+    image_requests = []
+    for source_name in source_names:
+        image_requests.append(image_pb2.ImageRequest(
+            image_source_name=source_name,
+            image_format=image_pb2.Image.Format.Value('FORMAT_' + options.image_format),
+            pixel_format=image_pb2.Image.PixelFormat.Value('PIXEL_FORMAT_' + options.pixel_format),
+            quality_percent=options.quality_percent, resize_ratio=options.resize_ratio))
+    return image_pb2.GetImageRequest(image_requests=image_requests)
+
+
+def drive(stub, request, deadline, latencies, acquisitions, errors):
+    # Calls GetImage in a loop until the deadline, recording the latencies and the frames received.
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        response = stub.GetImage(request)
+        latencies.append(time.monotonic() - start)
+        for image_response in response.image_responses:
+            if image_response.status != image_pb2.ImageResponse.STATUS_OK:
+                errors.append(image_pb2.ImageResponse.Status.Name(image_response.status))
+                continue
+            acquisitions.add((image_response.source.name, image_response.shot.acquisition_time.seconds,
+                              image_response.shot.acquisition_time.nanos))
+
+
+def wait_for_result(server, results):
+    # Fails fast if the service process died instead of answering.
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not server.is_alive():
+                raise Exception("The image service exited with code %s" % server.exitcode)
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile.
+    index = max(0, int(np.ceil(percent / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def run_benchmark(options):
+    context = multiprocessing.get_context('spawn')
+    commands, results = context.Queue(), context.Queue()
+    server = context.Process(target=serve, args=(options, options.port, commands, results), daemon=True)
+    server.start()
+    port = wait_for_result(server, results)
+
+    channel = grpc.insecure_channel('127.0.0.1:%d' % port)
+    stub = image_service_pb2_grpc.ImageServiceStub(channel)
+    sources = [source.name for source in stub.ListImageSources(image_pb2.ListImageSourcesRequest()).image_sources]
+    request = make_request(options, sources[:options.sources_per_request])
+
+    # Warm up until every source delivered a frame.
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        response = stub.GetImage(request)
+        if all(r.status == image_pb2.ImageResponse.STATUS_OK for r in response.image_responses):
+            break
+        time.sleep(0.1)
+
+    latencies, acquisitions, errors = [], set(), []
+    commands.put('start')
+    start = time.monotonic()
+    deadline = start + options.duration
+    clients = [threading.Thread(target=drive, args=(stub, request, deadline, latencies, acquisitions, errors))
+               for _ in range(options.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.monotonic() - start
+    commands.put('stop')
+    cpu_seconds = wait_for_result(server, results)
+    encode_cache = wait_for_result(server, results)
+    server.join(timeout=10)
+    channel.close()
+
+    latencies.sort()
+    images = len(latencies) * len(request.image_requests) - len(errors)
+    return {
+        'sources': [image_request.image_source_name for image_request in request.image_requests],
+        'concurrency': options.concurrency,
+        'image_format': options.image_format,
+        'pixel_format': options.pixel_format,
+        'resize_ratio': options.resize_ratio,
+        'quality_percent': options.quality_percent,
+        'duration_s': round(elapsed, 3),
+        'requests': len(latencies),
+        'errors': len(errors),
+        'latency_p50_ms': round(1000 * percentile(latencies, 50), 3) if latencies else None,
+        'latency_p95_ms': round(1000 * percentile(latencies, 95), 3) if latencies else None,
+        'latency_p99_ms': round(1000 * percentile(latencies, 99), 3) if latencies else None,
+        'images_per_s': round(images / elapsed, 2),
+        'distinct_frames_per_s': round(len(acquisitions) / elapsed, 2),
+        'service_cpu_ms_per_image': round(1000 * cpu_seconds / images, 3) if images else None,
+        'encode_cache_hits': sum(stats['hits'] for stats in encode_cache.values()),
+        'encode_cache_misses': sum(stats['misses'] for stats in encode_cache.values()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False, description=__doc__.splitlines()[0])
+    spot_cameras_image_service.add_cam_arguments(parser)
+    parser.add_argument('--port', type=int, default=0, help='Port of the service, 0 for any free port')
+    parser.add_argument('--duration', type=float, default=10, help='Duration of the measure, in seconds')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of clients calling GetImage at once')
+    parser.add_argument('--sources-per-request', type=int, default=1,
+                        help='Number of the listed sources requested by each GetImage call')
+    parser.add_argument('--image-format', default='JPEG', choices=['JPEG', 'RAW', 'UNKNOWN'])
+    parser.add_argument('--pixel-format', default='UNKNOWN', choices=['UNKNOWN', 'RGB_U8', 'GREYSCALE_U8'])
+    parser.add_argument('--resize-ratio', type=float, default=0, help='0 for the default of the source')
+    parser.add_argument('--quality-percent', type=float, default=0, help='0 for the default of the source')
+    parser.add_argument('--rows', type=int, default=480, help='Height of the synthetic frames')
+    parser.add_argument('--cols', type=int, default=640, help='Width of the synthetic frames')
+    parser.add_argument('--fps', type=float, default=30, help='Frame rate of the synthetic devices')
+    parser.add_argument('--video', help='Video file to read the frames from, instead of generating them')
+    parser.add_argument('--json', help='File to write the results to, as JSON')
+    options = parser.parse_args()
+    if not options.device_name and not options.virtual_source:
+        options.device_name = ['0']
+
+    results = run_benchmark(options)
+    for key, value in results.items():
+        print('%-26s %s' % (key, value))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
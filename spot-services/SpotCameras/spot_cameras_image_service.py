@@ -10,6 +10,12 @@
 #   * Added environment variables
 #   * Removed a lot of the argparse logic (replaced by environment variables)
 #   * Edited the device_name_to_source_name adequatly generate source name from rtsp requests
+#   * Moved the capture to a dedicated thread per device, GetImage answers with the latest frame
+#   * Honored the resize ratio and quality of the image requests, with configurable defaults per source
+#   * Added an LRU cache of the encoded images, shared by the requests for the same frame and parameters
+#   * Added an MJPEG mode, forwarding the JPEG frames of the device untouched when possible
+#   * Fulfilled the GetImage requests naming several sources in parallel
+#   * Added virtual sources, with their own defaults, over the capture of a device
 
 #!/usr/bin/env python
 """Register and run the Spot Cameras Service."""
@@ -17,7 +23,10 @@
 # Imports
 import logging
 import os
+import threading
 import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 
@@ -26,7 +35,7 @@ import bosdyn.util
 from bosdyn.client.directory_registration import (DirectoryRegistrationClient,
                                                   DirectoryRegistrationKeepAlive)
 from bosdyn.client.util import setup_logging
-from bosdyn.client.server_util import GrpcServiceRunner
+from bosdyn.client.server_util import GrpcServiceRunner, populate_response_header
 from bosdyn.api import image_pb2
 from bosdyn.api import image_service_pb2_grpc
 from bosdyn.client.image_service_helpers import (VisualImageSource, CameraBaseImageServicer,
@@ -47,16 +56,94 @@ SECRET = os.getenv('SECRET')
 CAMERA_PORT = os.getenv('CAMERA_PORT')
 ROBOT_IP = os.getenv('ROBOT_IP')
 SELF_IP = os.getenv('SELF_IP')
+# Oldest frame GetImage answers with, in seconds, before reporting a capture failure
+MAX_FRAME_AGE = float(os.getenv('MAX_FRAME_AGE', 2.0))
+# Used when an image request leaves them unset, can be overridden per source (e.g. RESIZE_RATIO_VIDEO99)
+RESIZE_RATIO = float(os.getenv('RESIZE_RATIO', 0.3))
+QUALITY_PERCENT = float(os.getenv('QUALITY_PERCENT', 50))
+# Number of encoded images kept per device
+ENCODE_CACHE_SIZE = int(os.getenv('ENCODE_CACHE_SIZE', 16))
+# Number of lookups between two logs of the encode cache hit and miss counters, 0 to disable them
+ENCODE_CACHE_LOG_PERIOD = int(os.getenv('ENCODE_CACHE_LOG_PERIOD', 1000))
+# Request MJPEG from the devices, can be overridden per source (e.g. MJPEG_VIDEO99)
+MJPEG = os.getenv('MJPEG', 'false').lower() == 'true'
+# Number of sources of a GetImage request captured and encoded at once
+GET_IMAGE_WORKERS = int(os.getenv('GET_IMAGE_WORKERS', 4))
 
 # Variables
 _LOGGER = logging.getLogger(__name__)
 
+# Frame of the latest-frame buffer, capture_id increases with every frame read from the device.
+# In MJPEG mode, jpeg holds the frame as compressed by the device and image is None.
+CapturedFrame = namedtuple('CapturedFrame', ['capture_id', 'image', 'jpeg'], defaults=[None])
+# Image data and fields of an image proto, as cached by the EncodeCache
+EncodedImage = namedtuple('EncodedImage', ['data', 'format', 'pixel_format', 'rows', 'cols'])
+
+
+class EncodeCache(object):
+    """LRU cache of the encoded images, counting its hits and misses.
+
+    A request for an image being encoded waits for it instead of encoding it again, so the requests
+    coming in during the same frame interval share a single encode. The counters are read with stats,
+    and logged every log_period lookups.
+    """
+
+    def __init__(self, name, size=ENCODE_CACHE_SIZE, log_period=ENCODE_CACHE_LOG_PERIOD):
+        self.name = name
+        self.size = size
+        self.log_period = log_period
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_create(self, key, create):
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self._count(hit=True)
+                    return self.entries[key]
+                pending = self.pending.get(key)
+                if pending is None:
+                    pending = self.pending[key] = threading.Event()
+                    self._count(hit=False)
+                    break
+            # Another request is encoding the same image, look it up again once done.
+            pending.wait()
+        try:
+            value = create()
+            with self.lock:
+                self.entries[key] = value
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.set()
+
+    def stats(self):
+        # Counters of the cache, consistent with each other.
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def _count(self, hit):
+        # Called with the lock held.
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.log_period and (self.hits + self.misses) % self.log_period == 0:
+            _LOGGER.info("Encode cache of %s: %d hits, %d misses", self.name, self.hits, self.misses)
+
 
 # Main
 class SpotCameras(CameraInterface):
     """Provide access to the latest camera data using openCV's VideoCapture."""
 
-    def __init__(self, device_name):
+    def __init__(self, device_name, resize_ratio=RESIZE_RATIO, quality_percent=QUALITY_PERCENT, mjpeg=MJPEG):
         # Check if the user is passing an index to a camera port, i.e. "0" to get the first
         # camera in the operating system's enumeration of available devices. The VideoCapture
         # takes either a filepath to the device (as a string), or a index to the device (as an
@@ -84,6 +171,15 @@ class SpotCameras(CameraInterface):
             _LOGGER.warning(err)
             raise Exception(err)
 
+        self.mjpeg = False
+        if mjpeg:
+            # Ask the device for MJPEG, and OpenCV for the compressed frames instead of decoding them.
+            self.mjpeg = (self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG')) and
+                          self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+            if not self.mjpeg:
+                _LOGGER.warning("%s does not support MJPEG, its frames will be decoded.", device_name)
+                self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+
         # Attempt to determine the gain and exposure for the camera.
         self.camera_exposure, self.camera_gain = None, None
         try:
@@ -101,68 +197,233 @@ class SpotCameras(CameraInterface):
         self.rows = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
         self.cols = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
 
-        self.default_jpeg_quality = 75
+        if not 0 < resize_ratio <= 1:
+            raise ValueError("Resize ratio %s is out of bounds." % resize_ratio)
+        self.default_resize_ratio = resize_ratio
+        self.default_jpeg_quality = quality_percent
+
+        # Resized images of the latest frame, by (capture id, resize ratio).
+        self.resize_cache = {}
+        self.resize_lock = threading.Lock()
+        # Encoded images, by (capture id, pixel format, image format, quality, resize ratio).
+        self.encode_cache = EncodeCache(self.image_source_name)
+
+        # Latest-frame buffer, filled by the capture thread.
+        self.latest_frame = None
+        self.latest_capture_time = None
+        self.capture_id = 0
+        self.capture_error = None
+        self.frame_condition = threading.Condition()
+        self.capturing = True
+        self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.capture_thread.start()
+
+    def _capture_loop(self):
+        # Read the frames as fast as the device delivers them, so the buffer always holds the freshest one.
+        while self.capturing:
+            success, image = self.capture.read()
+            # read() returns as soon as the device hands over the frame.
+            capture_time = time.time()
+            with self.frame_condition:
+                if success:
+                    self.capture_id += 1
+                    if is_jpeg_buffer(image):
+                        self.latest_frame = CapturedFrame(self.capture_id, None, image.tobytes())
+                    else:
+                        self.latest_frame = CapturedFrame(self.capture_id, image)
+                    self.latest_capture_time = capture_time
+                    self.capture_error = None
+                else:
+                    self.capture_error = "Unsuccessful call to cv2.VideoCapture().read()"
+                self.frame_condition.notify_all()
+            if not success:
+                # Do not spin on a disconnected device.
+                time.sleep(0.1)
+
+    def stop_capturing(self):
+        self.capturing = False
+        self.capture_thread.join(timeout=1)
+        self.capture.release()
 
     def blocking_capture(self):
-        # Get the image from the video capture.
-        capture_time = time.time()
-        success, image = self.capture.read()
-        if success:
-            return image, capture_time
-        else:
-            raise Exception("Unsuccessful call to cv2.VideoCapture().read()")
+        # Only blocks until the first frame is read, then returns the latest frame and its acquisition time.
+        with self.frame_condition:
+            if self.latest_frame is None:
+                self.frame_condition.wait_for(lambda: self.latest_frame is not None or self.capture_error is not None,
+                                              timeout=MAX_FRAME_AGE)
+            if self.latest_frame is None or time.time() - self.latest_capture_time > MAX_FRAME_AGE:
+                raise Exception(self.capture_error or "No frame read from the device in %s seconds" % MAX_FRAME_AGE)
+            return self.latest_frame, self.latest_capture_time
+
+    def resize(self, frame, resize_ratio):
+        # Concurrent requests for the same frame and ratio share a single decode and resize.
+        if frame.jpeg is None and resize_ratio == 1.0:
+            return frame.image
+        with self.resize_lock:
+            # Only the latest frame is requested again.
+            self.resize_cache = {cached_key: cached for cached_key, cached in self.resize_cache.items()
+                                 if cached_key[0] == frame.capture_id}
+            image = frame.image
+            if image is None:
+                # The full resolution image of an MJPEG frame is its decoded JPEG.
+                image = self.resize_cache.get((frame.capture_id, 1.0))
+                if image is None:
+                    image = cv2.imdecode(np.frombuffer(frame.jpeg, np.uint8), cv2.IMREAD_COLOR)
+                    self.resize_cache[(frame.capture_id, 1.0)] = image
+            if resize_ratio == 1.0:
+                return image
+            key = (frame.capture_id, resize_ratio)
+            resized = self.resize_cache.get(key)
+            if resized is None:
+                rows, cols = image.shape[:2]
+                resized = cv2.resize(image, (int(cols * resize_ratio), int(rows * resize_ratio)),
+                                     interpolation = cv2.INTER_AREA)
+                self.resize_cache[key] = resized
+        return resized
 
     def image_decode(self, image_data, image_proto, image_req):
-        pixel_format = image_req.pixel_format
-        # Convert pixel format.
-        converted_image_data = image_data
-        if pixel_format == image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8:
-            converted_image_data = convert_RGB_to_grayscale(
-                cv2.cvtColor(image_data, cv2.COLOR_BGR2RGB))
-
-        if pixel_format == image_pb2.Image.PIXEL_FORMAT_UNKNOWN:
-            # Hardcode to RGB for simplicity.
-            image_proto.pixel_format = image_pb2.Image.PIXEL_FORMAT_RGB_U8
-        else:
-            image_proto.pixel_format = pixel_format
+        self.decode(image_data, image_proto, image_req, self.default_resize_ratio, self.default_jpeg_quality,
+                    image_pb2.Image.PIXEL_FORMAT_RGB_U8)
 
-        # Note, we are currently not setting any information for the transform snapshot or the frame
-        # name for an image sensor since this information can't be determined with openCV.
-
-        resize_ratio = 0.3
-        quality_percent = 50
+    def decode(self, image_data, image_proto, image_req, default_resize_ratio, default_quality_percent,
+               default_pixel_format):
+        # Requests leaving the resize ratio, the quality or the pixel format unset (0) get the defaults of the source.
+        resize_ratio = image_req.resize_ratio or default_resize_ratio
+        quality_percent = image_req.quality_percent or default_quality_percent
 
         if resize_ratio < 0 or resize_ratio > 1:
             raise ValueError("Resize ratio %s is out of bounds." % resize_ratio)
 
-        if resize_ratio != 1.0 and resize_ratio != 0:
-            image_proto.rows = int(image_proto.rows * resize_ratio)
-            image_proto.cols = int(image_proto.cols * resize_ratio)
-            converted_image_data = cv2.resize(converted_image_data, (image_proto.cols, image_proto.rows),
-                                              interpolation = cv2.INTER_AREA)
+        pixel_format = image_req.pixel_format or default_pixel_format
 
-        # Set the image data.
         image_format = image_req.image_format
         if image_format == image_pb2.Image.FORMAT_RAW:
-            image_proto.data = np.ndarray.tobytes(converted_image_data)
-            image_proto.format = image_pb2.Image.FORMAT_RAW
+            quality = None
         elif image_format == image_pb2.Image.FORMAT_JPEG or image_format == image_pb2.Image.FORMAT_UNKNOWN or image_format is None:
             # If the image format is requested as JPEG or if no specific image format is requested, return
             # a JPEG. Since this service is for a webcam, we choose a sane default for the return if the
             # request format is unpopulated.
-            quality = self.default_jpeg_quality
+            image_format = image_pb2.Image.FORMAT_JPEG
+            quality = default_quality_percent
             if 0 < quality_percent <= 100:
                 # A valid image quality percentage was passed with the image request,
                 # so use this value instead of the service's default.
                 quality = quality_percent
-            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
-            image_proto.data = cv2.imencode('.jpg', converted_image_data, encode_param)[1].tobytes()
-            image_proto.format = image_pb2.Image.FORMAT_JPEG
         else:
             # Unsupported format.
             raise Exception(
                 "Image format %s is unsupported." % image_pb2.Image.Format.Name(image_format))
 
+        if (image_data.jpeg is not None and image_format == image_pb2.Image.FORMAT_JPEG and resize_ratio == 1.0 and
+                pixel_format == image_pb2.Image.PIXEL_FORMAT_RGB_U8 and has_huffman_tables(image_data.jpeg)):
+            # Forward the JPEG of the device, at its own quality.
+            image_proto.data = image_data.jpeg
+            image_proto.format = image_pb2.Image.FORMAT_JPEG
+            image_proto.pixel_format = pixel_format
+            image_proto.rows = self.rows
+            image_proto.cols = self.cols
+            return
+
+        key = (image_data.capture_id, pixel_format, image_format, quality, resize_ratio)
+        encoded = self.encode_cache.get_or_create(
+            key, lambda: self.encode(image_data, pixel_format, image_format, quality, resize_ratio))
+
+        # Note, we are currently not setting any information for the transform snapshot or the frame
+        # name for an image sensor since this information can't be determined with openCV.
+        image_proto.data = encoded.data
+        image_proto.format = encoded.format
+        image_proto.pixel_format = encoded.pixel_format
+        image_proto.rows = encoded.rows
+        image_proto.cols = encoded.cols
+
+    def encode(self, frame, pixel_format, image_format, quality, resize_ratio):
+        # Resize before converting the pixel format, there are less pixels to convert.
+        image_data = self.resize(frame, resize_ratio)
+        rows, cols = image_data.shape[:2]
+
+        # Convert pixel format.
+        converted_image_data = image_data
+        if pixel_format == image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8:
+            converted_image_data = convert_RGB_to_grayscale(
+                cv2.cvtColor(image_data, cv2.COLOR_BGR2RGB))
+
+        # Set the image data.
+        if image_format == image_pb2.Image.FORMAT_RAW:
+            data = np.ndarray.tobytes(converted_image_data)
+        else:
+            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+            data = cv2.imencode('.jpg', converted_image_data, encode_param)[1].tobytes()
+        return EncodedImage(data, image_format, pixel_format, rows, cols)
+
+
+class VirtualSource(CameraInterface):
+    """Image source derived from the capture of a SpotCameras device, with its own defaults.
+
+    All the sources of a device share its capture, its decode of each frame and its caches.
+    """
+
+    def __init__(self, image_source_name, camera, resize_ratio=None, quality_percent=None, pixel_format=None):
+        self.image_source_name = image_source_name
+        self.camera = camera
+        self.default_resize_ratio = resize_ratio or camera.default_resize_ratio
+        if not 0 < self.default_resize_ratio <= 1:
+            raise ValueError("Resize ratio %s is out of bounds." % self.default_resize_ratio)
+        self.default_jpeg_quality = quality_percent or camera.default_jpeg_quality
+        self.default_pixel_format = pixel_format or image_pb2.Image.PIXEL_FORMAT_RGB_U8
+
+    def blocking_capture(self):
+        return self.camera.blocking_capture()
+
+    def image_decode(self, image_data, image_proto, image_req):
+        self.camera.decode(image_data, image_proto, image_req, self.default_resize_ratio, self.default_jpeg_quality,
+                           self.default_pixel_format)
+
+
+class SpotCamerasImageServicer(CameraBaseImageServicer):
+    """Image servicer fulfilling the image requests of a GetImage call in parallel.
+
+    Each image request is handled by the base servicer as a GetImage call of its own, on a bounded
+    worker pool, and the image responses are put back in the order of the request.
+    """
+
+    def __init__(self, *args, max_workers=GET_IMAGE_WORKERS, spot_cameras=(), **kwargs):
+        super(SpotCamerasImageServicer, self).__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='get-image')
+        # Devices of the sources, whose encode caches are reported by encode_cache_stats.
+        self.spot_cameras = list(spot_cameras)
+
+    def encode_cache_stats(self):
+        # Hits, misses and entries of the encode cache of each device, by source name of the device.
+        return {camera.image_source_name: camera.encode_cache.stats() for camera in self.spot_cameras}
+
+    def GetImage(self, request, context):
+        if len(request.image_requests) <= 1:
+            return super(SpotCamerasImageServicer, self).GetImage(request, context)
+
+        def get_single_image(img_req):
+            single_request = image_pb2.GetImageRequest(header=request.header, image_requests=[img_req])
+            return super(SpotCamerasImageServicer, self).GetImage(single_request, context)
+
+        response = image_pb2.GetImageResponse()
+        error_message = None
+        for single_response in self.executor.map(get_single_image, request.image_requests):
+            response.image_responses.extend(single_response.image_responses)
+            error_message = single_response.header.error.message or error_message
+        populate_response_header(response, request, error_msg=error_message)
+        return response
+
+
+def is_jpeg_buffer(image):
+    # OpenCV returns the MJPEG frames as a single row of bytes when it does not decode them.
+    return image.ndim <= 2 and image.shape[0] == 1 and image.size > 2 and image[0, 0] == 0xFF and image[0, 1] == 0xD8
+
+
+def has_huffman_tables(jpeg):
+    # Some UVC devices leave the standard Huffman tables out of their MJPEG frames, which not every decoder
+    # supports. Such frames are decoded and encoded again.
+    start_of_scan = jpeg.find(b'\xff\xda')
+    return jpeg.find(b'\xff\xc4', 0, start_of_scan) != -1
+
 
 def device_name_to_source_name(device_name):
     if type(device_name) == int:
@@ -171,38 +432,87 @@ def device_name_to_source_name(device_name):
         return os.path.basename(device_name)
 
 
-def make_spot_cameras_image_service(bosdyn_sdk_robot, service_name, device_names, logger=None):
+def source_setting(name, source_name, default):
+    # Per source override of a setting, e.g. RESIZE_RATIO_VIDEO99 for the video99 source.
+    value = os.getenv('%s_%s' % (name, source_name.upper()))
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() == 'true'
+    return float(value)
+
+
+def parse_virtual_source(spec):
+    # NAME:DEVICE[:OPTION=VALUE...], the options being resize_ratio, quality_percent and pixel_format,
+    # e.g. video99_thumbnail:99:resize_ratio=0.1 or video99_grey:99:pixel_format=GREYSCALE_U8.
+    name, device, *options = spec.split(':')
+    if not name or not device:
+        raise ValueError("Virtual source %s is not NAME:DEVICE[:OPTION=VALUE...]." % spec)
+    settings = {}
+    for option in options:
+        key, value = option.split('=', 1)
+        if key == 'pixel_format':
+            settings[key] = image_pb2.Image.PixelFormat.Value('PIXEL_FORMAT_' + value.upper())
+        elif key in ('resize_ratio', 'quality_percent'):
+            settings[key] = float(value)
+        else:
+            raise ValueError("Unknown option %s of the virtual source %s." % (key, name))
+    return name, device, settings
+
+
+def make_spot_cameras_image_service(bosdyn_sdk_robot, service_name, device_names, logger=None,
+                                    virtual_sources=()):
+    virtual_sources = [parse_virtual_source(spec) for spec in virtual_sources]
+    # Each device is opened once, even when virtual sources are defined over it.
+    spot_cameras = OrderedDict()
+    for device in list(device_names) + [device for _, device, _ in virtual_sources]:
+        if device in spot_cameras:
+            continue
+        source_name = device_name_to_source_name(int(device) if device.isdigit() else device)
+        spot_cameras[device] = SpotCameras(device, resize_ratio=source_setting('RESIZE_RATIO', source_name, RESIZE_RATIO),
+                                           quality_percent=source_setting('QUALITY_PERCENT', source_name, QUALITY_PERCENT),
+                                           mjpeg=source_setting('MJPEG', source_name, MJPEG))
+
+    sources = [(spot_cameras[device], spot_cameras[device]) for device in device_names]
+    sources += [(VirtualSource(name, spot_cameras[device], **settings), spot_cameras[device])
+                for name, device, settings in virtual_sources]
     image_sources = []
-    for device in device_names:
-        spot_camera = SpotCameras(device)
+    for source, spot_camera in sources:
         # Hard-code supported pixel formats in this tutorial file. Please refer to SDK example on
         # how to determine correct list of supported pixel formats.
-        img_src = VisualImageSource(spot_camera.image_source_name, spot_camera, rows=spot_camera.rows,
+        img_src = VisualImageSource(source.image_source_name, source, rows=spot_camera.rows,
                                     cols=spot_camera.cols, gain=spot_camera.camera_gain,
                                     exposure=spot_camera.camera_exposure,
                                     pixel_formats=[image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8,
                                                    image_pb2.Image.PIXEL_FORMAT_RGB_U8])
         image_sources.append(img_src)
-    return CameraBaseImageServicer(bosdyn_sdk_robot, service_name, image_sources, logger)
+    # The SpotCameras instances already capture in the background, no need for the SDK's capture thread.
+    return SpotCamerasImageServicer(bosdyn_sdk_robot, service_name, image_sources, logger,
+                                    use_background_capture_thread=False, spot_cameras=spot_cameras.values())
 
 
-def run_service(bosdyn_sdk_robot, port, service_name, device_names, logger=None):
+def run_service(bosdyn_sdk_robot, port, service_name, device_names, logger=None, virtual_sources=()):
     # Proto service specific function used to attach a servicer to a server.
     add_servicer_to_server_fn = image_service_pb2_grpc.add_ImageServiceServicer_to_server
 
     # Instance of the servicer to be run.
     service_servicer = make_spot_cameras_image_service(bosdyn_sdk_robot, service_name, device_names,
-                                                       logger=logger)
+                                                       logger=logger, virtual_sources=virtual_sources)
     return GrpcServiceRunner(service_servicer, add_servicer_to_server_fn, port, logger=logger)
 
 
 def add_cam_arguments(parser):
-    # Set the default source as index 0 to point to the first
-    # available device found by the operating system.
+    # No default device here: the first available device is only used when neither devices nor
+    # virtual sources are passed, so that virtual sources alone do not also open device 0.
     parser.add_argument(
         '--device-name',
-        help=('Image source to query. If none are passed, it will default to the first available '
-              'source.'), nargs='*', default=['0'])
+        help=('Image source to query. If none are passed, nor virtual sources, it will default to the '
+              'first available source.'), nargs='*', default=[])
+    parser.add_argument(
+        '--virtual-source',
+        help=('Image source derived from the capture of a device, as NAME:DEVICE[:OPTION=VALUE...], '
+              'with resize_ratio, quality_percent and pixel_format (RGB_U8 or GREYSCALE_U8) options.'),
+        nargs='*', default=[])
 
 
 if __name__ == '__main__':
@@ -214,7 +524,7 @@ if __name__ == '__main__':
     options = parser.parse_args()
 
     devices = options.device_name
-    if not devices:
+    if not devices and not options.virtual_source:
         # No sources were provided. Set the default source as index 0 to point to the first
         # available device found by the operating system.
         devices = ["0"]
@@ -228,7 +538,8 @@ if __name__ == '__main__':
     robot.authenticate_from_payload_credentials(GUID, SECRET)
 
     # Create a service runner to start and maintain the service on background thread.
-    service_runner = run_service(robot, CAMERA_PORT, IMAGE_SERVICE_NAME, devices, logger=_LOGGER)
+    service_runner = run_service(robot, CAMERA_PORT, IMAGE_SERVICE_NAME, devices, logger=_LOGGER,
+                                 virtual_sources=options.virtual_source)
 
     # Use a keep alive to register the service with the robot directory.
     dir_reg_client = robot.ensure_client(DirectoryRegistrationClient.default_service_name)
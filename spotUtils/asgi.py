@@ -4,13 +4,76 @@ ASGI config for spotUtils project.
 It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotUtils.settings')
 
-application = get_asgi_application()
+
+class DisconnectMiddleware(object):
+    """
+    Flags the HTTP requests whose client went away in scope['disconnected'],
+    as Django's ASGI handler does not report it while a response is streamed.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        disconnected = asyncio.Event()
+        scope['disconnected'] = disconnected
+        watcher = None
+
+        async def watch_disconnect():
+            # Django has read the whole request body once the response starts.
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    disconnected.set()
+                    return
+
+        async def send_and_watch(message):
+            nonlocal watcher
+            if message['type'] == 'http.response.start' and watcher is None:
+                watcher = asyncio.ensure_future(watch_disconnect())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_watch)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+class WebSocketRouter(object):
+    """
+    Hands the WebSocket connections over to their ASGI endpoint, and everything else to Django.
+    """
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.app(scope, receive, send)
+        endpoint = self.routes.get(scope['path'])
+        if endpoint is None:
+            # Reject the handshake.
+            await send({'type': 'websocket.close'})
+            return
+        return await endpoint(scope, receive, send)
+
+
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from api.urls import websocket_urlpatterns
+
+application = WebSocketRouter(DisconnectMiddleware(django_application), websocket_urlpatterns)
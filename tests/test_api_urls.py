@@ -2,7 +2,13 @@
 """Tests for Django api urls"""
 
 # Imports
+import os
 import json
+import mock
+import io
+import asyncio
+import tempfile
+import numpy as np
 
 ## Django
 from django.test import TestCase, Client
@@ -10,6 +16,12 @@ from django.urls import reverse, resolve
 
 # Local Imports
 from api.views import *
+from api.views import _camera_factory
+from tests.test_potree_octree import make_octree
+
+## Boston Dynamics
+from bosdyn.client.exceptions import UnableToConnectToRobotError
+from bosdyn.client.image import UnknownImageSourceError
 
 class ApiUrlsTestCase(TestCase):
     """
@@ -70,6 +82,64 @@ class ApiUrlsTestCase(TestCase):
         match = resolve(url)
         self.assertEqual(match.func, getCameraFeed)
     
+    def test_camera_route_only_accepts_get(self):
+        """
+        Test case for checking that the asynchronous GET /api/camera/ API route rejects other methods
+        """
+        response = self.client.post(reverse('api-get-camera-feed'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_camera_route_rejects_invalid_variant(self):
+        """
+        Test case for checking that the GET /api/camera/ API route validates the requested encoding
+        """
+        for query in ['width=0', 'width=wide', 'quality=101', 'format=png', 'camera=hand_image']:
+            response = self.client.get(reverse('api-get-camera-feed') + '?' + query)
+            self.assertEqual(response.status_code, 400)
+
+    @mock.patch('api.views.SpotCameras')
+    @mock.patch('api.views.robot_session_pool')
+    def test_camera_factory_only_invalidates_stale_sessions(self, mock_robot_session_pool, mock_spot_cameras):
+        """
+        Test case for checking that a camera failing to open only drops the robot session on a connection error
+        """
+        session = mock_robot_session_pool.get.return_value
+        mock_spot_cameras.side_effect = UnknownImageSourceError(None)
+        with self.assertRaises(UnknownImageSourceError):
+            _camera_factory('back_fisheye_image')()
+        mock_robot_session_pool.release.assert_called_once_with(session)
+        mock_robot_session_pool.invalidate.assert_not_called()
+
+        mock_robot_session_pool.reset_mock()
+        mock_spot_cameras.side_effect = UnableToConnectToRobotError(None, None)
+        with self.assertRaises(UnableToConnectToRobotError):
+            _camera_factory('back_fisheye_image')()
+        mock_robot_session_pool.invalidate.assert_called_once_with(session)
+        mock_robot_session_pool.release.assert_not_called()
+
+        # The session is released along with the capture loop
+        mock_robot_session_pool.reset_mock()
+        mock_spot_cameras.side_effect = None
+        _camera_factory('back_fisheye_image')()
+        mock_robot_session_pool.release.assert_not_called()
+        mock_spot_cameras.call_args.kwargs['on_stop']()
+        mock_robot_session_pool.release.assert_called_once_with(session)
+
+    def test_camera_socket_rejects_invalid_fps(self):
+        """
+        Test case for checking that the /api/camera/ws/ WebSocket endpoint closes the handshake on an invalid frame rate
+        """
+        sent = []
+        async def receive():
+            return {'type': 'websocket.connect'}
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'websocket', 'path': '/api/camera/ws/', 'query_string': b'camera=back_fisheye_image&fps=0'}
+
+        asyncio.run(cameraFeedSocket(scope, receive, send))
+
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 1008}])
+
     def test_close_camera_route_is_accessible(self):
         """
         Test case for checking availability of the DELETE /api/close-camera/ API route
@@ -106,6 +176,37 @@ class ApiUrlsTestCase(TestCase):
         view_class = match.func.view_class
         self.assertTrue(hasattr(view_class, 'get'))
         self.assertTrue(hasattr(view_class, 'post'))
+
+    def test_pointclouds_invalid_filters_are_rejected(self):
+        """
+        Test case for checking that invalid dates and page sizes of GET /api/pointclouds/ are rejected with 400
+        """
+        url = reverse('api-pointclouds')
+        self.assertEqual(self.client.get(url, {'start': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'page_size': '0'}).status_code, 400)
+        response = self.client.get(url, {'start': '2023-08-01', 'page_size': '10'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual((response['X-Page'], response['X-Page-Count']), ('1', '1'))
+
+    def test_pointclouds_are_listed(self):
+        """
+        Test case for checking that GET /api/pointclouds/ returns the list of the pointclouds, complete unless a page is requested
+        """
+        url = reverse('api-pointclouds')
+        with mock.patch('api.views.AvailablePointcloudsHelper') as helper_class:
+            helper = helper_class.return_value
+            helper.list.return_value = {'count': 3, 'page': 1, 'pages': 1, 'results': [{'name': 'spot20230813142200'}]}
+
+            response = self.client.get(url)
+            self.assertEqual(response.json(), [{'name': 'spot20230813142200'}])
+            self.assertEqual(response['X-Total-Count'], '3')
+            helper.list.assert_called_with(None, None, 1, None)
+
+            self.client.get(url, {'page': '2'})
+            helper.list.assert_called_with(None, None, '2', 50)
+            self.client.get(url, {'page_size': '1000'})
+            helper.list.assert_called_with(None, None, 1, 500)
     
     def test_spot_slam_endpoints_are_accessible(self):
         """
@@ -118,3 +219,122 @@ class ApiUrlsTestCase(TestCase):
         view_class = match.func.view_class
         self.assertFalse(hasattr(view_class, 'get'))
         self.assertTrue(hasattr(view_class, 'post'))
+
+    def _make_octree(self, data_dir):
+        potree_dir = os.path.join(data_dir, 'spot20230813142200', 'pointclouds', 'spot')
+        os.makedirs(potree_dir)
+        with open(os.path.join(potree_dir, 'octree.bin'), 'wb') as f:
+            f.write(bytes(range(256)))
+        return reverse('api-pointcloud-data', args=['spot20230813142200', 'octree.bin'])
+
+    def test_pointcloud_data_ranges_and_validators(self):
+        """
+        Test case for checking byte ranges and conditional requests of the /api/pointclouds/<name>/data/ API endpoint
+        """
+        with tempfile.TemporaryDirectory() as data_dir, mock.patch('api.views.DATA_DIR', data_dir):
+            url = self._make_octree(data_dir)
+
+            response = self.client.get(url, HTTP_RANGE='bytes=16-31')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), bytes(range(16, 32)))
+            self.assertEqual(response['Content-Range'], 'bytes 16-31/256')
+            self.assertEqual(response['Content-Length'], '16')
+
+            etag = response['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=16-31', HTTP_IF_RANGE='"other"').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=300-').status_code, 416)
+            self.assertEqual(self.client.head(url).status_code, 200)
+            self.assertEqual(self.client.post(url).status_code, 405)
+            self.assertEqual(self.client.get(reverse('api-pointcloud-data', args=['spot20230813142200', 'cloud.pcd'])).status_code, 404)
+            self.assertEqual(self.client.get(reverse('api-pointcloud-data', args=['spot20230813142201', 'octree.bin'])).status_code, 404)
+
+    def test_pointcloud_data_accel_redirect(self):
+        """
+        Test case for checking that the /api/pointclouds/<name>/data/ API endpoint hands the transfer off to nginx when configured
+        """
+        with tempfile.TemporaryDirectory() as data_dir, mock.patch('api.views.DATA_DIR', data_dir), \
+                mock.patch('api.views.POINTCLOUD_ACCEL_REDIRECT', '/pointcloud-data/'):
+            url = self._make_octree(data_dir)
+
+            response = self.client.get(url, HTTP_RANGE='bytes=16-31')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/pointcloud-data/spot20230813142200/pointclouds/spot/octree.bin')
+        self.assertEqual(response.content, b'')
+
+    def test_pointcloud_thumbnail(self):
+        """
+        Test case for checking that the /api/pointclouds/<name>/thumbnail API endpoint serves the cached thumbnail, or schedules it
+        """
+        Pointcloud.objects.create(name='spot20230813142200', timestamp='2023-08-13T14:22:00Z', metadata_mtime_ns=0x1234)
+        url = reverse('api-pointcloud-thumbnail', args=['spot20230813142200'])
+        with tempfile.TemporaryDirectory() as cache_dir, mock.patch('api.views.PointcloudThumbnails') as mock_thumbnails_class:
+            thumbnails = mock_thumbnails_class.return_value
+            thumbnails.path.return_value = os.path.join(cache_dir, 'thumbnail.png')
+
+            self.assertEqual(self.client.get(url).status_code, 404)
+            thumbnails.schedule.assert_called_once_with('spot20230813142200', 0x1234)
+
+            with open(thumbnails.path.return_value, 'wb') as f:
+                f.write(b'\x89PNG')
+            response = self.client.get(url + '?v=1234')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'\x89PNG')
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(self.client.get(url)['Cache-Control'], 'no-cache')
+
+        self.assertEqual(self.client.get(reverse('api-pointcloud-thumbnail', args=['spot20230813142201'])).status_code, 404)
+
+    def test_pointcloud_extract(self):
+        """
+        Test case for checking that the /api/pointclouds/<name>/extract API endpoint streams the points in a box
+        """
+        url = reverse('api-pointcloud-extract', args=['spot20230813142200'])
+        with tempfile.TemporaryDirectory() as data_dir, mock.patch('api.views.DATA_DIR', data_dir):
+            points = make_octree(os.path.join(data_dir, 'spot20230813142200', 'pointclouds', 'spot'))
+            coordinates = points['xyz'] * 0.01
+            inside = np.all((coordinates >= [2, 2, 2]) & (coordinates <= [9, 10, 11]), axis=1)
+
+            response = self.client.get(url, {'min': '2,2,2', 'max': '9,10,11', 'format': 'npy'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="spot20230813142200-extract.npy"')
+            data = b''.join(response.streaming_content)
+            self.assertEqual(len(data), int(response['Content-Length']))
+            extract = np.load(io.BytesIO(data))
+            self.assertEqual(sorted(extract['intensity'].tolist()), sorted(points['intensity'][inside].tolist()))
+
+            response = self.client.get(url, {'min': '2,2,2', 'max': '9,10,11', 'level': '0'})
+            self.assertEqual(response['Content-Type'], 'application/vnd.las')
+            self.assertEqual(len(b''.join(response.streaming_content)), 227 + 26 * int(inside[:100].sum()))
+
+            self.assertEqual(self.client.get(url, {'min': '2,2', 'max': '9,10,11'}).status_code, 400)
+            self.assertEqual(self.client.get(url, {'min': '2,2,2', 'max': '9,10,11', 'level': '-1'}).status_code, 400)
+            self.assertEqual(self.client.get(url, {'min': '2,2,2', 'max': '9,10,11', 'format': 'e57'}).status_code, 400)
+            self.assertEqual(self.client.post(url).status_code, 405)
+            self.assertEqual(self.client.get(reverse('api-pointcloud-extract', args=['spot20230813142201']),
+                                             {'min': '2,2,2', 'max': '9,10,11'}).status_code, 404)
+
+    def test_pointcloud_export(self):
+        """
+        Test case for checking that the /api/pointclouds/<name>/export API endpoint streams all the points of a pointcloud
+        """
+        url = reverse('api-pointcloud-export', args=['spot20230813142200'])
+        with tempfile.TemporaryDirectory() as data_dir, mock.patch('api.views.DATA_DIR', data_dir):
+            points = make_octree(os.path.join(data_dir, 'spot20230813142200', 'pointclouds', 'spot'))
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/vnd.las')
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="spot20230813142200.las"')
+            data = b''.join(response.streaming_content)
+            self.assertEqual(len(data), int(response['Content-Length']))
+            self.assertEqual(len(data), 227 + 26 * len(points))
+
+            export = np.load(io.BytesIO(b''.join(self.client.get(url, {'format': 'npy'}).streaming_content)))
+            self.assertEqual(sorted(export['intensity'].tolist()), sorted(points['intensity'].tolist()))
+
+            self.assertEqual(self.client.get(url, {'format': 'e57'}).status_code, 400)
+            self.assertEqual(self.client.post(url).status_code, 405)
+            self.assertEqual(self.client.get(reverse('api-pointcloud-export', args=['spot20230813142201'])).status_code, 404)
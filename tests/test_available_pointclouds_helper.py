@@ -2,15 +2,19 @@
 """Tests for available_pointclouds_helper script"""
 
 # Imports
+import os
+import json
 import mock
 import time
+import shutil
 import datetime
-import subprocess
+import tempfile
 
 ## Django
 from django.test import TestCase
 
 ## Local Imports
+from api.models import Pointcloud
 from api.scripts.available_pointclouds_helper import AvailablePointcloudsHelper
 
 class TestAvailablePointcloudsHelper(TestCase):
@@ -31,47 +35,107 @@ class TestAvailablePointcloudsHelper(TestCase):
 
     self.assertEqual(result, ['spot20230813142200', 'spot20230813142201'])
 
-  def test_list(self):
+  def _make_pointcloud(self, name, points=1000, bounding_box=([0, 0, 0], [10, 20, 3])):
+    potree_dir = os.path.join(self.data_dir.name, name, 'pointclouds', 'spot')
+    os.makedirs(potree_dir, exist_ok=True)
+    with open(os.path.join(potree_dir, 'metadata.json'), 'w') as f:
+      json.dump({'version': '2.0', 'points': points, 'boundingBox': {'min': bounding_box[0], 'max': bounding_box[1]}}, f)
+    for file_name in ['hierarchy.bin', 'octree.bin']:
+      with open(os.path.join(potree_dir, file_name), 'wb') as f:
+        f.write(b'\0' * 100)
+
+  def _make_helper(self):
     helper = AvailablePointcloudsHelper()
+    helper.pointclouds_dir = self.data_dir.name
+    return helper
 
-    helper.pointclouds = ['spot20230813142200', 'spot20230813142201']
-
-    expected_result = [
-      {
-        'name': 'spot20230813142201',
-        'date': '13/08/2023 14:22:01',
-        'timestamp': int(time.mktime(datetime.datetime(2023, 8, 13, 14, 22, 1).timetuple()))
-      },
-      {
-        'name': 'spot20230813142200',
-        'date': '13/08/2023 14:22:00',
-        'timestamp': int(time.mktime(datetime.datetime(2023, 8, 13, 14, 22, 0).timetuple()))
-      }
-    ]
+  def setUp(self):
+    self.data_dir = tempfile.TemporaryDirectory()
 
-    result = helper.list()
+  def tearDown(self):
+    self.data_dir.cleanup()
 
-    self.assertEqual(result, expected_result)
-  
-  @mock.patch('api.scripts.available_pointclouds_helper.subprocess.run')
-  @mock.patch('logging.Logger.info')
-  def test_collect_new_pointclouds_success(self, mock_logger_info, mock_subprocess_run):
-    helper = AvailablePointcloudsHelper()
+  def test_scan_indexes_metadata(self):
+    self._make_pointcloud('spot20230813142200', points=1234, bounding_box=([-1, -2, -3], [4, 5, 6]))
+    os.makedirs(os.path.join(self.data_dir.name, 'spot20230813142201'))
+    os.makedirs(os.path.join(self.data_dir.name, 'spot_not_a_date'))
 
-    # Mock subprocess.run to return successfully
-    mock_subprocess_run.return_value.returncode = 0
+    self.assertEqual(self._make_helper().scan(), (2, 0))
 
-    helper.collect_new_pointclouds()
+    converted = Pointcloud.objects.get(name='spot20230813142200')
+    self.assertEqual(converted.points, 1234)
+    self.assertEqual(converted.bounding_box, [[-1, -2, -3], [4, 5, 6]])
+    self.assertEqual(converted.size, 200 + os.path.getsize(os.path.join(self.data_dir.name, 'spot20230813142200', 'pointclouds', 'spot', 'metadata.json')))
+    self.assertIsNone(Pointcloud.objects.get(name='spot20230813142201').points)
+    self.assertFalse(Pointcloud.objects.filter(name='spot_not_a_date').exists())
 
-    mock_subprocess_run.assert_called_once_with(['python', 'manage.py', 'collectstatic', '--noinput'], check=True)
+  def test_scan_is_incremental(self):
+    self._make_pointcloud('spot20230813142200')
+    self._make_pointcloud('spot20230813142201')
+    helper = self._make_helper()
+    helper.scan()
 
-  @mock.patch('api.scripts.available_pointclouds_helper.subprocess.run')
-  @mock.patch('logging.Logger.error')
-  def test_collect_new_pointclouds_error(self, mock_logger_error, mock_subprocess_run):
-    helper = AvailablePointcloudsHelper()
+    with mock.patch.object(helper, '_read_metadata', wraps=helper._read_metadata) as mock_read_metadata:
+      self.assertEqual(helper.scan(), (0, 0))
+      mock_read_metadata.assert_not_called()
 
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(returncode=1, cmd='collectstatic')
+      self._make_pointcloud('spot20230813142201', points=5)
+      metadata_path = os.path.join(self.data_dir.name, 'spot20230813142201', 'pointclouds', 'spot', 'metadata.json')
+      os.utime(metadata_path, ns=(1, 1))
+      shutil.rmtree(os.path.join(self.data_dir.name, 'spot20230813142200'))
+      self.assertEqual(helper.scan(), (1, 1))
+      mock_read_metadata.assert_called_once_with('spot20230813142201')
 
-    helper.collect_new_pointclouds()
+    self.assertEqual(list(Pointcloud.objects.values_list('name', 'points')), [('spot20230813142201', 5)])
 
-    mock_subprocess_run.assert_called_once_with(['python', 'manage.py', 'collectstatic', '--noinput'], check=True)
\ No newline at end of file
+  def test_list(self):
+    self._make_pointcloud('spot20230813142200')
+    self._make_pointcloud('spot20230813142201')
+
+    # The catalog is scanned on first use, the missing thumbnails are scheduled
+    with mock.patch('api.scripts.available_pointclouds_helper.PointcloudThumbnails') as mock_thumbnails_class:
+      mock_thumbnails_class.return_value.cached.return_value = False
+      result = self._make_helper().list()
+
+    self.assertEqual(result['count'], 2)
+    self.assertEqual(result['pages'], 1)
+    self.assertEqual(result['results'][0], {
+      'name': 'spot20230813142201',
+      'date': '13/08/2023 14:22:01',
+      'timestamp': int(time.mktime(datetime.datetime(2023, 8, 13, 14, 22, 1).timetuple())),
+      'size': result['results'][0]['size'],
+      'points': 1000,
+      'bounding_box': [[0, 0, 0], [10, 20, 3]],
+      'thumbnail': None,
+    })
+    self.assertEqual(result['results'][1]['name'], 'spot20230813142200')
+    self.assertEqual(mock_thumbnails_class.return_value.schedule.call_count, 2)
+
+  def test_list_pages_and_date_range(self):
+    for day in range(1, 6):
+      os.makedirs(os.path.join(self.data_dir.name, f'spot202308{day:02}120000'))
+    helper = self._make_helper()
+    helper.scan()
+
+    result = helper.list(start='2023-08-02', end='2023-08-04', page=2, page_size=2)
+
+    self.assertEqual((result['count'], result['page'], result['pages']), (3, 2, 2))
+    self.assertEqual([pointcloud['name'] for pointcloud in result['results']], ['spot20230802120000'])
+    # Without page size, a single page of all of them
+    result = helper.list(page_size=None)
+    self.assertEqual((result['count'], result['pages'], len(result['results'])), (5, 1, 5))
+    with self.assertRaises(ValueError):
+      helper.list(start='yesterday')
+
+  @mock.patch('api.scripts.available_pointclouds_helper.PointcloudPublisher')
+  def test_collect_new_pointclouds_publishes_and_scans(self, mock_publisher_class):
+    self._make_pointcloud('spot20230813142200')
+    mock_publisher_class.return_value.publish.return_value = {'spot20230813142200': {'method': 'hardlink'}}
+    progress = mock.Mock()
+    helper = self._make_helper()
+
+    self.assertEqual(helper.collect_new_pointclouds(progress), {'spot20230813142200': {'method': 'hardlink'}})
+
+    mock_publisher_class.assert_called_once_with(target_dir=self.data_dir.name)
+    mock_publisher_class.return_value.publish.assert_called_once_with(progress, None)
+    self.assertTrue(Pointcloud.objects.filter(name='spot20230813142200').exists())
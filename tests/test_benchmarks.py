@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Tests for the benchmarks"""
+
+# Imports
+import json
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from benchmarks import spot_cameras_pipeline, camera_feed_load
+from benchmarks.spot_stand_in import SpotStandIn
+from api.scripts.robot_session_pool import RobotSession
+
+class TestSpotCamerasPipelineBenchmark(TestCase):
+
+  def test_every_stage_is_measured(self):
+    report = spot_cameras_pipeline.run(min_time=0, cases=spot_cameras_pipeline.CASES[:1])
+
+    stages = [result['stage'] for result in report['results']]
+    self.assertEqual(stages, ['deserialize', 'decode', 'rotate', 'get_image', 'encode', 'multipart',
+                              'variant_jpeg_q70_w320', 'variant_webp_q70_w320'])
+    for result in report['results']:
+      self.assertGreater(result['median_us'], 0)
+      self.assertGreaterEqual(result['peak_alloc_bytes'], result['retained_alloc_bytes'])
+    # The report is saved as JSON
+    json.dumps(report)
+
+  def test_compare_reports_regressions(self):
+    baseline = {'results': [{'case': 'raw', 'stage': 'decode', 'median_us': 10.0},
+                            {'case': 'raw', 'stage': 'rotate', 'median_us': 10.0}]}
+    report = {'results': [{'case': 'raw', 'stage': 'decode', 'median_us': 11.0},
+                          {'case': 'raw', 'stage': 'rotate', 'median_us': 13.0},
+                          {'case': 'raw', 'stage': 'encode', 'median_us': 99.0}]}
+
+    self.assertEqual(spot_cameras_pipeline.compare(report, baseline), [('raw', 'rotate', 10.0, 13.0)])
+
+class TestSpotStandIn(TestCase):
+
+  def test_robot_session_gets_images(self):
+    stand_in = SpotStandIn(fps=10)
+    environment = stand_in.environment()
+    try:
+      session = RobotSession(environment['ROBOT_IP'], environment['GUID'], environment['SECRET'],
+                             port=environment['ROBOT_PORT'], cert=environment['ROBOT_CERT'])
+      image_responses = session.ensure_client('image').get_image_from_sources(['frontleft_fisheye_image'])
+      session.close()
+    finally:
+      stand_in.stop()
+
+    self.assertEqual(image_responses[0].shot.image.rows, 480)
+    self.assertTrue(image_responses[0].shot.image.data.startswith(b'\xff\xd8'))
+
+class TestCameraFeedLoad(TestCase):
+
+  def test_summarize(self):
+    results = [{'first_frame': 0.5, 'frames': [10.0, 10.5, 11.0]},
+               {'first_frame': 1.5, 'frames': [10.0, 11.0]},
+               {'status': 503, 'frames': []}]
+
+    summary = camera_feed_load.summarize(results)
+
+    self.assertEqual(summary['clients_served'], 2)
+    self.assertEqual(summary['errors'], ['HTTP 503'])
+    self.assertEqual(summary['time_to_first_frame_max_ms'], 1500.0)
+    self.assertEqual(summary['fps_per_client_min'], 1.0)
+    self.assertEqual(summary['fps_per_client_mean'], 1.5)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Tests for pcd_reader script"""
+
+# Imports
+import os
+import tempfile
+
+import numpy as np
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pcd_reader import PcdReader, find_pcd
+
+HEADER = ('# .PCD v0.7 - Point Cloud Data file format\nVERSION 0.7\nFIELDS x y z _ intensity rgb\nSIZE 4 4 4 1 4 4\n'
+          'TYPE F F F U F F\nCOUNT 1 1 1 3 1 1\nWIDTH {0}\nHEIGHT 1\nVIEWPOINT 0 0 0 1 0 0 0\nPOINTS {0}\nDATA {1}\n')
+DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('_', 'u1', (3,)), ('intensity', '<f4'), ('rgb', '<u4')])
+
+def make_pcd(path, count, data='binary'):
+  """
+  Writes a PCD file of points along a line, with padding as PCL writes it, and colors packed in a float.
+
+      Returns:
+          points (np.ndarray): Points written, of dtype DTYPE
+  """
+  points = np.zeros(count, dtype=DTYPE)
+  points['x'], points['y'], points['z'] = np.arange(count) * 0.5, 1, -np.arange(count)
+  points['intensity'] = np.arange(count) * 2
+  points['rgb'] = (np.arange(count) % 256) << 16 | 128 << 8 | 7
+  with open(path, 'wb') as f:
+    f.write(HEADER.format(count, data).encode())
+    if data == 'binary':
+      f.write(points.tobytes())
+    else:
+      for point in points:
+        rgb = np.array([point['rgb']], dtype='<u4').view('<f4')[0]
+        f.write(f"{point['x']} {point['y']} {point['z']} 0 0 0 {point['intensity']} {float(rgb)!r}\n".encode())
+  return points
+
+class TestPcdReader(TestCase):
+
+  def setUp(self):
+    self.scan_dir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.scan_dir.cleanup()
+
+  def test_chunks(self):
+    for data in ['binary', 'ascii']:
+      path = os.path.join(self.scan_dir.name, f'{data}.pcd')
+      points = make_pcd(path, 10, data)
+      reader = PcdReader(path)
+
+      chunks = list(reader.chunks(chunk_points=4))
+
+      self.assertEqual(reader.points, 10)
+      self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+      chunk = np.concatenate(chunks)
+      self.assertEqual(reader.xyz(chunk)[:, 0].tolist(), points['x'].tolist())
+      self.assertEqual(reader.field(chunk, 'intensity')[:, 0].tolist(), points['intensity'].tolist())
+      self.assertEqual(reader.colors(chunk)[9].tolist(), [9, 128, 7])
+      self.assertEqual([bound.tolist() for bound in reader.bounds()], [[0, 1, -9], [4.5, 1, 0]])
+
+  def test_unsupported(self):
+    path = os.path.join(self.scan_dir.name, 'cloud.pcd')
+    make_pcd(path, 10, 'binary_compressed')
+    with self.assertRaises(ValueError):
+      PcdReader(path)
+    with open(path, 'w') as f:
+      f.write('VERSION 0.7\nFIELDS x y\nSIZE 4 4\nTYPE F F\nPOINTS 0\nDATA ascii\n')
+    with self.assertRaises(ValueError):
+      PcdReader(path)
+
+  def test_find_pcd(self):
+    self.assertIsNone(find_pcd(self.scan_dir.name))
+    os.makedirs(os.path.join(self.scan_dir.name, 'pointclouds'))
+    path = os.path.join(self.scan_dir.name, 'pointclouds', 'cloud.pcd')
+    make_pcd(path, 1)
+    self.assertEqual(find_pcd(self.scan_dir.name), path)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""Tests for pointcloud_compressor script"""
+
+# Imports
+import os
+import json
+import mock
+import struct
+import tempfile
+
+import brotli
+import numpy as np
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_compressor import PointcloudCompressor, HIERARCHY_RECORD
+
+ATTRIBUTES = [
+  {'name': 'position', 'size': 12, 'numElements': 3, 'elementSize': 4, 'type': 'int32'},
+  {'name': 'rgb', 'size': 6, 'numElements': 3, 'elementSize': 2, 'type': 'uint16'},
+  {'name': 'intensity', 'size': 2, 'numElements': 1, 'elementSize': 2, 'type': 'uint16'},
+]
+
+def js_decode(data, num_points):
+  """
+  Decodes a BROTLI node the way the loop of DecoderWorker_brotli.js documents it, as (xyz, rgb, intensity) tuples.
+  """
+  data = brotli.decompress(data)
+  points = []
+  for j in range(num_points):
+    upper, lower = struct.unpack_from('<QQ', data, 16 * j)
+    xyz = [0, 0, 0]
+    for k in range(16):
+      for axis in range(3):
+        xyz[axis] |= ((lower >> (3 * k + axis)) & 1) << k
+        xyz[axis] |= ((upper >> (3 * k + axis)) & 1) << (k + 16)
+    code, = struct.unpack_from('<Q', data, 16 * num_points + 8 * j)
+    rgb = [sum(((code >> (3 * k + channel)) & 1) << k for k in range(16)) for channel in range(3)]
+    intensity, = struct.unpack_from('<H', data, 24 * num_points + 2 * j)
+    points.append((tuple(struct.unpack('<3i', struct.pack('<3I', *xyz))), tuple(rgb), intensity))
+  return points
+
+class TestPointcloudCompressor(TestCase):
+
+  def setUp(self):
+    self.source_dir = tempfile.TemporaryDirectory()
+    self.potree_dir = os.path.join(self.source_dir.name, 'spot20230813142200', 'pointclouds', 'spot')
+    os.makedirs(self.potree_dir)
+    random = np.random.default_rng(0)
+    dtype = np.dtype([('xyz', '<i4', (3,)), ('rgb', '<u2', (3,)), ('intensity', '<u2')])
+    self.nodes = []
+    octree = b''
+    for num_points in [500, 0, 120]:
+      points = np.zeros(num_points, dtype=dtype)
+      points['xyz'] = random.integers(-2**31, 2**31, size=(num_points, 3))
+      points['rgb'] = random.integers(0, 2**16, size=(num_points, 3))
+      points['intensity'] = random.integers(0, 2**16, size=num_points)
+      self.nodes.append(points)
+      octree += points.tobytes()
+    with open(os.path.join(self.potree_dir, 'octree.bin'), 'wb') as f:
+      f.write(octree)
+    # Root node with two children, the second one behind a proxy to another chunk
+    hierarchy = np.zeros(4, dtype=HIERARCHY_RECORD)
+    hierarchy[0] = (0, 0b11, 500, 0, 500 * 20)
+    hierarchy[1] = (1, 0, 0, 500 * 20, 0)
+    hierarchy[2] = (2, 0, 0, 3 * HIERARCHY_RECORD.itemsize, HIERARCHY_RECORD.itemsize)
+    hierarchy[3] = (1, 0, 120, 500 * 20, 120 * 20)
+    self.hierarchy = hierarchy
+    with open(os.path.join(self.potree_dir, 'hierarchy.bin'), 'wb') as f:
+      f.write(hierarchy.tobytes())
+    with open(os.path.join(self.potree_dir, 'metadata.json'), 'w') as f:
+      json.dump({'points': 620, 'encoding': 'DEFAULT', 'attributes': ATTRIBUTES,
+                 'hierarchy': {'firstChunkSize': 3 * HIERARCHY_RECORD.itemsize, 'stepSize': 4, 'depth': 1}}, f)
+
+  def tearDown(self):
+    self.source_dir.cleanup()
+
+  def _read(self):
+    with open(os.path.join(self.potree_dir, 'metadata.json')) as f:
+      metadata = json.load(f)
+    with open(os.path.join(self.potree_dir, 'hierarchy.bin'), 'rb') as f:
+      hierarchy = np.frombuffer(f.read(), dtype=HIERARCHY_RECORD)
+    with open(os.path.join(self.potree_dir, 'octree.bin'), 'rb') as f:
+      octree = f.read()
+    return metadata, hierarchy, octree
+
+  def _assert_compressed(self, report):
+    metadata, hierarchy, octree = self._read()
+    self.assertEqual(metadata['encoding'], 'BROTLI')
+    self.assertEqual(metadata['hierarchy'], {'firstChunkSize': 3 * HIERARCHY_RECORD.itemsize, 'stepSize': 4, 'depth': 1})
+    # Proxies and point counts are unchanged, the nodes point to their compressed data
+    self.assertEqual(hierarchy[2].tolist(), self.hierarchy[2].tolist())
+    self.assertEqual(hierarchy['numPoints'].tolist(), self.hierarchy['numPoints'].tolist())
+    self.assertEqual(hierarchy['byteSize'][1], 0)
+    for record, points in [(hierarchy[0], self.nodes[0]), (hierarchy[3], self.nodes[2])]:
+      decoded = js_decode(octree[record['byteOffset']:record['byteOffset'] + record['byteSize']], int(record['numPoints']))
+      self.assertEqual(decoded, [(tuple(p['xyz'].tolist()), tuple(p['rgb'].tolist()), int(p['intensity'])) for p in points])
+    self.assertEqual(report['nodes'], 2)
+    self.assertEqual(report['bytes'], 620 * 20)
+    self.assertEqual(report['compressed_bytes'], len(octree))
+    self.assertAlmostEqual(report['ratio'], 620 * 20 / len(octree))
+    self.assertEqual(sorted(os.listdir(self.potree_dir)), ['hierarchy.bin', 'metadata.json', 'octree.bin'])
+
+  def test_octree_is_reencoded_for_the_brotli_decoder(self):
+    compressor = PointcloudCompressor(self.source_dir.name, workers=1)
+    self.assertEqual(compressor.pending(), ['spot20230813142200'])
+
+    self._assert_compressed(compressor.compress('spot20230813142200'))
+    self.assertEqual(compressor.pending(), [])
+    with self.assertRaises(ValueError):
+      compressor.compress('spot20230813142200')
+
+  def test_octree_is_reencoded_in_a_process_pool(self):
+    progress = mock.Mock()
+
+    reports = PointcloudCompressor(self.source_dir.name, workers=2).compress_all(progress=progress)
+
+    self.assertEqual(len(reports), 1)
+    self._assert_compressed(reports[0])
+    progress.assert_called_once_with('spot20230813142200', 1, 1, reports[0])
+
+  def test_original_is_kept_if_the_rewrite_is_not_verified(self):
+    original = self._read()
+
+    with mock.patch('api.scripts.pointcloud_compressor.decode_node', return_value=b''):
+      reports = PointcloudCompressor(self.source_dir.name, workers=1).compress_all()
+
+    self.assertEqual(reports, [])
+    metadata, hierarchy, octree = self._read()
+    self.assertEqual(metadata, original[0])
+    self.assertEqual(hierarchy.tobytes(), original[1].tobytes())
+    self.assertEqual(octree, original[2])
+    self.assertEqual(sorted(os.listdir(self.potree_dir)), ['hierarchy.bin', 'metadata.json', 'octree.bin'])
+
+  def _crash(self, renames):
+    """
+    Compresses the scan until it crashes, after a number of renames, without cleaning up nor recovering it.
+    """
+    rename = os.rename
+    calls = []
+    def crashing_rename(source, target):
+      if len(calls) == renames:
+        raise KeyboardInterrupt
+      calls.append(source)
+      rename(source, target)
+    compressor = PointcloudCompressor(self.source_dir.name, workers=1)
+    with mock.patch('os.rename', side_effect=crashing_rename), mock.patch('shutil.rmtree'), mock.patch.object(compressor, 'recover'):
+      with self.assertRaises(KeyboardInterrupt):
+        compressor.compress('spot20230813142200')
+
+  def test_interrupted_swap_is_completed(self):
+    self._crash(renames=1)
+    pointclouds_dir = os.path.dirname(self.potree_dir)
+    self.assertEqual(sorted(os.listdir(pointclouds_dir)), ['spot.original', 'spot.partial'])
+
+    compressor = PointcloudCompressor(self.source_dir.name, workers=1)
+    self.assertEqual(compressor.recover_all(), ['spot20230813142200'])
+
+    self.assertEqual(os.listdir(pointclouds_dir), ['spot'])
+    self.assertEqual(compressor.pending(), [])
+    metadata, hierarchy, octree = self._read()
+    self.assertEqual(metadata['encoding'], 'BROTLI')
+    self.assertEqual(len(js_decode(octree[hierarchy[3]['byteOffset']:hierarchy[3]['byteOffset'] + hierarchy[3]['byteSize']], 120)), 120)
+
+  def test_interrupted_compression_is_discarded(self):
+    original = self._read()
+    self._crash(renames=0)
+    pointclouds_dir = os.path.dirname(self.potree_dir)
+    self.assertEqual(sorted(os.listdir(pointclouds_dir)), ['spot', 'spot.partial'])
+
+    # Recovered before compressing again
+    reports = PointcloudCompressor(self.source_dir.name, workers=1).compress_all()
+
+    self.assertEqual(os.listdir(pointclouds_dir), ['spot'])
+    self.assertEqual(len(reports), 1)
+    self.assertEqual(self._read()[0]['points'], original[0]['points'])
+    self._assert_compressed(reports[0])
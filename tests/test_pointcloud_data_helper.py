@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Tests for pointcloud_data_helper script"""
+
+# Imports
+import asyncio
+import tempfile
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_data_helper import pointcloud_file, parse_range, afile_chunks
+
+class TestPointcloudDataHelper(TestCase):
+
+  def test_pointcloud_file(self):
+    self.assertEqual(pointcloud_file('spot20230813142200', 'octree.bin'), 'spot20230813142200/pointclouds/spot/octree.bin')
+    self.assertIsNone(pointcloud_file('spot20230813142200', 'cloud.pcd'))
+    self.assertIsNone(pointcloud_file('..', 'octree.bin'))
+    self.assertIsNone(pointcloud_file('spot/../..', 'octree.bin'))
+
+  def test_parse_range(self):
+    self.assertEqual(parse_range('bytes=10-19', 100), (10, 19))
+    self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+    self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+    self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+    self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+    self.assertFalse(parse_range('bytes=100-', 100))
+    self.assertFalse(parse_range('bytes=20-10', 100))
+    # No range, or several ranges, the whole file is sent
+    self.assertIsNone(parse_range(None, 100))
+    self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+    self.assertIsNone(parse_range('items=0-1', 100))
+
+  def test_afile_chunks(self):
+    with tempfile.NamedTemporaryFile() as f:
+      f.write(bytes(range(100)))
+      f.flush()
+
+      async def read():
+        return [chunk async for chunk in afile_chunks(f.name, 10, 25, chunk_size=10)]
+
+      chunks = asyncio.run(read())
+
+    self.assertEqual(chunks, [bytes(range(10, 20)), bytes(range(20, 30)), bytes(range(30, 35))])
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Tests for pointcloud_export_helper script"""
+
+# Imports
+import io
+import os
+import mock
+import struct
+import tempfile
+
+import numpy as np
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_export_helper import EXPORT_DTYPE, LasWriter, PlyWriter, NpyWriter, PointCountError, parse_box, encoded_chunks, box_export, scan_export
+from api.scripts.potree_octree import PotreeOctree
+from tests.test_potree_octree import make_octree
+from tests.test_pcd_reader import make_pcd
+
+class TestPointcloudExportHelper(TestCase):
+
+  def setUp(self):
+    self.points = np.zeros(3, dtype=EXPORT_DTYPE)
+    self.points['X'], self.points['Y'], self.points['Z'] = [0, 100, -250], [1, 2, 3], [10, 20, 30]
+    self.points['intensity'] = [1, 2, 3]
+    self.points['red'], self.points['green'], self.points['blue'] = [65535, 200, 0], [256, 0, 0], [0, 0, 512]
+    self.args = ([0.01, 0.01, 0.01], [1000, 2000, 0], ([997.5, 2000, 0], [1001, 2001, 1]))
+
+  def _export(self, writer, chunk_size=1):
+    return b''.join(encoded_chunks(writer, len(self.points), [self.points[:2], self.points[2:]], chunk_size=chunk_size))
+
+  def test_las(self):
+    writer = LasWriter(*self.args)
+
+    data = self._export(writer)
+
+    self.assertEqual(len(data), writer.size(3))
+    self.assertEqual(data[:4], b'LASF')
+    self.assertEqual(struct.unpack_from('<BB', data, 24), (1, 2))
+    offset_to_points, = struct.unpack_from('<I', data, 96)
+    self.assertEqual(offset_to_points, 227)
+    self.assertEqual(struct.unpack_from('<BHI', data, 104), (2, 26, 3))
+    self.assertEqual(struct.unpack_from('<3d3d', data, 131), (0.01, 0.01, 0.01, 1000, 2000, 0))
+    self.assertEqual(struct.unpack_from('<2d', data, 179), (1001, 997.5))
+    records = np.frombuffer(data, dtype=LasWriter.RECORD, offset=offset_to_points)
+    self.assertEqual(records['X'].tolist(), [0, 100, -250])
+    self.assertEqual(records['blue'].tolist(), [0, 0, 512])
+    self.assertEqual(records['returns'].tolist(), [9, 9, 9])
+
+  def test_ply(self):
+    writer = PlyWriter(*self.args)
+
+    data = self._export(writer)
+
+    self.assertEqual(len(data), writer.size(3))
+    header, body = data.split(b'end_header\n')
+    self.assertIn(b'element vertex 3\n', header)
+    records = np.frombuffer(body, dtype=PlyWriter.RECORD)
+    self.assertEqual(records['x'].tolist(), [1000, 1001, 997.5])
+    self.assertEqual(records['red'].tolist(), [255, 200, 0])
+    self.assertEqual(records['blue'].tolist(), [0, 0, 2])
+
+  def test_npy(self):
+    writer = NpyWriter(*self.args)
+
+    data = self._export(writer, chunk_size=2**20)
+
+    self.assertEqual(len(data), writer.size(3))
+    array = np.load(io.BytesIO(data))
+    self.assertEqual(array['z'].tolist(), [0.1, 0.2, 0.3])
+    self.assertEqual(array['red'].tolist(), [65535, 200, 0])
+
+  def test_count_mismatch_aborts_the_file(self):
+    writer = NpyWriter(*self.args)
+
+    for count in [2, 4]:
+      chunks = encoded_chunks(writer, count, [self.points[:2], self.points[2:]], chunk_size=2**20)
+      self.assertEqual(next(chunks), writer.header(count))
+      # Nothing after the header, the file is cut short
+      with self.assertRaises(PointCountError):
+        next(chunks)
+
+  def test_parse_box(self):
+    box = parse_box('1,2,3', '4,5.5,6')
+    self.assertEqual((box[0].tolist(), box[1].tolist()), ([1, 2, 3], [4, 5.5, 6]))
+    for minimum, maximum in [('1,2', '4,5,6'), ('1,2,3', None), ('a,b,c', '4,5,6'), ('1,2,3', '0,5,6'), ('nan,2,3', '4,5,6')]:
+      with self.assertRaises(ValueError):
+        parse_box(minimum, maximum)
+
+  def test_scan_export(self):
+    with tempfile.TemporaryDirectory() as scan_dir:
+      points = make_octree(os.path.join(scan_dir, 'pointclouds', 'spot'))
+
+      # From all the nodes of the octree, inner ones included
+      writer, count, chunks = scan_export(scan_dir, os.path.join('pointclouds', 'spot'), NpyWriter)
+      export = np.load(io.BytesIO(b''.join(chunks)))
+      self.assertEqual(count, 400)
+      self.assertEqual(sorted(export['intensity'].tolist()), sorted(points['intensity'].tolist()))
+
+      # From the PCD as soon as there is one, in the frame of the octree
+      pcd = make_pcd(os.path.join(scan_dir, 'cloud.pcd'), 10)
+      writer, count, chunks = scan_export(scan_dir, os.path.join('pointclouds', 'spot'), LasWriter)
+      data = b''.join(chunks)
+      self.assertEqual((count, len(data)), (10, writer.size(10)))
+      self.assertEqual(writer.scale.tolist(), [0.01] * 3)
+      records = np.frombuffer(data, dtype=LasWriter.RECORD, offset=227)
+      self.assertEqual(records['X'].tolist(), (pcd['x'] * 100).astype(int).tolist())
+      self.assertEqual(records['red'].tolist(), (np.arange(10) * 256).tolist())
+
+      # Without octree, quantized to the millimeter from the corner of the points
+      os.remove(os.path.join(scan_dir, 'pointclouds', 'spot', 'metadata.json'))
+      writer, count, chunks = scan_export(scan_dir, os.path.join('pointclouds', 'spot'), LasWriter)
+      records = np.frombuffer(b''.join(chunks), dtype=LasWriter.RECORD, offset=227)
+      self.assertEqual(writer.offset.tolist(), [0, 1, -9])
+      self.assertEqual(records['Z'].tolist(), ((9 - np.arange(10)) * 1000).tolist())
+
+    with self.assertRaises(OSError):
+      scan_export(scan_dir, os.path.join('pointclouds', 'spot'), LasWriter)
+
+  def test_box_export(self):
+    with tempfile.TemporaryDirectory() as potree_dir:
+      points = make_octree(potree_dir)
+      box = (np.array([2, 2, 2]), np.array([16, 16, 16]))
+      coordinates = points['xyz'] * 0.01
+      inside = np.all((coordinates >= box[0]) & (coordinates <= box[1]), axis=1)
+      octree = PotreeOctree(potree_dir)
+
+      with mock.patch.object(octree, 'read', wraps=octree.read) as read:
+        # The points of the nodes crossing the box spill to disk past 100 bytes
+        writer, count, chunks = box_export(octree, box, None, NpyWriter, spool_size=100)
+        export = np.load(io.BytesIO(b''.join(chunks)))
+
+      self.assertEqual(count, int(inside.sum()))
+      self.assertEqual(sorted(export['intensity'].tolist()), sorted(points['intensity'][inside].tolist()))
+      # Each node is read once, whether it crosses the box or is inside it
+      self.assertEqual(sorted(call.args[0].index for call in read.call_args_list), [0, 2, 3, 4])
+      self.assertEqual(writer.bounds[0].tolist(), [2, 2, 2])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Tests for pointcloud_publisher script"""
+
+# Imports
+import os
+import errno
+import mock
+import tempfile
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_publisher import PointcloudPublisher, METADATA_PATH
+
+class TestPointcloudPublisher(TestCase):
+
+  def setUp(self):
+    self.source_dir = tempfile.TemporaryDirectory()
+    self.target_dir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.source_dir.cleanup()
+    self.target_dir.cleanup()
+
+  def _make_scan(self, name, converted=True):
+    potree_dir = os.path.join(self.source_dir.name, name, os.path.dirname(METADATA_PATH))
+    os.makedirs(potree_dir)
+    with open(os.path.join(potree_dir, 'octree.bin'), 'wb') as f:
+      f.write(b'\0' * 1000)
+    if converted:
+      with open(os.path.join(self.source_dir.name, name, METADATA_PATH), 'w') as f:
+        f.write('{}')
+
+  def _make_publisher(self):
+    return PointcloudPublisher(self.source_dir.name, self.target_dir.name)
+
+  def test_new_scans_are_hardlinked(self):
+    self._make_scan('spot20230813142200')
+    progress = mock.Mock()
+
+    published = self._make_publisher().publish(progress)
+
+    self.assertEqual(published['spot20230813142200']['method'], 'hardlink')
+    self.assertEqual(published['spot20230813142200']['files'], 2)
+    self.assertEqual(published['spot20230813142200']['bytes'], 1002)
+    progress.assert_called_once_with('spot20230813142200', 1, 1, published['spot20230813142200'])
+    source = os.path.join(self.source_dir.name, 'spot20230813142200', 'pointclouds', 'spot', 'octree.bin')
+    target = os.path.join(self.target_dir.name, 'spot20230813142200', 'pointclouds', 'spot', 'octree.bin')
+    self.assertTrue(os.path.samefile(source, target))
+
+  def test_reruns_only_publish_new_or_changed_scans(self):
+    self._make_scan('spot20230813142200')
+    self._make_scan('spot20230813142201', converted=False)
+    self._make_publisher().publish()
+
+    # The manifest survives the publisher, the unconverted scan is not published again while its files are unchanged
+    publisher = self._make_publisher()
+    self.assertEqual(publisher.pending(), [])
+
+    self._make_scan('spot20230813142202')
+    os.utime(os.path.join(self.source_dir.name, 'spot20230813142200', METADATA_PATH), ns=(1, 1))
+    with open(os.path.join(self.source_dir.name, 'spot20230813142201', 'cloud.pcd'), 'wb') as f:
+      f.write(b'\0' * 10)
+    self.assertEqual(sorted(publisher.publish()), ['spot20230813142200', 'spot20230813142201', 'spot20230813142202'])
+
+    # Converted in the end
+    with open(os.path.join(self.source_dir.name, 'spot20230813142201', METADATA_PATH), 'w') as f:
+      f.write('{}')
+    self.assertEqual(publisher.pending(), ['spot20230813142201'])
+
+  def test_removed_scans_are_unpublished(self):
+    self._make_scan('spot20230813142200')
+    publisher = self._make_publisher()
+    publisher.publish()
+
+    os.rename(os.path.join(self.source_dir.name, 'spot20230813142200'), os.path.join(self.source_dir.name, 'other'))
+    publisher.publish()
+
+    self.assertFalse(os.path.exists(os.path.join(self.target_dir.name, 'spot20230813142200')))
+    self.assertEqual(publisher.manifest, {})
+
+  @mock.patch('api.scripts.pointcloud_publisher.os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link'))
+  def test_symlink_across_filesystems(self, mock_link):
+    self._make_scan('spot20230813142200')
+
+    published = self._make_publisher().publish()
+
+    self.assertEqual(published['spot20230813142200']['method'], 'symlink')
+    target = os.path.join(self.target_dir.name, 'spot20230813142200')
+    self.assertEqual(os.readlink(target), os.path.join(self.source_dir.name, 'spot20230813142200'))
+    self.assertFalse(os.path.lexists(os.path.join(self.target_dir.name, '.spot20230813142200.partial')))
+
+  @mock.patch('api.scripts.pointcloud_publisher.os.symlink', side_effect=OSError(errno.EPERM, 'Operation not permitted'))
+  @mock.patch('api.scripts.pointcloud_publisher.os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link'))
+  def test_copy_when_links_are_not_possible(self, mock_link, mock_symlink):
+    self._make_scan('spot20230813142200')
+
+    published = self._make_publisher().publish()
+
+    self.assertEqual(published['spot20230813142200']['method'], 'copy')
+    target = os.path.join(self.target_dir.name, 'spot20230813142200', METADATA_PATH)
+    self.assertFalse(os.path.islink(os.path.join(self.target_dir.name, 'spot20230813142200')))
+    self.assertTrue(os.path.isfile(target))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Tests for pointcloud_thumbnails script"""
+
+# Imports
+import os
+import json
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_compressor import PointcloudCompressor, HIERARCHY_RECORD
+from api.scripts.pointcloud_thumbnails import PointcloudThumbnails
+
+ATTRIBUTES = [
+  {'name': 'position', 'size': 12, 'numElements': 3, 'elementSize': 4, 'type': 'int32'},
+  {'name': 'intensity', 'size': 2, 'numElements': 1, 'elementSize': 2, 'type': 'uint16'},
+]
+DTYPE = np.dtype([('xyz', '<i4', (3,)), ('intensity', '<u2')])
+
+class TestPointcloudThumbnails(TestCase):
+
+  def setUp(self):
+    self.source_dir = tempfile.TemporaryDirectory()
+    self.cache_dir = tempfile.TemporaryDirectory()
+    self.potree_dir = os.path.join(self.source_dir.name, 'spot20230813142200', 'pointclouds', 'spot')
+    os.makedirs(self.potree_dir)
+    # A 20 m x 10 m floor at 0 m, with a 3 m high wall along its east edge, scale of 1 cm
+    floor = np.zeros(200, dtype=DTYPE)
+    floor['xyz'][:, 0] = np.linspace(0, 1900, 200)
+    floor['xyz'][:, 1] = np.tile(np.linspace(0, 1000, 20), 10)
+    floor['intensity'] = 100
+    wall = np.zeros(50, dtype=DTYPE)
+    wall['xyz'] = np.column_stack([np.full(50, 2000), np.linspace(0, 1000, 50), np.full(50, 300)])
+    wall['intensity'] = 1000
+    # Root with the floor and a child with the wall, behind a proxy, then a grandchild too fine for the thumbnail
+    detail = np.zeros(1000, dtype=DTYPE)
+    nodes = [floor, wall, detail]
+    offsets = np.cumsum([0] + [len(node) * DTYPE.itemsize for node in nodes])
+    with open(os.path.join(self.potree_dir, 'octree.bin'), 'wb') as f:
+      f.write(b''.join(node.tobytes() for node in nodes))
+    hierarchy = np.zeros(4, dtype=HIERARCHY_RECORD)
+    hierarchy[0] = (0, 0b10000000, 200, offsets[0], offsets[1] - offsets[0])
+    hierarchy[1] = (2, 0, 50, 2 * HIERARCHY_RECORD.itemsize, 2 * HIERARCHY_RECORD.itemsize)
+    hierarchy[2] = (0, 0b1, 50, offsets[1], offsets[2] - offsets[1])
+    hierarchy[3] = (1, 0, 1000, offsets[2], offsets[3] - offsets[2])
+    with open(os.path.join(self.potree_dir, 'hierarchy.bin'), 'wb') as f:
+      f.write(hierarchy.tobytes())
+    with open(os.path.join(self.potree_dir, 'metadata.json'), 'w') as f:
+      json.dump({'points': 1250, 'encoding': 'DEFAULT', 'attributes': ATTRIBUTES, 'scale': [0.01] * 3, 'offset': [0, 0, 0],
+                 'boundingBox': {'min': [0, 0, 0], 'max': [20, 10, 3]},
+                 'hierarchy': {'firstChunkSize': 2 * HIERARCHY_RECORD.itemsize, 'stepSize': 1, 'depth': 2}}, f)
+
+  def tearDown(self):
+    self.source_dir.cleanup()
+    self.cache_dir.cleanup()
+
+  def _make_thumbnails(self, **kwargs):
+    return PointcloudThumbnails(self.source_dir.name, self.cache_dir.name, size=64, max_points=500, **kwargs)
+
+  def test_coarse_levels_are_read(self):
+    xyz, intensity, _ = self._make_thumbnails().read_points('spot20230813142200')
+
+    self.assertEqual(len(xyz), 250)
+    self.assertEqual(xyz[:, 2].max(), 3)
+    self.assertEqual(sorted(set(intensity)), [100, 1000])
+
+  def test_thumbnail_is_rendered_and_invalidated(self):
+    thumbnails = self._make_thumbnails()
+    self.assertFalse(thumbnails.cached('spot20230813142200', 1))
+
+    path = thumbnails.render('spot20230813142200', 1)
+
+    self.assertTrue(thumbnails.cached('spot20230813142200', 1))
+    image = np.asarray(Image.open(path))
+    self.assertEqual(image.shape, (32, 64, 4))
+    # The wall is the highest, on the east edge, the floor the lowest
+    self.assertEqual(image[16, 63].tolist(), [253, 231, 37, 255])
+    self.assertEqual(image[31, 0].tolist(), [68, 1, 84, 255])
+    # A new version of the scan replaces the thumbnail
+    thumbnails.render('spot20230813142200', 2)
+    self.assertEqual(os.listdir(self.cache_dir.name), [os.path.basename(thumbnails.path('spot20230813142200', 2))])
+    thumbnails.remove('spot20230813142200')
+    self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+  def test_thumbnail_of_a_compressed_octree(self):
+    expected = np.asarray(Image.open(self._make_thumbnails(color='intensity').render('spot20230813142200', 1)))
+    PointcloudCompressor(self.source_dir.name, workers=1).compress('spot20230813142200')
+
+    image = np.asarray(Image.open(self._make_thumbnails(color='intensity').render('spot20230813142200', 2)))
+
+    self.assertTrue((image == expected).all())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Tests for pointcloud_watcher script"""
+
+# Imports
+import os
+import mock
+import shutil
+import tempfile
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_watcher import PointcloudWatcher, COMPLETE_FILES, INOTIFY, POLL
+
+class TestPointcloudWatcher(TestCase):
+
+  def setUp(self):
+    self.source_dir = tempfile.TemporaryDirectory()
+    self.register = mock.Mock()
+
+  def tearDown(self):
+    self.source_dir.cleanup()
+
+  def _write_scan(self, name, paths):
+    for path in paths:
+      path = os.path.join(self.source_dir.name, name, path)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'wb') as f:
+        f.write(b'\0' * 10)
+
+  def _make_watcher(self, mode=POLL, settle_time=0):
+    watcher = PointcloudWatcher(self.register, self.source_dir.name, mode=mode, settle_time=settle_time)
+    self.addCleanup(watcher._close_inotify)
+    return watcher
+
+  def test_poll_registers_complete_scans_once(self):
+    watcher = self._make_watcher()
+    self._write_scan('spot20230813142200', ['cloud.pcd'])
+
+    watcher.poll()
+    watcher.register_settled()
+    self.register.assert_not_called()
+
+    self._write_scan('spot20230813142200', COMPLETE_FILES)
+    watcher.poll()
+    watcher.register_settled()
+    self.register.assert_called_once_with(['spot20230813142200'])
+
+    watcher.poll()
+    watcher.register_settled()
+    self.register.assert_called_once()
+
+  def test_changing_scans_are_debounced(self):
+    watcher = self._make_watcher(settle_time=60)
+    self._write_scan('spot20230813142200', COMPLETE_FILES)
+
+    watcher.poll()
+    watcher.register_settled()
+
+    self.register.assert_not_called()
+    self.assertIn('spot20230813142200', watcher.changes)
+
+  def test_removed_scans_are_registered(self):
+    watcher = self._make_watcher()
+    self._write_scan('spot20230813142200', COMPLETE_FILES)
+    watcher.poll()
+    watcher.register_settled()
+
+    shutil.rmtree(os.path.join(self.source_dir.name, 'spot20230813142200'))
+    watcher.poll()
+    watcher.register_settled()
+
+    self.assertEqual(self.register.call_args_list, [mock.call(['spot20230813142200'])] * 2)
+    self.assertEqual(watcher.registered, set())
+
+  def test_inotify_events(self):
+    watcher = self._make_watcher(mode=INOTIFY)
+    if watcher.inotify is None:
+      self.skipTest('inotify is not available')
+    watcher.poll()
+
+    self._write_scan('spot20230813142200', COMPLETE_FILES)
+    self._write_scan('not_a_scan', ['cloud.pcd'])
+    for _ in range(10):
+      watcher.handle_events(watcher.inotify.read(timeout=0.1))
+    watcher.register_settled()
+
+    self.register.assert_called_once_with(['spot20230813142200'])
+
+  def test_registration_errors_are_retried(self):
+    watcher = self._make_watcher()
+    self._write_scan('spot20230813142200', COMPLETE_FILES)
+    self.register.side_effect = [Exception('database is locked'), Exception('database is locked'), None]
+
+    with mock.patch('api.scripts.pointcloud_watcher.time.monotonic', return_value=1000) as monotonic:
+      watcher.poll()
+      for now, calls in [(1000, 1), (1004, 1), (1005, 2), (1014, 2), (1015, 3)]:
+        monotonic.return_value = now
+        watcher.register_settled()
+        # Not tried again before 5 s, then 10 s
+        self.assertEqual(self.register.call_count, calls, now)
+
+    self.assertEqual(watcher.registered, {'spot20230813142200'})
+    self.assertEqual((watcher.failures, watcher.changes), (0, {}))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Tests for potree_octree script"""
+
+# Imports
+import os
+import json
+import tempfile
+
+import numpy as np
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.pointcloud_compressor import PointcloudCompressor, HIERARCHY_RECORD
+from api.scripts.potree_octree import PotreeOctree
+
+ATTRIBUTES = [
+  {'name': 'position', 'size': 12, 'numElements': 3, 'elementSize': 4, 'type': 'int32', 'min': [0, 0, 0], 'max': [16, 16, 16]},
+  {'name': 'rgb', 'size': 6, 'numElements': 3, 'elementSize': 2, 'type': 'uint16'},
+  {'name': 'intensity', 'size': 2, 'numElements': 1, 'elementSize': 2, 'type': 'uint16'},
+]
+DTYPE = np.dtype([('xyz', '<i4', (3,)), ('rgb', '<u2', (3,)), ('intensity', '<u2')])
+
+def make_octree(potree_dir):
+  """
+  Writes a Potree octree of the 16 m cube at a scale of 1 cm: a root with 100 points anywhere, its children of the
+    lowest octant (behind a proxy) and of the highest octant, and the lowest child of the latter, 100 points each.
+
+      Returns:
+          points (np.ndarray): Points of the nodes, of dtype DTYPE, in the order of octree.bin
+  """
+  os.makedirs(potree_dir, exist_ok=True)
+  random = np.random.default_rng(0)
+  nodes = []
+  for low, high in [(0, 1600), (0, 800), (800, 1600), (800, 1200)]:
+    points = np.zeros(100, dtype=DTYPE)
+    points['xyz'] = random.integers(low, high, size=(100, 3))
+    points['rgb'] = random.integers(0, 2**16, size=(100, 3))
+    points['intensity'] = random.integers(0, 2**16, size=100)
+    nodes.append(points)
+  with open(os.path.join(potree_dir, 'octree.bin'), 'wb') as f:
+    f.write(b''.join(points.tobytes() for points in nodes))
+  size = 100 * DTYPE.itemsize
+  hierarchy = np.zeros(5, dtype=HIERARCHY_RECORD)
+  hierarchy[0] = (0, 0b10000001, 100, 0, size)
+  hierarchy[1] = (2, 0, 100, 4 * HIERARCHY_RECORD.itemsize, HIERARCHY_RECORD.itemsize)
+  hierarchy[2] = (0, 0b1, 100, 2 * size, size)
+  hierarchy[3] = (1, 0, 100, 3 * size, size)
+  hierarchy[4] = (1, 0, 100, size, size)
+  with open(os.path.join(potree_dir, 'hierarchy.bin'), 'wb') as f:
+    f.write(hierarchy.tobytes())
+  with open(os.path.join(potree_dir, 'metadata.json'), 'w') as f:
+    json.dump({'version': '2.0', 'points': 400, 'encoding': 'DEFAULT', 'attributes': ATTRIBUTES, 'scale': [0.01] * 3,
+               'offset': [0, 0, 0], 'boundingBox': {'min': [0, 0, 0], 'max': [16, 16, 16]},
+               'hierarchy': {'firstChunkSize': 4 * HIERARCHY_RECORD.itemsize, 'stepSize': 1, 'depth': 2}}, f)
+  return np.concatenate(nodes)
+
+class TestPotreeOctree(TestCase):
+
+  def setUp(self):
+    self.data_dir = tempfile.TemporaryDirectory()
+    self.potree_dir = os.path.join(self.data_dir.name, 'spot20230813142200', 'pointclouds', 'spot')
+    self.points = make_octree(self.potree_dir)
+
+  def tearDown(self):
+    self.data_dir.cleanup()
+
+  def _records(self, points):
+    return sorted(point.tobytes() for point in points)
+
+  def _in_box(self, points, box):
+    coordinates = points['xyz'] * 0.01
+    return self._records(points[np.all((coordinates >= box[0]) & (coordinates <= box[1]), axis=1)])
+
+  def test_nodes_are_walked_level_by_level(self):
+    with PotreeOctree(self.potree_dir) as octree:
+      nodes = list(octree.nodes())
+
+      self.assertEqual([(node.index, node.level) for node in nodes], [(0, 0), (4, 1), (2, 1), (3, 2)])
+      self.assertEqual(nodes[1].max.tolist(), [8, 8, 8])
+      self.assertEqual((nodes[3].min.tolist(), nodes[3].max.tolist()), ([8, 8, 8], [12, 12, 12]))
+      self.assertEqual([node.index for node in octree.nodes(max_level=0)], [0])
+      # The subtree of the highest octant is not walked for a box in the lowest one
+      self.assertEqual([node.index for node in octree.nodes(box=(np.array([1, 1, 1]), np.array([2, 2, 2])))], [0, 4])
+
+  def test_points_in_a_box(self):
+    box = (np.array([2, 2, 2]), np.array([9, 10, 11]))
+
+    for compress in [False, True]:
+      if compress:
+        PointcloudCompressor(self.data_dir.name, workers=1).compress('spot20230813142200')
+      with PotreeOctree(self.potree_dir) as octree:
+        self.assertEqual(octree.count(), 400)
+        self.assertEqual(octree.count(box), len(self._in_box(self.points, box)))
+        self.assertEqual(self._records(np.concatenate(list(octree.points(box)))), self._in_box(self.points, box))
+        # Up to the root level, the coarsest points only
+        self.assertEqual(octree.count(box, max_level=0), len(self._in_box(self.points[:100], box)))
+        self.assertEqual(self._records(np.concatenate(list(octree.points(box, max_level=0)))), self._in_box(self.points[:100], box))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Tests for robot_session_pool script"""
+
+# Imports
+import mock
+import threading
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.robot_session_pool import RobotSessionPool
+
+class TestRobotSessionPool(TestCase):
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_session_is_reused(self, mock_create_standard_sdk):
+    mock_robot = mock_create_standard_sdk.return_value.create_robot.return_value
+    pool = RobotSessionPool()
+
+    first = pool.get('10.0.0.3', guid='guid', secret='secret')
+    second = pool.get('10.0.0.3', guid='guid', secret='secret')
+
+    self.assertIs(first, second)
+    mock_create_standard_sdk.assert_called_once()
+    mock_robot.authenticate_from_payload_credentials.assert_called_once_with('guid', 'secret')
+    mock_robot.sync_with_directory.assert_called_once()
+    mock_robot.start_time_sync.assert_called_once()
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_sessions_are_keyed_by_credentials(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+
+    payload_session = pool.get('10.0.0.3', guid='guid', secret='secret')
+    user_session = pool.get('10.0.0.3', username='user', password='password')
+    other_robot_session = pool.get('10.0.0.4', guid='guid', secret='secret')
+
+    self.assertIsNot(payload_session, user_session)
+    self.assertIsNot(payload_session, other_robot_session)
+    user_session.robot.authenticate.assert_called_with('user', 'password')
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_clients_are_cached(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+    session = pool.get('10.0.0.3', guid='guid', secret='secret')
+
+    first = session.ensure_client('image')
+    second = session.ensure_client('image')
+
+    self.assertIs(first, second)
+    session.robot.ensure_client.assert_called_once_with('image')
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_invalidate(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+    session = pool.get('10.0.0.3', guid='guid', secret='secret')
+
+    pool.invalidate(session)
+
+    session.robot._shutdown.assert_called_once()
+    self.assertEqual(pool.sessions, {})
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_invalidated_session_is_closed_by_its_last_user(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+    session = pool.get('10.0.0.3', guid='guid', secret='secret')
+    self.assertIs(pool.get('10.0.0.3', guid='guid', secret='secret'), session)
+
+    pool.invalidate(session)
+
+    # Still used by the other caller, the next ones get a new session
+    session.robot._shutdown.assert_not_called()
+    self.assertIsNot(pool.get('10.0.0.3', guid='guid', secret='secret'), session)
+    pool.release(session)
+    session.robot._shutdown.assert_called_once()
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_released_session_stays_pooled(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+    session = pool.get('10.0.0.3', guid='guid', secret='secret')
+
+    pool.release(session)
+
+    session.robot._shutdown.assert_not_called()
+    self.assertIs(pool.get('10.0.0.3', guid='guid', secret='secret'), session)
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_custom_port_and_certificate(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+
+    session = pool.get('127.0.0.1', guid='guid', secret='secret', port='50443', cert='/tmp/stand-in.crt')
+
+    mock_create_standard_sdk.return_value.load_robot_cert.assert_called_once_with('/tmp/stand-in.crt')
+    session.robot.update_secure_channel_port.assert_called_once_with(50443)
+    self.assertIsNot(session, pool.get('127.0.0.1', guid='guid', secret='secret'))
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_slow_robot_does_not_block_other_sessions(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+    started, release = threading.Event(), threading.Event()
+    def authenticate(guid, secret):
+      if guid == 'slow':
+        started.set()
+        release.wait(5)
+    mock_create_standard_sdk.return_value.create_robot.return_value.authenticate_from_payload_credentials.side_effect = authenticate
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(pool.get('10.0.0.3', guid='slow', secret='secret'))) for _ in range(3)]
+    threads[0].start()
+    self.assertTrue(started.wait(5))
+    for thread in threads[1:]:
+      thread.start()
+
+    # Created while the first session is still authenticating
+    pool.get('10.0.0.4', guid='guid', secret='secret')
+    self.assertEqual(sessions, [])
+    release.set()
+    for thread in threads:
+      thread.join(5)
+
+    # The callers of the slow session waited for the one being created
+    self.assertEqual(len(sessions), 3)
+    self.assertTrue(all(session is sessions[0] for session in sessions))
+    self.assertEqual(sessions[0].users, 3)
+    self.assertEqual(mock_create_standard_sdk.call_count, 2)
+
+  @mock.patch('api.scripts.robot_session_pool.bosdyn.client.create_standard_sdk')
+  def test_session_creation_error(self, mock_create_standard_sdk):
+    pool = RobotSessionPool()
+    mock_create_standard_sdk.return_value.create_robot.return_value.authenticate_from_payload_credentials.side_effect = [RuntimeError('unreachable'), None]
+
+    with self.assertRaises(RuntimeError):
+      pool.get('10.0.0.3', guid='guid', secret='secret')
+
+    # Not left pending, the next caller tries again
+    self.assertEqual(pool.sessions, {})
+    self.assertEqual(pool.get('10.0.0.3', guid='guid', secret='secret').users, 1)
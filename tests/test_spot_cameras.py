@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""Tests for spot_cameras script"""
+
+# Imports
+import asyncio
+import mock
+import threading
+import numpy as np
+import cv2 as cv
+
+## Boston Dynamics
+from bosdyn.api import image_pb2
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+from api.scripts.spot_cameras import SpotCameras, SpotCamerasMosaic, SpotCamerasBroadcaster, MOSAIC_SOURCES, CaptureLimitError, broadcaster, gen, agen, wsgen, rotate, encode_variant, WS_FRAME_HEADER
+
+def make_image_response(source_name, data, image_format, rows=0, cols=0, pixel_format=image_pb2.Image.PIXEL_FORMAT_RGB_U8):
+  image_response = image_pb2.ImageResponse()
+  image_response.source.name = source_name
+  image_response.shot.image.data = data
+  image_response.shot.image.format = image_format
+  image_response.shot.image.pixel_format = pixel_format
+  image_response.shot.image.rows = rows
+  image_response.shot.image.cols = cols
+  return image_response
+
+class TestSpotCameras(TestCase):
+
+  def _make_camera(self, image_response):
+    image_client = mock.Mock()
+    image_client.get_image_from_sources.return_value = [image_response]
+    return SpotCameras(image_response.source.name, image_client, capture=False)
+
+  def test_jpeg_is_forwarded_untouched(self):
+    jpeg = b'\xff\xd8robot jpeg\xff\xd9'
+    camera = self._make_camera(make_image_response('back_fisheye_image', jpeg, image_pb2.Image.FORMAT_JPEG))
+
+    self.assertIsNone(camera.frame)
+    self.assertEqual(camera.get_frame(), jpeg)
+
+  def test_raw_image_is_rotated(self):
+    img = np.arange(2 * 3 * 3, dtype=np.uint8).reshape((2, 3, 3))
+    camera = self._make_camera(make_image_response('frontleft_fisheye_image', img.tobytes(), image_pb2.Image.FORMAT_RAW, rows=2, cols=3))
+
+    np.testing.assert_array_equal(camera.frame, np.rot90(img, -1))
+    self.assertEqual(cv.imdecode(np.frombuffer(camera.get_frame(), np.uint8), -1).shape, (3, 2, 3))
+
+  def test_frames_are_sequenced(self):
+    jpeg = b'\xff\xd8robot jpeg\xff\xd9'
+    camera = self._make_camera(make_image_response('back_fisheye_image', jpeg, image_pb2.Image.FORMAT_JPEG))
+
+    self.assertEqual(camera.wait_for_frame(0), (1, jpeg))
+    camera.encode()
+    self.assertEqual(camera.wait_for_frame(1), (2, jpeg))
+
+    camera.stop()
+    self.assertEqual(camera.wait_for_frame(2), (2, False))
+
+  def test_variants_are_encoded_once_per_frame(self):
+    img = np.random.randint(0, 255, (40, 60, 3)).astype(np.uint8)
+    _, jpeg = cv.imencode('.jpg', img)
+    camera = self._make_camera(make_image_response('back_fisheye_image', jpeg.tobytes(), image_pb2.Image.FORMAT_JPEG))
+
+    with mock.patch('api.scripts.spot_cameras.encode_variant', wraps=encode_variant) as mock_encode_variant:
+      self.assertEqual(camera.get_variant(), (1, jpeg.tobytes()))
+      frame_seq, webp = camera.get_variant(30, 50, 'webp')
+      self.assertEqual(camera.get_variant(30, 50, 'webp'), (frame_seq, webp))
+      mock_encode_variant.assert_called_once()
+
+      camera.encode()
+      self.assertEqual(camera.get_variant(30, 50, 'webp')[0], 2)
+      self.assertEqual(mock_encode_variant.call_count, 2)
+    self.assertEqual(cv.imdecode(np.frombuffer(webp, np.uint8), -1).shape, (20, 30, 3))
+    self.assertNotIn((1, 30, 50, 'webp'), camera.variants)
+
+  def test_encode_variant_does_not_upscale(self):
+    img = np.zeros((40, 60, 3), dtype=np.uint8)
+
+    self.assertEqual(cv.imdecode(np.frombuffer(encode_variant(img, width=120), np.uint8), -1).shape, (40, 60, 3))
+
+  def test_capture_period(self):
+    camera = self._make_camera(make_image_response('back_fisheye_image', b'', image_pb2.Image.FORMAT_JPEG))
+
+    camera.fps_caps = [5, 10]
+    self.assertEqual(camera.capture_period(), 0.1)
+    camera.fps_caps = [5, None]
+    self.assertEqual(camera.capture_period(), 0)
+
+  def test_rotate_multiples_of_90_degrees(self):
+    img = np.random.randint(0, 255, (4, 6, 3)).astype(np.uint8)
+
+    for angle in [-90, 0, 90, 180, 270]:
+      np.testing.assert_array_equal(rotate(img, angle), np.rot90(img, angle // 90))
+
+class TestSpotCamerasMosaic(TestCase):
+
+  def test_body_cameras_are_fetched_in_one_request(self):
+    img = np.full((480, 640), 255, dtype=np.uint8)
+    responses = []
+    for source in MOSAIC_SOURCES:
+      image_response = make_image_response(source, img.tobytes(), image_pb2.Image.FORMAT_RAW, rows=480, cols=640,
+                                           pixel_format=image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8)
+      image_response.status = image_pb2.ImageResponse.STATUS_OK
+      responses.append(image_response)
+    image_client = mock.Mock()
+    image_client.get_image_from_sources.return_value = responses
+
+    with mock.patch('api.scripts.spot_cameras.threading.Thread'):
+      camera = SpotCamerasMosaic(image_client, tile_size=100)
+
+    image_client.get_image_from_sources.assert_called_once_with(MOSAIC_SOURCES)
+    self.assertEqual(camera.frame.shape, (200, 300, 3))
+    # frontleft is rotated to portrait and centered in the first tile
+    self.assertEqual(camera.frame[50, 5, 0], 0)
+    self.assertEqual(camera.frame[50, 50, 0], 255)
+    # the sixth tile is left empty
+    self.assertEqual(camera.frame[150, 250, 0], 0)
+
+class TestSpotCamerasBroadcaster(TestCase):
+
+  def _make_camera(self, camera_request):
+    camera = mock.Mock()
+    camera.camera_request = camera_request
+    camera.subscribers = 0
+    camera.fps_caps = []
+    camera.updating = True
+    return camera
+
+  def test_subscribers_share_one_capture_loop(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=2)
+    factory = mock.Mock(side_effect=lambda: self._make_camera('frontleft_fisheye_image'))
+
+    first = helper.subscribe('frontleft_fisheye_image', factory)
+    second = helper.subscribe('frontleft_fisheye_image', factory)
+
+    factory.assert_called_once()
+    self.assertIs(first, second)
+    self.assertEqual(first.subscribers, 2)
+
+  def test_last_unsubscribe_stops_capture_loop(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=2)
+    camera = helper.subscribe('back_fisheye_image', lambda: self._make_camera('back_fisheye_image'))
+    helper.subscribe('back_fisheye_image', lambda: self._make_camera('back_fisheye_image'))
+
+    helper.unsubscribe(camera)
+    camera.stop.assert_not_called()
+    self.assertIn('back_fisheye_image', helper.cameras)
+
+    helper.unsubscribe(camera)
+    camera.stop.assert_called_once()
+    self.assertNotIn('back_fisheye_image', helper.cameras)
+
+  def test_capture_limit(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=1)
+    helper.subscribe('left_fisheye_image', lambda: self._make_camera('left_fisheye_image'))
+
+    with self.assertRaises(CaptureLimitError):
+      helper.subscribe('right_fisheye_image', lambda: self._make_camera('right_fisheye_image'))
+
+  def test_dead_capture_loop_is_replaced(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=1)
+    dead = helper.subscribe('left_fisheye_image', lambda: self._make_camera('left_fisheye_image'))
+    dead.updating = False
+
+    alive = helper.subscribe('left_fisheye_image', lambda: self._make_camera('left_fisheye_image'))
+
+    self.assertIsNot(dead, alive)
+    self.assertIs(helper.cameras['left_fisheye_image'], alive)
+
+  def test_slow_camera_does_not_block_other_cameras(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=2)
+    connecting, connected = threading.Event(), threading.Event()
+    def slow_factory():
+      connecting.set()
+      connected.wait(5)
+      return self._make_camera('left_fisheye_image')
+    results = []
+    slow = threading.Thread(target=lambda: results.append(helper.subscribe('left_fisheye_image', slow_factory)))
+    waiting = threading.Thread(target=lambda: results.append(helper.subscribe('left_fisheye_image', slow_factory)))
+    slow.start()
+    self.assertTrue(connecting.wait(5))
+    waiting.start()
+
+    # Another camera and its viewers are served while the first one connects
+    right = helper.subscribe('right_fisheye_image', lambda: self._make_camera('right_fisheye_image'))
+    helper.unsubscribe(right)
+    right.stop.assert_called_once()
+
+    connected.set()
+    slow.join(5)
+    waiting.join(5)
+    self.assertIs(results[0], results[1])
+    self.assertEqual(results[0].subscribers, 2)
+    self.assertIs(helper.cameras['left_fisheye_image'], results[0])
+
+  def test_camera_factory_error(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=1)
+
+    with self.assertRaises(ConnectionError):
+      helper.subscribe('left_fisheye_image', mock.Mock(side_effect=ConnectionError))
+
+    # The placeholder is removed, the camera can be started again
+    self.assertNotIn('left_fisheye_image', helper.cameras)
+    camera = helper.subscribe('left_fisheye_image', lambda: self._make_camera('left_fisheye_image'))
+    self.assertEqual(camera.subscribers, 1)
+
+  def test_fps_caps(self):
+    helper = SpotCamerasBroadcaster(max_capture_threads=1)
+    camera = helper.subscribe('left_fisheye_image', lambda: self._make_camera('left_fisheye_image'), fps=5)
+    helper.subscribe('left_fisheye_image', lambda: self._make_camera('left_fisheye_image'), fps=10)
+    self.assertEqual(camera.fps_caps, [5, 10])
+
+    helper.unsubscribe(camera, fps=10)
+    self.assertEqual(camera.fps_caps, [5])
+
+  @mock.patch.object(broadcaster, 'unsubscribe')
+  def test_gen_releases_subscription(self, mock_unsubscribe):
+    camera = mock.Mock()
+    camera.wait_for_frame.side_effect = [(1, b'jpeg'), (1, False)]
+
+    frames = list(gen(camera, fps=5))
+
+    self.assertEqual(frames, [b'--frame\r\nContent-Type: image/jpeg\r\n\r\njpeg\r\n\r\n'])
+    camera.wait_for_frame.assert_has_calls([mock.call(0), mock.call(1)])
+    mock_unsubscribe.assert_called_once_with(camera, 5)
+
+  @mock.patch.object(broadcaster, 'unsubscribe')
+  def test_gen_sends_requested_variant(self, mock_unsubscribe):
+    camera = mock.Mock()
+    camera.wait_for_frame.side_effect = [(1, b'jpeg'), (1, False)]
+    camera.get_variant.return_value = (1, b'webp')
+
+    frames = list(gen(camera, width=320, image_format='webp'))
+
+    self.assertEqual(frames, [b'--frame\r\nContent-Type: image/webp\r\n\r\nwebp\r\n\r\n'])
+    camera.get_variant.assert_called_once_with(320, None, 'webp')
+
+  @mock.patch.object(broadcaster, 'unsubscribe')
+  def test_agen_stops_on_disconnect(self, mock_unsubscribe):
+    camera = mock.Mock()
+    disconnected = asyncio.Event()
+
+    async def wait_for_frame_async(last_seq):
+      if last_seq == 1:
+        disconnected.set()
+        return (last_seq, None)
+      return (1, b'jpeg')
+    camera.wait_for_frame_async.side_effect = wait_for_frame_async
+
+    async def consume():
+      return [frame async for frame in agen(camera, disconnected=disconnected)]
+
+    frames = asyncio.run(consume())
+
+    self.assertEqual(frames, [b'--frame\r\nContent-Type: image/jpeg\r\n\r\njpeg\r\n\r\n'])
+    mock_unsubscribe.assert_called_once_with(camera, None)
+
+  @mock.patch.object(broadcaster, 'unsubscribe')
+  def test_agen_closed_by_the_server_releases_subscription(self, mock_unsubscribe):
+    camera = mock.Mock()
+    camera.wait_for_frame_async = mock.AsyncMock(return_value=(1, b'jpeg'))
+
+    async def first_frame():
+      frames = agen(camera, fps=5)
+      frame = await frames.__anext__()
+      # As when the client disconnects mid-stream
+      await frames.aclose()
+      return frame
+
+    self.assertEqual(asyncio.run(first_frame()), b'--frame\r\nContent-Type: image/jpeg\r\n\r\njpeg\r\n\r\n')
+    mock_unsubscribe.assert_called_once_with(camera, 5)
+
+  @mock.patch.object(broadcaster, 'unsubscribe')
+  def test_wsgen_skips_frames_already_sent(self, mock_unsubscribe):
+    camera = mock.Mock()
+    camera.camera_request = 'back_fisheye_image'
+    camera.wait_for_frame_async = mock.AsyncMock(side_effect=[(1, b'jpeg', 1700000000.5), (2, b'jpeg', 1700000001.5), (2, False, 1700000001.5)])
+    # The variant of the first frame is already that of the second one, sent again by the next wait
+    camera.get_variant.side_effect = [(2, b'webp', 1700000001.5), (2, b'webp', 1700000001.5)]
+
+    async def consume():
+      return [message async for message in wsgen(camera, image_format='webp')]
+
+    messages = asyncio.run(consume())
+
+    self.assertEqual(len(messages), 1)
+    header = WS_FRAME_HEADER.unpack_from(messages[0])
+    self.assertEqual(header, (2, 1700000001.5, len('back_fisheye_image')))
+    self.assertEqual(messages[0][WS_FRAME_HEADER.size:], b'back_fisheye_imagewebp')
+    mock_unsubscribe.assert_called_once_with(camera, None)
+
+  @mock.patch.object(broadcaster, 'unsubscribe')
+  def test_wsgen_sends_frames_slower_to_encode_than_captured(self, mock_unsubscribe):
+    _, jpeg = cv.imencode('.jpg', np.random.randint(0, 255, (40, 60, 3)).astype(np.uint8))
+    image_client = mock.Mock()
+    image_client.get_image_from_sources.return_value = [make_image_response('back_fisheye_image', jpeg.tobytes(), image_pb2.Image.FORMAT_JPEG)]
+    camera = SpotCameras('back_fisheye_image', image_client, capture=False)
+    disconnected = asyncio.Event()
+
+    def slow_encode_variant(*args):
+      # A new frame is captured during each encoding
+      camera.encode()
+      return b'webp'
+
+    async def consume():
+      messages = []
+      async for message in wsgen(camera, disconnected=disconnected, image_format='webp'):
+        messages.append(message)
+        if len(messages) == 3:
+          disconnected.set()
+      return messages
+
+    with mock.patch('api.scripts.spot_cameras.encode_variant', side_effect=slow_encode_variant):
+      messages = asyncio.run(consume())
+
+    self.assertEqual([WS_FRAME_HEADER.unpack_from(message)[0] for message in messages], [1, 2, 3])
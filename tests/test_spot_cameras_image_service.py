@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Tests for the spot_cameras_image_service of the SpotCameras service"""
+
+# Imports
+import os
+import sys
+import time
+import struct
+import threading
+import mock
+import numpy as np
+import cv2
+
+## Boston Dynamics
+from bosdyn.api import image_pb2
+
+## Django
+from django.test import TestCase
+
+## Local Imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'spot-services', 'SpotCameras'))
+import spot_cameras_image_service
+from benchmark_spot_cameras_image_service import LocalRobot
+from spot_cameras_image_service import EncodeCache, SpotCameras, CapturedFrame, VirtualSource, has_huffman_tables, parse_virtual_source
+
+class FakeCapture(object):
+  """
+  Stand-in for cv2.VideoCapture, delivering the same frame at about 100 fps.
+  """
+  def __init__(self, device_name, jpeg=None):
+    self.image = np.full((48, 64, 3), 128, dtype=np.uint8)
+    self.jpeg = jpeg
+
+  def isOpened(self):
+    return True
+
+  def set(self, prop, value):
+    return self.jpeg is not None
+
+  def get(self, prop):
+    return {cv2.CAP_PROP_FRAME_HEIGHT: 48, cv2.CAP_PROP_FRAME_WIDTH: 64}.get(prop, 0)
+
+  def read(self):
+    time.sleep(0.01)
+    if self.jpeg is not None:
+      return True, np.frombuffer(self.jpeg, dtype=np.uint8).reshape(1, -1)
+    return True, self.image
+
+  def release(self):
+    pass
+
+def make_camera(jpeg=None, **kwargs):
+  with mock.patch.object(spot_cameras_image_service.cv2, 'VideoCapture', lambda device_name: FakeCapture(device_name, jpeg)):
+    return SpotCameras('0', **kwargs)
+
+def make_servicer(device_names, virtual_sources=()):
+  with mock.patch.object(spot_cameras_image_service.cv2, 'VideoCapture', FakeCapture):
+    return spot_cameras_image_service.make_spot_cameras_image_service(LocalRobot(), 'test-image-service', device_names,
+                                                                      virtual_sources=virtual_sources)
+
+def stop_servicer(servicer):
+  for camera in servicer.spot_cameras:
+    camera.stop_capturing()
+  servicer.executor.shutdown()
+
+def strip_huffman_tables(jpeg):
+  """
+  Removes the DHT segments of a JPEG, as some UVC devices send their MJPEG frames.
+  """
+  stripped, offset = jpeg[:2], 2
+  while jpeg[offset:offset + 2] != b'\xff\xda':
+    length, = struct.unpack_from('>H', jpeg, offset + 2)
+    if jpeg[offset:offset + 2] != b'\xff\xc4':
+      stripped += jpeg[offset:offset + 2 + length]
+    offset += 2 + length
+  return stripped + jpeg[offset:]
+
+class TestEncodeCache(TestCase):
+
+  def test_hits_and_misses(self):
+    cache = EncodeCache('video0', size=2, log_period=0)
+    create = mock.Mock(side_effect=lambda: object())
+
+    first = cache.get_or_create((1, 'jpeg'), create)
+    self.assertIs(cache.get_or_create((1, 'jpeg'), create), first)
+    cache.get_or_create((1, 'raw'), create)
+
+    self.assertEqual(create.call_count, 2)
+    self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'entries': 2})
+
+  def test_least_recently_used_is_evicted(self):
+    cache = EncodeCache('video0', size=2, log_period=0)
+    for key in [1, 2, 1, 3]:
+      cache.get_or_create(key, lambda: key)
+
+    self.assertEqual(list(cache.entries), [1, 3])
+    cache.get_or_create(2, lambda: 2)
+    self.assertEqual(cache.stats(), {'hits': 1, 'misses': 4, 'entries': 2})
+
+  def test_concurrent_requests_share_one_encode(self):
+    cache = EncodeCache('video0', log_period=0)
+    started, release = threading.Event(), threading.Event()
+    def slow_encode():
+      started.set()
+      release.wait(5)
+      return 'encoded'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create('key', slow_encode))) for _ in range(4)]
+    threads[0].start()
+    self.assertTrue(started.wait(5))
+    for thread in threads[1:]:
+      thread.start()
+    release.set()
+    for thread in threads:
+      thread.join(5)
+
+    self.assertEqual(results, ['encoded'] * 4)
+    self.assertEqual(cache.stats(), {'hits': 3, 'misses': 1, 'entries': 1})
+
+  def test_new_frame_is_encoded_again(self):
+    camera = make_camera(resize_ratio=0.5, quality_percent=50)
+    try:
+      camera.stop_capturing()
+      image = np.full((48, 64, 3), 128, dtype=np.uint8)
+      request = image_pb2.ImageRequest(image_format=image_pb2.Image.FORMAT_JPEG)
+      encode = mock.Mock(wraps=camera.encode)
+      with mock.patch.object(camera, 'encode', encode):
+        for capture_id in [1, 1, 2]:
+          image_proto = image_pb2.Image()
+          camera.image_decode(CapturedFrame(capture_id, image), image_proto, request)
+          self.assertEqual((image_proto.rows, image_proto.cols), (24, 32))
+
+      # The second request of the first frame is a hit, the next frame a miss
+      self.assertEqual(encode.call_count, 2)
+      self.assertEqual(camera.encode_cache.stats(), {'hits': 1, 'misses': 2, 'entries': 2})
+    finally:
+      camera.stop_capturing()
+
+  def test_stats_of_the_servicer(self):
+    servicer = make_servicer(['0'], virtual_sources=['video0_small:0:resize_ratio=0.1'])
+    try:
+      request = image_pb2.GetImageRequest(image_requests=[image_pb2.ImageRequest(image_source_name=name) for name in ['video0', 'video0_small']])
+      servicer.GetImage(request, None)
+
+      # Both sources are encoded by the cache of their device
+      self.assertEqual(servicer.encode_cache_stats(), {'video0': {'hits': 0, 'misses': 2, 'entries': 2}})
+    finally:
+      stop_servicer(servicer)
+
+class TestJpegPassthrough(TestCase):
+
+  def setUp(self):
+    self.jpeg = cv2.imencode('.jpg', np.full((48, 64, 3), 128, dtype=np.uint8))[1].tobytes()
+
+  def _decode(self, jpeg, **request):
+    camera = make_camera(jpeg=jpeg, resize_ratio=0.5)
+    camera.stop_capturing()
+    image_proto = image_pb2.Image()
+    camera.image_decode(CapturedFrame(1, None, jpeg), image_proto, image_pb2.ImageRequest(**request))
+    return image_proto
+
+  def test_has_huffman_tables(self):
+    self.assertTrue(has_huffman_tables(self.jpeg))
+    self.assertFalse(has_huffman_tables(strip_huffman_tables(self.jpeg)))
+
+  def test_frames_with_huffman_tables_are_forwarded(self):
+    image_proto = self._decode(self.jpeg, image_format=image_pb2.Image.FORMAT_JPEG, resize_ratio=1.0)
+
+    self.assertEqual(image_proto.data, self.jpeg)
+    self.assertEqual((image_proto.rows, image_proto.cols), (48, 64))
+
+  def test_frames_without_huffman_tables_are_encoded_again(self):
+    jpeg = strip_huffman_tables(self.jpeg)
+
+    image_proto = self._decode(jpeg, image_format=image_pb2.Image.FORMAT_JPEG, resize_ratio=1.0)
+
+    self.assertNotEqual(image_proto.data, jpeg)
+    self.assertTrue(has_huffman_tables(image_proto.data))
+    self.assertEqual(cv2.imdecode(np.frombuffer(image_proto.data, np.uint8), cv2.IMREAD_COLOR).shape, (48, 64, 3))
+
+  def test_resized_or_converted_frames_are_encoded_again(self):
+    for request in [{'resize_ratio': 0.5}, {'resize_ratio': 1.0, 'pixel_format': image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8},
+                    {'resize_ratio': 1.0, 'image_format': image_pb2.Image.FORMAT_RAW}]:
+      self.assertNotEqual(self._decode(self.jpeg, **request).data, self.jpeg)
+
+class TestSpotCamerasImageServicer(TestCase):
+
+  def test_sources_are_fulfilled_in_parallel_in_request_order(self):
+    names = ['video0_a', 'video0_b', 'video0_c']
+    servicer = make_servicer([], virtual_sources=[f'{name}:0' for name in names])
+    decode = VirtualSource.image_decode
+    lock, in_flight, max_in_flight = threading.Lock(), [0], [0]
+    def slow_decode(source, image_data, image_proto, image_req):
+      with lock:
+        in_flight[0] += 1
+        max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+      # The first sources requested are the last ones done
+      time.sleep(0.05 * (len(names) - names.index(source.image_source_name)))
+      with lock:
+        in_flight[0] -= 1
+      decode(source, image_data, image_proto, image_req)
+    try:
+      request = image_pb2.GetImageRequest(image_requests=[image_pb2.ImageRequest(image_source_name=name) for name in names + ['unknown']])
+      with mock.patch.object(VirtualSource, 'image_decode', autospec=True, side_effect=slow_decode):
+        response = servicer.GetImage(request, None)
+
+      self.assertEqual([image_response.source.name for image_response in response.image_responses[:3]], names)
+      self.assertEqual([image_response.status for image_response in response.image_responses],
+                       [image_pb2.ImageResponse.STATUS_OK] * 3 + [image_pb2.ImageResponse.STATUS_UNKNOWN_CAMERA])
+      self.assertGreater(max_in_flight[0], 1)
+    finally:
+      stop_servicer(servicer)
+
+class TestVirtualSources(TestCase):
+
+  def test_parse_virtual_source(self):
+    self.assertEqual(parse_virtual_source('video99_thumbnail:99'), ('video99_thumbnail', '99', {}))
+    self.assertEqual(parse_virtual_source('video99_grey:/dev/video99:resize_ratio=0.1:quality_percent=40:pixel_format=greyscale_u8'),
+                     ('video99_grey', '/dev/video99', {'resize_ratio': 0.1, 'quality_percent': 40.0,
+                                                       'pixel_format': image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8}))
+
+  def test_parse_invalid_virtual_source(self):
+    for spec in ['video99', 'video99_grey:', ':99', 'video99_grey:99:gain=2', 'video99_grey:99:resize_ratio',
+                 'video99_grey:99:resize_ratio=small', 'video99_grey:99:pixel_format=CMYK']:
+      with self.assertRaises(ValueError, msg=spec):
+        parse_virtual_source(spec)
+
+  def test_virtual_sources_share_their_device(self):
+    with mock.patch.object(spot_cameras_image_service.cv2, 'VideoCapture', side_effect=FakeCapture) as video_capture:
+      servicer = spot_cameras_image_service.make_spot_cameras_image_service(
+        LocalRobot(), 'test-image-service', [], virtual_sources=['video0_small:0:resize_ratio=0.1', 'video0_grey:0:pixel_format=GREYSCALE_U8'])
+    try:
+      # Only the virtual sources are listed, over a single capture of the device
+      video_capture.assert_called_once_with(0)
+      self.assertEqual(sorted(servicer.image_sources_mapped), ['video0_grey', 'video0_small'])
+      request = image_pb2.GetImageRequest(image_requests=[image_pb2.ImageRequest(image_source_name='video0_small'),
+                                                          image_pb2.ImageRequest(image_source_name='video0_grey')])
+      small, grey = servicer.GetImage(request, None).image_responses
+      self.assertEqual((small.shot.image.rows, small.shot.image.cols), (4, 6))
+      self.assertEqual(grey.shot.image.pixel_format, image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8)
+    finally:
+      stop_servicer(servicer)
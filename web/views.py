@@ -51,6 +51,11 @@ class PointcloudIndex(APIView):
         Get the list of available Pointclouds
         """
         helper = AvailablePointcloudsHelper()
-        pointclouds = helper.list()
-        context = { 'pointclouds': pointclouds }
+        start, end = request.GET.get('start', ''), request.GET.get('end', '')
+        try:
+            pointclouds = helper.list(start, end, request.GET.get('page', 1))
+        except ValueError:
+            start, end = '', ''
+            pointclouds = helper.list(page=request.GET.get('page', 1))
+        context = { 'pointclouds': pointclouds['results'], 'page': pointclouds, 'start': start, 'end': end }
         return render(request, 'web/pointcloud_index.html', context)